@@ -14,8 +14,8 @@ app.config.from_object('config')
 
 celery = Celery(
     __name__,
-    broker="redis://redis:6379/0",
-    backend="redis://redis:6379/0"
+    broker=app.config["CELERY_BROKER_URL"],
+    backend=app.config["CELERY_RESULT_BACKEND"]
 )
 
 login_manager = LoginManager()
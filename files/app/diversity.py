@@ -0,0 +1,97 @@
+from app import app
+from math import comb
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+"""
+Diversity selection for keyword candidates
+Works on the precomputed, normalized candidate embedding matrix from the
+candidate pool so no similarity is computed twice
+
+Cost (n candidates, d dimensions, k keywords):
+    - 'mmr'     greedy Maximal Marginal Relevance, O(n*d*k) time and O(n) memory
+                each step updates a running max similarity with one
+                matrix-vector product instead of building the n*n matrix
+    - 'maxsum'  Max Sum Similarity over a capped pool, at most
+                KEYWORD_MAXSUM_COMBINATIONS combinations are scored, the pool is
+                shrunk until C(pool, k) fits, O(p*d + C(p,k)*k^2)
+"""
+
+def _scored(words, doc_similarity, selected):
+    keywords = [(words[i], round(float(doc_similarity[i]), 4)) for i in selected]
+    return sorted(keywords, key=lambda keyword: keyword[1], reverse=True)
+
+"""
+Greedy MMR
+1. Start with the candidate closest to the document
+2. Repeatedly add the candidate with the best trade-off between closeness
+   to the document and distance to the closest already selected keyword
+Returns (word, similarity) pairs, the same as keybert's mmr
+"""
+def mmr(doc_embedding, embeddings, words, top_n=10, diversity=0.5):
+    doc_similarity = embeddings @ doc_embedding.ravel()
+    k = min(top_n, len(words))
+    if k == 0:
+        return []
+    selected = [int(np.argmax(doc_similarity))]
+    closest = embeddings @ embeddings[selected[0]]
+    available = np.ones(len(words), dtype=bool)
+    available[selected[0]] = False
+    for _ in range(k - 1):
+        scores = (1 - diversity) * doc_similarity - diversity * closest
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(closest, embeddings @ embeddings[best], out=closest)
+    return _scored(words, doc_similarity, selected)
+
+"""
+Largest pool size whose top_n combinations fit in the budget
+"""
+def maxsum_pool(top_n, nr_candidates, max_combinations):
+    pool = nr_candidates
+    while pool > top_n and comb(pool, top_n) > max_combinations:
+        pool -= 1
+    return pool
+
+"""
+Capped Max Sum Similarity
+1. Take the candidates closest to the document, as many as the budget allows
+2. Score every top_n combination of them in vectorized batches
+3. Return the combination with the lowest total pairwise similarity
+"""
+def max_sum(doc_embedding, embeddings, words, top_n=10, nr_candidates=20, max_combinations=None, batch=4096):
+    from itertools import combinations, islice
+    max_combinations = max_combinations or app.config.get("KEYWORD_MAXSUM_COMBINATIONS", 20000)
+    doc_similarity = embeddings @ doc_embedding.ravel()
+    k = min(top_n, len(words))
+    if k == 0:
+        return []
+    pool = maxsum_pool(k, min(nr_candidates, len(words)), max_combinations)
+    if pool < nr_candidates:
+        logger.debug("Max sum pool capped at %d candidates for %d keywords", pool, k)
+    idx = np.argsort(-doc_similarity)[:pool]
+    similarity = embeddings[idx] @ embeddings[idx].T
+    best, best_sum = None, np.inf
+    combos = combinations(range(pool), k)
+    while True:
+        chunk = np.array(list(islice(combos, batch)), dtype=np.intp)
+        if len(chunk) == 0:
+            break
+        sums = similarity[chunk[:, :, None], chunk[:, None, :]].sum(axis=(1, 2))
+        i = int(np.argmin(sums))
+        if sums[i] < best_sum:
+            best, best_sum = chunk[i], sums[i]
+    return _scored(words, doc_similarity, idx[best])
+
+"""
+Select diverse keywords with the method in KEYWORD_DIVERSITY
+"""
+def select(doc_embedding, embeddings, words, top_n=10, diversity=0.5):
+    method = app.config.get("KEYWORD_DIVERSITY", "mmr")
+    if method == "maxsum":
+        return max_sum(doc_embedding, embeddings, words, top_n, app.config.get("KEYWORD_MAXSUM_CANDIDATES", 20))
+    return mmr(doc_embedding, embeddings, words, top_n, diversity)
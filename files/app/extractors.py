@@ -0,0 +1,123 @@
+from app import app, pipeline
+from nltk.stem import PorterStemmer
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+ps = PorterStemmer()
+
+"""
+Keyword extractors
+An extractor takes a stream of text pieces and the resource's headings
+and returns a list of keywords, None if there was no text or [] if it failed
+
+Available extractors:
+    - 'keybert' (sentence-transformer embeddings, needs the model)
+    - 'statistical' (term statistics only, no model, milliseconds per document)
+
+KEYWORD_EXTRACTOR picks the default, KEYWORD_EXTRACTOR_BY_TYPE overrides
+it per resource type e.g. {'transcript': 'statistical'}
+"""
+
+def keybert_extractor(pieces, headings=None):
+    return pipeline.keybert_exec(pieces)
+
+"""
+Statistical keyword extractor
+1. Count stopword filtered 1-2 gram candidates in each chunk
+2. Score each candidate with vectorized term statistics:
+    - log term frequency
+    - spread (fraction of chunks it appears in)
+    - position (candidates that appear early score higher)
+    - bigrams that repeat are preferred over their single words
+    - candidates sharing a stem with a markdown heading are boosted
+3. Merge candidates with the same stems, keeping the most frequent form
+4. Take the top scoring candidates, skipping ones covered by a better keyword
+"""
+def statistical_extractor(pieces, headings=None, top_n=10):
+    if isinstance(pieces, str):
+        pieces = [pieces]
+    try:
+        analyzer = pipeline.candidate_analyzer()
+        vocab = {}
+        ids = []
+        positions = []
+        chunks = 0
+        for chunk in pipeline.chunk_text(pieces):
+            for term in analyzer(chunk):
+                ids.append(vocab.setdefault(term, len(vocab)))
+                positions.append(chunks)
+            chunks += 1
+        if chunks == 0:
+            return None
+        if not vocab:
+            return []
+        terms = list(vocab)
+        ids = np.array(ids)
+        positions = np.array(positions)
+
+        tf = np.bincount(ids, minlength=len(terms)).astype(np.float64)
+        first = np.full(len(terms), chunks, dtype=np.float64)
+        np.minimum.at(first, ids, positions)
+        pairs = np.unique(ids * chunks + positions)
+        spread = np.bincount(pairs // chunks, minlength=len(terms)) / chunks
+        bigram = np.array([" " in term for term in terms])
+        numeric = np.array([term.replace(" ", "").isdigit() for term in terms])
+
+        scores = np.log1p(tf) * (1 + spread) / np.log2(2 + first)
+        scores[bigram & (tf >= 2)] *= 1.5
+        scores[bigram & (tf < 2)] *= 0.5
+        scores[numeric] = 0
+
+        stems = [" ".join(ps.stem(word) for word in term.split()) for term in terms]
+        if headings:
+            heading_stems = set(ps.stem(word.lower()) for heading in headings for word in heading.split())
+            boost = np.array([any(stem in heading_stems for stem in key.split()) for key in stems])
+            scores[boost] *= 2
+
+        # Merge stem equivalent candidates
+        best = {}
+        for i, key in enumerate(stems):
+            if key not in best or tf[i] > tf[best[key]]:
+                best[key] = i
+        merged = np.zeros(len(terms))
+        for i, key in enumerate(stems):
+            merged[best[key]] += scores[i]
+
+        keywords = []
+        covered = set()
+        for i in np.argsort(-merged):
+            if merged[i] <= 0 or len(keywords) == top_n:
+                break
+            key = set(stems[i].split())
+            if key <= covered:
+                continue
+            covered |= key
+            keywords.append(terms[i])
+        return keywords
+    except Exception:
+        logger.exception("Statistical keyword extraction failed")
+        return []
+
+EXTRACTORS = {
+    "keybert": keybert_extractor,
+    "statistical": statistical_extractor,
+}
+
+"""
+Get the name of the extractor configured for a resource type
+"""
+def name_for(resource_type):
+    by_type = app.config.get("KEYWORD_EXTRACTOR_BY_TYPE") or {}
+    name = by_type.get(resource_type) or app.config.get("KEYWORD_EXTRACTOR", "keybert")
+    if name not in EXTRACTORS:
+        logger.warning("Unknown keyword extractor %s, using keybert", name)
+        name = "keybert"
+    return name
+
+"""
+Check if any resource type is configured to use the keybert model
+"""
+def uses_model():
+    by_type = app.config.get("KEYWORD_EXTRACTOR_BY_TYPE") or {}
+    return app.config.get("KEYWORD_EXTRACTOR", "keybert") == "keybert" or "keybert" in by_type.values()
@@ -0,0 +1,244 @@
+from app import app, db, models
+from contextlib import contextmanager
+from urllib.parse import urlparse, unquote
+from requests.adapters import HTTPAdapter
+import requests
+import html2text
+import hashlib
+import html
+import logging
+import fcntl
+import json
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+"""
+Fetching url resource content
+All requests go through one pooled session per process with explicit
+connect/read timeouts (URL_FETCH_TIMEOUT)
+
+Disk cache (URL_CACHE_DIR), one json file per key:
+    - entries younger than URL_CACHE_TTL are used as they are
+    - older pages are revalidated, with If-None-Match/If-Modified-Since for
+      plain urls and the page's last revision id for Wikipedia articles
+    - a lock per key (or per Wikipedia batch) makes concurrent workers wait
+      for the first fetch instead of repeating it, so a url shared by many
+      groups is fetched once
+    - failed page fetches are cached for URL_FAILURE_TTL, so a dead page
+      isn't fetched again by every job
+
+Wikipedia articles are fetched in batches of titles (titles=A|B|C), and the
+titles of every queued url resource are fetched together with the first one
+"""
+WIKIPEDIA_BATCH = 50
+
+_session = None
+_session_pid = None
+
+def session():
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=app.config.get("URL_POOL_SIZE", 8))
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+        _session.headers["User-Agent"] = app.config.get("URL_USER_AGENT", "SmartNotes/1.0")
+        _session_pid = os.getpid()
+    return _session
+
+def timeout():
+    return app.config.get("URL_FETCH_TIMEOUT", (5, 20))
+
+def html_to_text(content):
+    h = html2text.HTML2Text()
+    h.ignore_links = True
+    h.ignore_images = True
+    return h.handle(content)
+
+def _path(key):
+    directory = app.config.get("URL_CACHE_DIR")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, hashlib.sha256(key.encode()).hexdigest())
+
+def cache_get(key):
+    if not app.config.get("URL_CACHE_DIR"):
+        return None
+    try:
+        with open(_path(key) + ".json", "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def cache_put(key, entry):
+    if not app.config.get("URL_CACHE_DIR"):
+        return entry
+    entry["fetched"] = time.time()
+    path = _path(key)
+    with open(path + ".tmp", "w") as f:
+        json.dump(entry, f)
+    os.replace(path + ".tmp", path + ".json")
+    return entry
+
+"""
+Is a cache entry recent enough to use as it is
+Failed fetches are cached too (failed is set) but only for URL_FAILURE_TTL
+"""
+def fresh(entry):
+    if entry is None:
+        return False
+    ttl = app.config.get("URL_FAILURE_TTL", 300) if entry.get("failed") else app.config.get("URL_CACHE_TTL", 86400)
+    return time.time() - entry.get("fetched", 0) < ttl
+
+@contextmanager
+def locked(key):
+    if not app.config.get("URL_CACHE_DIR"):
+        yield
+        return
+    with open(_path(key) + ".lock", "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+"""
+Get a url through the disk cache
+1. Return a fresh cached entry
+2. Else revalidate a stale entry with its ETag/Last-Modified, a 304 keeps it
+3. Else fetch the page and cache it with its validators
+Returns the cache entry ({"content", "etag", "last_modified", "status"})
+"""
+def get(url):
+    key = "url:" + url
+    entry = cache_get(key)
+    if fresh(entry):
+        return entry
+    with locked(key):
+        entry = cache_get(key)
+        if fresh(entry):
+            return entry
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        response = session().get(url, headers=headers, timeout=timeout())
+        if response.status_code == 304 and entry:
+            logger.info("Revalidated %s", url)
+            return cache_put(key, entry)
+        response.raise_for_status()
+        return cache_put(key, {
+            "url": url,
+            "status": response.status_code,
+            "content": response.text,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        })
+
+"""
+Get the article title from a Wikipedia url, None for other urls
+Urls are stored html escaped
+"""
+def wikipedia_title(url):
+    parsed = urlparse(html.unescape(url.strip()))
+    if not parsed.netloc.endswith("wikipedia.org"):
+        return None
+    title = unquote(parsed.path.rstrip("/").split("/")[-1])
+    return title.replace("_", " ") or None
+
+def _query(params):
+    params = dict(params, action="query", format="json")
+    response = session().get(app.config.get("WIKIPEDIA_API_URL", "https://en.wikipedia.org/w/api.php"), params=params, timeout=timeout())
+    response.raise_for_status()
+    return response.json()
+
+"""
+Run a title query, following continuations and resolving normalized
+titles and redirects
+Returns {requested title: page}, missing pages are left out
+"""
+def _pages(titles, params):
+    pages = {}
+    aliases = {}
+    extra = {}
+    for _ in range(len(titles) + 1):
+        data = _query(dict(params, titles="|".join(titles), redirects="true", **extra))
+        query = data.get("query", {})
+        for item in query.get("normalized", []) + query.get("redirects", []):
+            aliases[item["from"]] = item["to"]
+        for page in query.get("pages", {}).values():
+            if "missing" in page or "invalid" in page:
+                continue
+            merged = pages.setdefault(page["title"], {})
+            merged.update({k: v for k, v in page.items() if v is not None})
+        if "continue" not in data:
+            break
+        extra = data["continue"]
+    found = {}
+    for title in titles:
+        seen = set()
+        target = title
+        while target in aliases and target not in seen:
+            seen.add(target)
+            target = aliases[target]
+        if target in pages:
+            found[title] = pages[target]
+    return found
+
+"""
+Get the text of Wikipedia articles, fetching the titles that are not cached in batches
+1. Use fresh cache entries as they are
+2. Revalidate stale entries in one info query, an unchanged revision keeps its text
+3. Fetch extracts for the rest, WIKIPEDIA_BATCH titles per query
+Returns {title: text}, "" for missing articles
+"""
+def wikipedia(titles):
+    titles = list(dict.fromkeys(titles))
+    entries = {title: cache_get("wikipedia:" + title) for title in titles}
+    if all(fresh(entry) for entry in entries.values()):
+        return {title: entry["content"] for title, entry in entries.items()}
+    with locked("wikipedia"):
+        entries = {title: cache_get("wikipedia:" + title) for title in titles}
+        stale = [title for title, entry in entries.items() if entry is not None and not fresh(entry) and entry.get("revid")]
+        fetch = [title for title, entry in entries.items() if entry is None or (not fresh(entry) and not entry.get("revid"))]
+        for i in range(0, len(stale), WIKIPEDIA_BATCH):
+            batch = stale[i:i + WIKIPEDIA_BATCH]
+            pages = _pages(batch, {"prop": "info"})
+            for title in batch:
+                page = pages.get(title)
+                if page and page.get("lastrevid") == entries[title]["revid"]:
+                    entries[title] = cache_put("wikipedia:" + title, entries[title])
+                else:
+                    fetch.append(title)
+            logger.info("Revalidated %d Wikipedia articles", len(batch))
+        for i in range(0, len(fetch), WIKIPEDIA_BATCH):
+            batch = fetch[i:i + WIKIPEDIA_BATCH]
+            pages = _pages(batch, {"prop": "extracts|info"})
+            for title in batch:
+                page = pages.get(title, {})
+                entries[title] = cache_put("wikipedia:" + title, {
+                    "content": html_to_text(page["extract"]) if page.get("extract") else "",
+                    "revid": page.get("lastrevid"),
+                })
+            logger.info("Fetched %d Wikipedia articles in one batch", len(batch))
+    return {title: entry["content"] for title, entry in entries.items()}
+
+"""
+Fetch every queued url resource in one go
+Called before a url job is processed so a burst of url resources costs one
+batched Wikipedia query and one round of concurrent page fetches (when
+URL_FETCH_PAGES is set), the jobs that follow read from the cache
+"""
+def prefetch_queued():
+    from app import pagefetch
+    rows = db.session.query(models.Resource.data).join(models.Queue, models.Queue.resource == models.Resource.id) \
+        .filter(models.Resource.type == "url", models.Queue.state.in_(("queued", "running"))).all()
+    urls = [html.unescape(row[0].strip()) for row in rows]
+    titles = [title for title in (wikipedia_title(url) for url in urls) if title]
+    if titles:
+        wikipedia(titles)
+    pages = [url for url in urls if not wikipedia_title(url) and not fresh(cache_get("page:" + url))]
+    if pages and app.config.get("URL_FETCH_PAGES", False):
+        pagefetch.fetch_pages(pages)
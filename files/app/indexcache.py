@@ -0,0 +1,99 @@
+from app import app
+from collections import OrderedDict
+import threading
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+"""
+Per process cache of folder and group indexes for search
+A folder's postings are loaded once into an Index (see postings.py) and
+kept with the folder's index version (SearchTree.version), a search only reads
+the versions of its folders and answers from memory while they match
+Groups are cached the same way under ('group', id) with Group.index_version
+
+Every write to a folder's postings bumps its version in the same transaction,
+so a process never answers from an index older than the last commit it can see
+The version is read before the postings are loaded, a write in between makes
+the cached index look old and it is loaded again on the next search
+
+Entries are evicted least recently used first once the estimated size passes
+INDEX_CACHE_BYTES (0 disables the cache)
+"""
+# Rough CPython size of a term: its dict slot and key plus the numpy array header
+# of its postings, the postings themselves are counted by the array's nbytes
+TERM_BYTES = 232
+
+def estimate(index):
+    return index.nbytes
+
+class IndexCache:
+    def __init__(self, budget):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    """
+    Get the index of a key, ('folder', id) or ('group', id), at a version,
+    loading it with load() on a miss
+    """
+    def get(self, key, version, load):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        index = load()
+        size = estimate(index)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            if size <= self.budget:
+                self.entries[key] = (version, index, size)
+                self.bytes += size
+            while self.bytes > self.budget and self.entries:
+                _, (_, _, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+        return index
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "pid": os.getpid(),
+                "folders": sum(1 for kind, _ in self.entries if kind == "folder"),
+                "groups": sum(1 for kind, _ in self.entries if kind == "group"),
+                "bytes": self.bytes,
+                "budget": self.budget,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+_caches = {}
+
+def get_cache():
+    key = os.getpid()
+    budget = app.config.get("INDEX_CACHE_BYTES", 64 * 1024 * 1024)
+    if key not in _caches:
+        _caches[key] = IndexCache(budget)
+    _caches[key].budget = budget
+    return _caches[key]
+
+def stats():
+    return get_cache().stats()
@@ -0,0 +1,292 @@
+from app import app
+from keybert.backend import BaseEmbedder
+import numpy as np
+import logging
+import socket
+import socketserver
+import struct
+import threading
+import queue
+import json
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+"""
+Local inference server for keyword embeddings
+One process owns the sentence-transformer, pipeline workers send it
+embedding requests over a unix socket or localhost tcp
+Requests from all workers are collected and embedded together in one
+forward pass once the batch is full or the oldest request hits its deadline
+
+Wire format (both directions):
+    8 byte header: json length, payload length (big endian uint32)
+    json header
+    payload (float32 embeddings for responses, empty for requests)
+"""
+
+BATCH_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+WAIT_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+"""
+Fixed bucket histogram
+Each bucket counts observations less than or equal to its bound, the last
+count is for observations above every bound
+"""
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            i = 0
+            while i < len(self.bounds) and value > self.bounds[i]:
+                i += 1
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self.lock:
+            buckets = {str(bound): count for bound, count in zip(self.bounds, self.counts)}
+            buckets["inf"] = self.counts[-1]
+            return {"buckets": buckets, "count": self.count, "sum": round(self.sum, 3)}
+
+"""
+Parse an address from config
+"unix:///path/to.sock" -> (AF_UNIX, "/path/to.sock")
+"host:port" -> (AF_INET, (host, port))
+"""
+def parse_address(address):
+    if address.startswith("unix://"):
+        return socket.AF_UNIX, address[len("unix://"):]
+    host, port = address.rsplit(":", 1)
+    return socket.AF_INET, (host, int(port))
+
+def send_msg(sock, header, payload=b""):
+    data = json.dumps(header).encode()
+    sock.sendall(struct.pack(">II", len(data), len(payload)) + data + payload)
+
+def recv_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("Inference connection closed")
+        buf.extend(chunk)
+    return bytes(buf)
+
+def recv_msg(sock):
+    header_len, payload_len = struct.unpack(">II", recv_exact(sock, 8))
+    header = json.loads(recv_exact(sock, header_len))
+    payload = recv_exact(sock, payload_len) if payload_len else b""
+    return header, payload
+
+"""
+A single embedding request waiting in the batcher
+"""
+class _Pending:
+    def __init__(self, texts):
+        self.texts = texts
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+"""
+Micro-batcher
+Collects pending requests until max_batch texts are waiting or the first
+request has waited max_wait_ms, then runs embed_fn once over all of them
+"""
+class Batcher:
+    def __init__(self, embed_fn, max_batch=64, max_wait_ms=10):
+        self.embed_fn = embed_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.pending = queue.Queue()
+        self.batch_sizes = Histogram(BATCH_BUCKETS)
+        self.queue_wait_ms = Histogram(WAIT_BUCKETS_MS)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def submit(self, texts):
+        item = _Pending(texts)
+        self.pending.put(item)
+        item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def collect(self):
+        try:
+            first = self.pending.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        size = len(first.texts)
+        deadline = first.enqueued + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self.pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item.texts)
+        return batch
+
+    def run(self):
+        while self.running:
+            batch = self.collect()
+            if not batch:
+                continue
+            texts = []
+            now = time.perf_counter()
+            for item in batch:
+                texts.extend(item.texts)
+                self.queue_wait_ms.observe((now - item.enqueued) * 1000)
+            self.batch_sizes.observe(len(texts))
+            try:
+                embeddings = np.asarray(self.embed_fn(texts), dtype=np.float32)
+            except Exception as e:
+                logger.exception("Inference batch of %d texts failed", len(texts))
+                for item in batch:
+                    item.error = e
+                    item.done.set()
+                continue
+            start = 0
+            for item in batch:
+                item.result = embeddings[start:start + len(item.texts)]
+                start += len(item.texts)
+                item.done.set()
+
+    def stats(self):
+        return {
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_wait_ms": self.queue_wait_ms.snapshot(),
+            "pending": self.pending.qsize(),
+        }
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        batcher = self.server.batcher
+        while True:
+            try:
+                header, _ = recv_msg(self.request)
+            except (ConnectionError, struct.error):
+                return
+            op = header.get("op")
+            if op == "embed":
+                try:
+                    result = batcher.submit(header.get("texts", []))
+                except Exception as e:
+                    send_msg(self.request, {"error": str(e)})
+                    continue
+                send_msg(self.request, {"shape": list(result.shape), "dtype": "float32"}, result.tobytes())
+            elif op == "stats":
+                send_msg(self.request, batcher.stats())
+            else:
+                send_msg(self.request, {"error": "Unknown op"})
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+"""
+Create (but don't start) an inference server
+embed_fn defaults to the registry's sentence-transformer
+"""
+def create_server(address=None, embed_fn=None, max_batch=None, max_wait_ms=None):
+    address = address or app.config.get("INFERENCE_ADDRESS") or "127.0.0.1:5001"
+    if embed_fn is None:
+        from app import registry
+        embed_fn = registry.load_local_model().model.embed
+    batcher = Batcher(
+        embed_fn,
+        max_batch=max_batch or app.config.get("INFERENCE_MAX_BATCH", 64),
+        max_wait_ms=max_wait_ms if max_wait_ms is not None else app.config.get("INFERENCE_MAX_WAIT_MS", 10),
+    )
+    family, addr = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(addr):
+            os.remove(addr)
+        server = _UnixServer(addr, _Handler)
+    else:
+        server = _TCPServer(addr, _Handler)
+    server.batcher = batcher
+    batcher.start()
+    return server
+
+def serve(address=None):
+    server = create_server(address)
+    logger.info("Inference server listening on %s", address or app.config.get("INFERENCE_ADDRESS"))
+    try:
+        server.serve_forever()
+    finally:
+        server.batcher.stop()
+        server.server_close()
+
+"""
+Client side embedder used by KeyBERT in the pipeline workers
+Keeps one connection per thread and reconnects on failure
+"""
+class RemoteEmbedder(BaseEmbedder):
+    def __init__(self, address, timeout=60):
+        super().__init__()
+        self.address = address
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def connect(self):
+        family, addr = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(addr)
+        self.local.sock = sock
+        return sock
+
+    def request(self, header):
+        sock = getattr(self.local, "sock", None)
+        for attempt in range(2):
+            try:
+                if sock is None:
+                    sock = self.connect()
+                send_msg(sock, header)
+                return recv_msg(sock)
+            except (OSError, ConnectionError):
+                if sock is not None:
+                    sock.close()
+                sock = None
+                self.local.sock = None
+                if attempt == 1:
+                    raise
+
+    def embed(self, documents, verbose=False):
+        documents = [str(doc) for doc in documents]
+        if not documents:
+            return np.zeros((0, 0), dtype=np.float32)
+        header, payload = self.request({"op": "embed", "texts": documents})
+        if "error" in header:
+            raise RuntimeError(header["error"])
+        return np.frombuffer(payload, dtype=np.float32).reshape(header["shape"])
+
+    def stats(self):
+        header, _ = self.request({"op": "stats"})
+        return header
@@ -0,0 +1,309 @@
+from app import app, db, models
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_, update, func
+import logging
+import threading
+import socket
+import os
+
+logger = logging.getLogger(__name__)
+
+"""
+Leased job queue for keyword generation
+Jobs are rows in the Queue table
+States:
+    - 'queued'  waiting to be claimed
+    - 'running' claimed by a worker, lease_expires must keep moving forward
+    - 'done'    finished, deleted after JOB_DONE_RETENTION_HOURS
+    - 'dead'    failed too many times, kept for inspection in the admin panel
+A failed job goes back to queued with an exponential backoff (available_at)
+until it has used JOB_MAX_ATTEMPTS attempts, then it is dead lettered
+A worker claims a job with a conditional update, only one worker can win
+the update for a given row so N workers always get distinct jobs (this also
+holds on SQLite where the update takes the database write lock)
+A running job whose lease has expired is treated as claimable again
+
+Stages:
+A job moves through fetch (url resources only), extract and persist
+Each stage is claimed by its own workers, fetch and persist run on the io
+pool and extract on the cpu pool (PIPELINE_POOLS), so slow network calls
+never hold a cpu slot and the reverse
+Finishing a stage puts the job back in the queue at the next stage with a
+fresh set of attempts, the stage's output is carried in payload
+PIPELINE_STAGE_LIMITS can cap how many jobs of a stage run at once across all
+workers (a soft limit, two workers may both claim the last slot), none by
+default so throughput grows with the workers
+"""
+ACTIVE_STATES = ("queued", "running")
+STAGES = ("fetch", "extract", "persist")
+
+def worker_id():
+    return socket.gethostname() + ":" + str(os.getpid()) + ":" + str(threading.get_ident())
+
+def lease_seconds():
+    return app.config.get("JOB_LEASE_SECONDS", 300)
+
+def max_attempts():
+    return app.config.get("JOB_MAX_ATTEMPTS", 3)
+
+def pool(stage):
+    return app.config.get("PIPELINE_POOLS", {}).get(stage, "cpu")
+
+"""
+First stage for a resource type, urls are fetched on the io pool first
+"""
+def first_stage(resource_type):
+    return "fetch" if resource_type == "url" else "extract"
+
+def _claimable(now, stage=None):
+    claimable = or_(
+        and_(models.Queue.state == "queued", or_(models.Queue.available_at == None, models.Queue.available_at <= now)),
+        and_(models.Queue.state == "running", models.Queue.lease_expires < now),
+    )
+    return and_(claimable, models.Queue.stage == stage) if stage else claimable
+
+"""
+Add a resource to the queue
+Returns the new job
+"""
+def enqueue(resource_id, stage="extract"):
+    job = models.Queue(resource=resource_id, state="queued", stage=stage, attempts=0, enqueued=datetime.now())
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+"""
+Get the queued or running job for a resource, if any
+"""
+def active(resource_id):
+    return models.Queue.query.filter_by(resource=resource_id).filter(models.Queue.state.in_(ACTIVE_STATES)).first()
+
+"""
+Claim the next job, of a stage if given
+1. Stop if the stage already runs its limit of jobs
+2. Select a few claimable job ids, oldest first
+3. Try to move each one to running with a conditional update
+4. The first update that changes a row wins the job
+5. Dead letter the job instead if it has used every attempt
+6. Return the job, or None if nothing could be claimed
+"""
+def claim(worker, limit=10, stage=None):
+    now = datetime.now()
+    stage_limit = app.config.get("PIPELINE_STAGE_LIMITS", {}).get(stage)
+    if stage_limit and running_count(stage, now) >= stage_limit:
+        return None
+    ids = [row[0] for row in db.session.query(models.Queue.id).filter(_claimable(now, stage)).order_by(models.Queue.id).limit(limit).all()]
+    for id in ids:
+        result = db.session.execute(
+            update(models.Queue)
+            .where(models.Queue.id == id, _claimable(now, stage))
+            .values(
+                state="running",
+                worker=worker,
+                started=now,
+                lease_expires=now + timedelta(seconds=lease_seconds()),
+                attempts=models.Queue.attempts + 1,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            job = db.session.get(models.Queue, id)
+            db.session.refresh(job)
+            # A job that keeps losing its lease is killing its worker
+            if job.attempts > max_attempts():
+                dead_letter(job, job.last_error or "Lease expired on every attempt")
+                db.session.commit()
+                continue
+            if job.attempts > 1:
+                logger.warning("Job %s for resource %s claimed by %s (attempt %s)", job.id, job.resource, worker, job.attempts)
+            return job
+    return None
+
+"""
+Extend the lease of a running job
+Returns False if the job is no longer held by this worker
+"""
+def heartbeat(job_id, worker):
+    result = db.session.execute(
+        update(models.Queue)
+        .where(models.Queue.id == job_id, models.Queue.worker == worker, models.Queue.state == "running")
+        .values(lease_expires=datetime.now() + timedelta(seconds=lease_seconds()))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+"""
+Mark a job as finished
+Done jobs older than JOB_DONE_RETENTION_HOURS are deleted at the same time,
+so the queue table only grows with the active and dead jobs
+Caller commits
+"""
+def complete(job):
+    job.state = "done"
+    job.finished = datetime.now()
+    job.lease_expires = None
+    db.session.add(job)
+    purge_done(job.finished)
+
+"""
+Delete done jobs that finished before the retention window
+Returns the number of jobs deleted, caller commits
+"""
+def purge_done(now=None):
+    cutoff = (now or datetime.now()) - timedelta(hours=app.config.get("JOB_DONE_RETENTION_HOURS", 24))
+    return models.Queue.query.filter(models.Queue.state == "done", models.Queue.finished < cutoff).delete(synchronize_session=False)
+
+"""
+Move a job on to the next stage, with the output of this one
+Caller commits
+"""
+def advance(job, stage, payload=None):
+    job.stage = stage
+    job.payload = payload
+    job.state = "queued"
+    job.attempts = 0
+    job.worker = None
+    job.lease_expires = None
+    # Also marks when the job started waiting for this stage
+    job.available_at = datetime.now()
+    job.last_error = None
+    db.session.add(job)
+
+"""
+Seconds a claimed job waited in the queue for its stage
+From when it became available (enqueued, advanced or retried) to its claim,
+0 for jobs without either time (rows from before the leased queue)
+"""
+def waited(job):
+    since = job.available_at or job.enqueued
+    if since is None or job.started is None:
+        return 0
+    return max((job.started - since).total_seconds(), 0)
+
+"""
+Move a job to the dead letter state
+Used for jobs that can never succeed and jobs out of attempts
+Caller commits
+"""
+def dead_letter(job, error):
+    job.state = "dead"
+    job.finished = datetime.now()
+    job.lease_expires = None
+    job.last_error = str(error)[:2000]
+    db.session.add(job)
+    logger.error("Job %s for resource %s dead lettered after %s attempts: %s", job.id, job.resource, job.attempts, error)
+
+"""
+Record a failed attempt
+1. If the job is out of attempts, dead letter it and return None
+2. Else put it back in the queue after an exponential backoff
+3. Return the backoff in seconds so the caller can schedule a retry
+"""
+def fail(job_id, error):
+    job = db.session.get(models.Queue, job_id)
+    if not job:
+        return None
+    if job.attempts >= max_attempts():
+        dead_letter(job, error)
+        db.session.commit()
+        return None
+    base = app.config.get("JOB_BACKOFF_SECONDS", 30)
+    delay = min(base * 2 ** max(job.attempts - 1, 0), app.config.get("JOB_BACKOFF_MAX_SECONDS", 3600))
+    job.state = "queued"
+    job.lease_expires = None
+    job.worker = None
+    job.available_at = datetime.now() + timedelta(seconds=delay)
+    job.last_error = str(error)[:2000]
+    db.session.commit()
+    logger.warning("Job %s for resource %s failed (attempt %s), retrying in %ss: %s", job.id, job.resource, job.attempts, delay, error)
+    return delay
+
+"""
+Put dead jobs back in the queue with fresh attempts
+Returns the number of jobs requeued
+"""
+def requeue(ids):
+    count = 0
+    for job in models.Queue.query.filter(models.Queue.id.in_(ids), models.Queue.state == "dead").all():
+        if active(job.resource):
+            continue
+        job.state = "queued"
+        job.attempts = 0
+        job.available_at = datetime.now()
+        job.finished = None
+        count += 1
+    db.session.commit()
+    return count
+
+"""
+Delete dead jobs
+Returns the number of jobs purged
+"""
+def purge(ids):
+    count = models.Queue.query.filter(models.Queue.id.in_(ids), models.Queue.state == "dead").delete(synchronize_session=False)
+    db.session.commit()
+    return count
+
+"""
+Keep a job's lease alive while the body of the with block runs
+Heartbeats are sent from a background thread every third of the lease, a
+failed heartbeat (e.g. the database is locked) is logged and tried again at
+the next interval while the lease still has time left
+"""
+class Lease:
+    def __init__(self, job_id, worker):
+        self.job_id = job_id
+        self.worker = worker
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        interval = max(lease_seconds() / 3, 1)
+        while not self.stopped.wait(interval):
+            with app.app_context():
+                try:
+                    held = heartbeat(self.job_id, self.worker)
+                except Exception:
+                    logger.exception("Heartbeat failed for job %s", self.job_id)
+                    db.session.rollback()
+                    continue
+                if not held:
+                    logger.warning("Lost lease on job %s", self.job_id)
+                    return
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        return False
+
+"""
+Count claimable jobs, used to decide if a drain should be started
+"""
+def claimable_count(stage=None):
+    return models.Queue.query.filter(_claimable(datetime.now(), stage)).count()
+
+def running_count(stage, now=None):
+    now = now or datetime.now()
+    return models.Queue.query.filter(models.Queue.stage == stage, models.Queue.state == "running", models.Queue.lease_expires >= now).count()
+
+"""
+Queue depth of every stage
+Returns {stage: {"pool", "queued", "running", "limit"}}
+"""
+def depths():
+    counts = dict(((stage, state), count) for stage, state, count in db.session.query(
+        models.Queue.stage, models.Queue.state, func.count(models.Queue.id)
+    ).filter(models.Queue.state.in_(ACTIVE_STATES)).group_by(models.Queue.stage, models.Queue.state).all())
+    limits = app.config.get("PIPELINE_STAGE_LIMITS", {})
+    return {stage: {
+        "pool": pool(stage),
+        "queued": counts.get((stage, "queued"), 0),
+        "running": counts.get((stage, "running"), 0),
+        "limit": limits.get(stage),
+    } for stage in STAGES}
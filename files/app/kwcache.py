@@ -0,0 +1,120 @@
+from app import app, db, models
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+import hashlib
+import logging
+import json
+import time
+
+logger = logging.getLogger(__name__)
+
+"""
+Content addressed keyword cache
+Keywords are stored against a hash of the content plus the model version
+so a PDF or page uploaded by many groups only goes through the model once
+
+Files are hashed from their raw bytes (no extraction needed on a hit),
+notes and url pages from their whitespace normalized text
+
+Single flight:
+The first job to see a hash inserts a 'pending' row, the unique constraint
+on (hash, model) makes every other job for the same hash wait for that
+row to become 'ready' instead of running the model again
+"""
+CHUNK = 1024 * 1024
+
+"""
+Version of the keyword extractor, model and settings, part of every cache key
+Changing the extractor, model or extraction settings changes the key and so
+invalidates old entries
+"""
+def model_version(extractor="keybert"):
+    name = app.config.get("KEYBERT_MODEL", "all-mpnet-base-v2") if extractor == "keybert" else extractor
+    return name + ":" + str(app.config.get("KEYWORD_CACHE_VERSION", 1))
+
+def file_key(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK):
+            h.update(chunk)
+    return h.hexdigest()
+
+def text_key(text):
+    return hashlib.sha256(" ".join(text.split()).encode()).hexdigest()
+
+def lookup(key, version=None):
+    return models.KeywordCache.query.filter_by(hash=key, model=version or model_version()).first()
+
+"""
+Wait for another job to finish computing a key
+Returns the ready entry, or None if it was abandoned or took too long
+"""
+def wait_for(key, version):
+    deadline = time.monotonic() + app.config.get("KEYWORD_CACHE_WAIT_SECONDS", 600)
+    while time.monotonic() < deadline:
+        db.session.rollback()
+        entry = lookup(key, version)
+        if entry is None or entry.state == "ready":
+            return entry
+        time.sleep(0.2)
+    return None
+
+"""
+Get keywords for a key, computing them at most once
+1. If a ready entry exists, return it
+2. Try to claim the key by inserting a pending entry
+3. If another job holds the key, wait for its result
+4. Else compute, store and return the result
+compute() returns a list of keywords, or None if the content has no text
+Empty lists (extraction failed) are returned but not cached
+"""
+def single_flight(key, compute, version=None):
+    version = version or model_version()
+    entry = lookup(key, version)
+    if entry and entry.state == "ready":
+        logger.info("Keyword cache hit for %s", key)
+        return json.loads(entry.json)
+    if entry is None:
+        try:
+            db.session.add(models.KeywordCache(hash=key, model=version, state="pending", created=datetime.now()))
+            db.session.commit()
+            owner = True
+        except IntegrityError:
+            db.session.rollback()
+            owner = False
+    else:
+        # Someone else's pending entry, take it over if it has gone stale
+        stale = entry.created < datetime.now() - timedelta(seconds=app.config.get("KEYWORD_CACHE_WAIT_SECONDS", 600))
+        owner = stale
+        if stale:
+            entry.created = datetime.now()
+            db.session.commit()
+    if not owner:
+        logger.info("Keyword cache waiting for in-flight computation of %s", key)
+        entry = wait_for(key, version)
+        if entry is not None and entry.state == "ready":
+            return json.loads(entry.json)
+    try:
+        result = compute()
+    except Exception:
+        _release(key, version)
+        raise
+    if result == []:
+        _release(key, version)
+        return result
+    entry = lookup(key, version)
+    if entry is None:
+        entry = models.KeywordCache(hash=key, model=version, created=datetime.now())
+        db.session.add(entry)
+    entry.state = "ready"
+    entry.json = json.dumps(result)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+    return result
+
+def _release(key, version):
+    db.session.rollback()
+    models.KeywordCache.query.filter_by(hash=key, model=version, state="pending").delete()
+    db.session.commit()
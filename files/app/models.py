@@ -1,5 +1,6 @@
 from app import db, login_manager
 from flask_login import UserMixin
+from datetime import datetime
 
 @login_manager.user_loader
 def load_user(id):
@@ -25,6 +26,7 @@ class Group(db.Model):
     title = db.Column(db.String(256))
     code = db.Column(db.String(256), unique=True)
     owner = db.Column(db.Integer, db.ForeignKey('user.id'))
+    index_version = db.Column(db.Integer, default=0)
 
 class Member(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -59,6 +61,54 @@ class Review(db.Model):
 class Queue(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     resource = db.Column(db.Integer, db.ForeignKey('resource.id'))
+    state = db.Column(db.String(32), default="queued", index=True)
+    attempts = db.Column(db.Integer, default=0)
+    enqueued = db.Column(db.DateTime, default=datetime.now)
+    started = db.Column(db.DateTime, default=None)
+    finished = db.Column(db.DateTime, default=None)
+    lease_expires = db.Column(db.DateTime, default=None)
+    worker = db.Column(db.String(256), default=None)
+    available_at = db.Column(db.DateTime, default=None)
+    last_error = db.Column(db.Text, default=None)
+    stage = db.Column(db.String(32), default="extract", index=True)
+    payload = db.Column(db.Text, default=None)
+    __table_args__ = (
+        db.Index('ix_queue_resource', 'resource'),
+        db.Index('ix_queue_state_stage_available', 'state', 'stage', 'available_at'),
+        db.Index('ix_queue_state_finished', 'state', 'finished'),
+    )
+
+class KeywordCache(db.Model):
+    __table_args__ = (db.UniqueConstraint('hash', 'model'),)
+    id = db.Column(db.Integer, primary_key=True)
+    hash = db.Column(db.String(64), index=True)
+    model = db.Column(db.String(256))
+    state = db.Column(db.String(32), default="pending")
+    json = db.Column(db.Text)
+    created = db.Column(db.DateTime, default=datetime.now)
+
+# Heading delimited section of a note with its cached embedding and candidates
+# embedding is the length weighted sum of the section's chunk embeddings (float32 bytes)
+# and weight the sum of the lengths, so sections can be added up into the note embedding
+# model is the extractor version (kwcache.model_version) the embedding was made with
+class NoteSection(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    resource = db.Column(db.Integer, db.ForeignKey('resource.id'), index=True)
+    hash = db.Column(db.String(64))
+    model = db.Column(db.String(256))
+    embedding = db.Column(db.LargeBinary)
+    weight = db.Column(db.Float)
+    candidates = db.Column(db.Text)
+
+class JobSpan(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job = db.Column(db.Integer, index=True)
+    resource = db.Column(db.Integer)
+    stage = db.Column(db.String(32))
+    name = db.Column(db.String(64))
+    seconds = db.Column(db.Float)
+    chars = db.Column(db.Integer, default=None)
+    finished = db.Column(db.DateTime, index=True)
 
 class Report(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -68,8 +118,24 @@ class Report(db.Model):
 
 class SearchTree(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    folder = db.Column(db.Integer, db.ForeignKey('folder.id'))
+    folder = db.Column(db.Integer, db.ForeignKey('folder.id'), index=True)
     json = db.Column(db.Text)
+    version = db.Column(db.Integer, default=0)
+
+class Posting(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    term = db.Column(db.String(128))
+    folder = db.Column(db.Integer, db.ForeignKey('folder.id'))
+    group = db.Column(db.Integer, db.ForeignKey('group.id'))
+    resource = db.Column(db.Integer, db.ForeignKey('resource.id'))
+    field = db.Column(db.String(16))
+    tf = db.Column(db.Integer)
+    length = db.Column(db.Integer)
+    __table_args__ = (
+        db.Index('ix_posting_folder_term', 'folder', 'term'),
+        db.Index('ix_posting_group_term', 'group', 'term'),
+        db.Index('ix_posting_resource_field', 'resource', 'field'),
+    )
 
 # Available Resource Types:
 #   - 'material' (PDF, upload on site, data=filename)
@@ -77,6 +143,41 @@ class SearchTree(db.Model):
 #   - 'notes' (MD, input on site, no upload, data=content)
 #   - 'url' (URL, input on site, no upload, data=url)
 
+# Queue (job) States:
+#   - 'queued' (waiting for a worker)
+#   - 'running' (claimed, worker holds a lease until lease_expires)
+#   - 'done' (keywords saved, finished is set)
+#   - 'dead' (failed JOB_MAX_ATTEMPTS times or can never succeed, last_error is set)
+
+# Queue (job) Stages, each stage has its own pool of workers:
+#   - 'fetch' (io, download url content into payload)
+#   - 'extract' (cpu, parse and embed, keywords into payload)
+#   - 'persist' (io, write the SearchTree and Keywords)
+
+# SearchTree marks a folder as searchable, its json is no longer used (see Posting)
+# version is bumped on every write to the folder's postings, processes cache
+# the folder's index until it changes (see indexcache.py)
+# Group.index_version is bumped with the versions of the group's folders
+
+# Posting rows carry the group of their folder too, so a group search is one
+# lookup on (group, term) however many folders the group has
+
+# Posting Fields (one row per stemmed term of a resource field, tf is the count,
+# length the number of terms in the whole field, for BM25 length normalization):
+#   - 'title' (resource title)
+#   - 'heading' (markdown headings of notes)
+#   - 'keyword' (generated keywords)
+
+# JobSpan Names (one row per name for each stage a job finishes, see timings.py):
+#   - 'wait' (queued to claimed), 'total' (the whole stage)
+#   - 'prepare_<type>' (reading the resource, chars is the raw text size before normalization)
+#   - 'model_load', 'candidates', 'embed', 'embed_candidates', 'select'
+#   - 'index', 'db_write'
+
+# KeywordCache States:
+#   - 'pending' (a job is computing the keywords for this hash)
+#   - 'ready' (json holds the keywords, null if the content had no text)
+
 # Available Report Types:
 #   - 'resource' (item=resource.id)
 #   - 'review' (item=review.id)
\ No newline at end of file
@@ -0,0 +1,129 @@
+from collections import Counter, deque
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+"""
+Text normalization between the prepare/iter stage and keyword extraction
+Every stage is a generator over text pieces so documents are still streamed
+
+    - material    join hyphenated line breaks, strip repeated page headers
+                  and footers, collapse whitespace
+    - transcript  drop rolling caption lines already shown, collapse whitespace
+    - notes, url  collapse whitespace
+
+The number of characters in and out is logged for every document
+"""
+HYPHEN_BREAK = re.compile(r"(\w)-[ \t]*\r?\n[ \t]*(\w)")
+PAGE_NUMBER = re.compile(r"^(page|slide|p\.)?\s*\d+\s*((of|/)\s*\d+)?$")
+
+def collapse_whitespace(pieces):
+    for piece in pieces:
+        piece = " ".join(piece.split())
+        if piece:
+            yield piece
+
+def dehyphenate(pieces):
+    for piece in pieces:
+        yield HYPHEN_BREAK.sub(r"\1\2", piece)
+
+"""
+Drop caption lines that were shown by one of the last few captions
+Auto generated vtt captions roll, each caption repeats the line before it
+"""
+def dedupe_captions(pieces, window=3):
+    recent = deque(maxlen=window)
+    for piece in pieces:
+        lines = []
+        for line in piece.splitlines():
+            key = " ".join(line.split()).lower()
+            if not key or key in recent:
+                continue
+            recent.append(key)
+            lines.append(line)
+        if lines:
+            yield "\n".join(lines)
+
+"""
+Strip lines repeated at the top or bottom of most pages (headers, footers, page numbers)
+1. Buffer the first `sample` pages
+2. Count the first and last `edge` lines of each page, with page numbers
+   masked so 'Page 3 of 20' matches 'Page 4 of 20'
+3. Lines on at least `share` of the sampled pages are boilerplate
+4. Strip them from the edges of every page, buffered or not
+Documents with fewer than 3 pages are passed through
+"""
+def strip_boilerplate(pages, sample=12, edge=3, share=0.6):
+    pages = iter(pages)
+    buffered = []
+    for page in pages:
+        buffered.append(page)
+        if len(buffered) == sample:
+            break
+    if len(buffered) < 3:
+        yield from buffered
+        return
+    counts = Counter()
+    for page in buffered:
+        counts.update(set(_edges(page, edge)))
+    boilerplate = set(line for line, count in counts.items() if count >= share * len(buffered))
+    if not boilerplate:
+        yield from buffered
+        yield from pages
+        return
+    for page in buffered:
+        yield _strip(page, edge, boilerplate)
+    for page in pages:
+        yield _strip(page, edge, boilerplate)
+
+def _mask(line):
+    line = " ".join(line.split()).lower()
+    return "#" if PAGE_NUMBER.match(line) else line
+
+def _edges(page, edge):
+    lines = [_mask(line) for line in page.splitlines() if line.strip()]
+    return lines[:edge] + lines[-edge:]
+
+def _strip(page, edge, boilerplate):
+    lines = [line for line in page.splitlines() if line.strip()]
+    head = 0
+    while head < min(edge, len(lines)) and _mask(lines[head]) in boilerplate:
+        head += 1
+    tail = len(lines)
+    while tail > max(head, len(lines) - edge) and _mask(lines[tail - 1]) in boilerplate:
+        tail -= 1
+    return "\n".join(lines[head:tail])
+
+"""
+Count characters going through a stage and log the reduction once the stream ends
+"""
+class SizeReport:
+    def __init__(self, label):
+        self.label = label
+        self.before = 0
+        self.after = 0
+
+    def count_in(self, pieces):
+        for piece in pieces:
+            self.before += len(piece)
+            yield piece
+
+    def count_out(self, pieces):
+        for piece in pieces:
+            self.after += len(piece)
+            yield piece
+        saved = 100 * (1 - self.after / self.before) if self.before else 0
+        logger.info("Normalized %s: %d -> %d chars (%.1f%% smaller)", self.label, self.before, self.after, saved)
+
+"""
+Normalize a stream of text pieces for a resource type
+"""
+def normalize(pieces, resource_type, report=None):
+    report = report or SizeReport(resource_type)
+    pieces = report.count_in(pieces)
+    if resource_type == "material":
+        pieces = strip_boilerplate(dehyphenate(pieces))
+    elif resource_type == "transcript":
+        pieces = dedupe_captions(pieces)
+    return report.count_out(collapse_whitespace(pieces))
@@ -0,0 +1,200 @@
+from app import db, models, registry, pipeline, kwcache, timings
+from collections import Counter
+import numpy as np
+import json
+import html
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+"""
+Single pass markdown reader for notes
+Replaces rendering the note to html with markdown() and parsing it back with
+BeautifulSoup, and the separate scan for headings
+
+Each line is read once and turned into either a heading or plaintext:
+    - ATX headings ('## Title ##'), setext underlines, rules and reference
+      link definitions produce no body text of their own
+    - list, quote and fence markers are dropped
+    - inline markup (emphasis, code spans, links, images, html tags and
+      backslash escapes) is reduced to the text markdown would render
+The plaintext has the same words as the markdown/BeautifulSoup text
+"""
+ATX = re.compile(r"^(#{1,6})(.*?)(?:\s+#+)?\s*$")
+SETEXT = re.compile(r"^(=+|-+)\s*$")
+RULE = re.compile(r"^([-*_])(\s*\1){2,}\s*$")
+LIST_ITEM = re.compile(r"^(?:[-*+]|\d+\.)\s+")
+QUOTE = re.compile(r"^(?:>\s?)+")
+FENCE = re.compile(r"^(```+|~~~+)")
+REFERENCE = re.compile(r"^\[[^\]]+\]:\s*\S+")
+IMAGE = re.compile(r"!\[[^\]]*\]\([^)]*\)|!\[[^\]]*\]\[[^\]]*\]")
+LINK = re.compile(r"\[([^\]]*)\]\([^)]*\)|\[([^\]]*)\]\[[^\]]*\]")
+AUTOLINK = re.compile(r"<((?:https?|ftp|mailto):[^>\s]+)>")
+TAG = re.compile(r"</?[A-Za-z][^>]*>")
+CODE = re.compile(r"(`+)(.+?)\1")
+EMPHASIS = re.compile(r"(\*\*|__|\*|\b_)(?=\S)(.+?)(?<=\S)\1")
+ESCAPE = re.compile(r"\\([\\`*_{}\[\]()#+\-.!>])")
+
+def inline(text):
+    # Code spans and escaped characters are literal, keep them out of the other substitutions
+    spans = []
+    def keep(value):
+        spans.append(value)
+        return "\x00" + str(len(spans) - 1) + "\x00"
+    text = ESCAPE.sub(lambda match: keep(match.group(1)), text)
+    text = CODE.sub(lambda match: keep(match.group(2).strip()), text)
+    text = IMAGE.sub("", text)
+    text = LINK.sub(lambda match: match.group(1) if match.group(1) is not None else match.group(2), text)
+    text = AUTOLINK.sub(r"\1", text)
+    text = TAG.sub("", text)
+    previous = None
+    while previous != text:
+        previous = text
+        text = EMPHASIS.sub(r"\2", text)
+    return re.sub("\x00(\\d+)\x00", lambda match: spans[int(match.group(1))], text)
+
+"""
+Title of a heading line as markdown_headings saw it: the words after a
+first word made only of hashes, as written (closing hashes included)
+Returns None if the line isn't a heading by that rule
+"""
+def heading_title(line):
+    first, _, rest = line.lstrip().partition(" ")
+    if not first or first.strip("#"):
+        return None
+    return rest
+
+"""
+Read a note line by line
+Yields ('heading', level, text, title) for headings, title is the keyword
+form from heading_title, and ('text', line) for body text
+Setext underlines only count straight after the first line of a block,
+like in markdown, otherwise they are text
+"""
+def tokenize(data):
+    fenced = None
+    block = 0
+    for line in html.unescape(data).split("\n"):
+        line = line.rstrip("\r")
+        stripped = line.strip()
+        fence = FENCE.match(stripped)
+        if fenced:
+            if fence and fence.group(1)[0] == fenced:
+                fenced = None
+            else:
+                yield ("text", line)
+            continue
+        if fence:
+            fenced = fence.group(1)[0]
+            continue
+        if not stripped:
+            block = 0
+            continue
+        block += 1
+        heading = ATX.match(stripped)
+        if heading:
+            yield ("heading", len(heading.group(1)), inline(heading.group(2).strip()), heading_title(line))
+            block = 0
+            continue
+        if RULE.match(stripped) or (block == 2 and SETEXT.match(stripped)) or REFERENCE.match(stripped):
+            block = 0
+            continue
+        if line.startswith("    ") or line.startswith("\t"):
+            # Indented code block
+            yield ("text", line)
+            continue
+        stripped = QUOTE.sub("", stripped)
+        stripped = LIST_ITEM.sub("", stripped)
+        if stripped:
+            yield ("text", inline(stripped))
+
+"""
+Get the headings and plaintext of a note in one pass
+Headings match markdown_headings (each heading once, sorted), except that
+lines in fenced code and empty headings are skipped
+Returns (headings, text)
+"""
+def parse(data):
+    headings = set()
+    lines = []
+    for token in tokenize(data):
+        if token[0] == "heading":
+            _, level, text, title = token
+            if title:
+                headings.add(title)
+            lines.append(text)
+        else:
+            lines.append(token[1])
+    return sorted(headings), "\n".join(lines)
+
+"""
+Split a note into heading delimited sections of plaintext
+Text before the first heading is its own section
+"""
+def sections(data):
+    parts = [[]]
+    for token in tokenize(data):
+        if token[0] == "heading":
+            parts.append([token[2]])
+        else:
+            parts[-1].append(token[1])
+    return ["\n".join(lines) for lines in parts if lines]
+
+"""
+Extract keywords for a note, only embedding the sections that changed
+1. Split the note into sections and hash each one
+2. Reuse the stored embedding sum and candidate counts of unchanged sections
+3. Embed new or changed sections and store them, drop sections that are gone
+4. Add the sections up into the note embedding and candidates
+5. Run the final keyword selection on the whole note
+Returns None if the note has no text and [] if extraction fails
+"""
+def keybert_sections(resource_id, data, top_n=10, diversity=0.5):
+    version = kwcache.model_version("keybert")
+    try:
+        with timings.span("model_load"):
+            embedder = registry.get_model().model
+        analyzer = pipeline.candidate_analyzer()
+        stored = {}
+        for section in models.NoteSection.query.filter_by(resource=resource_id).all():
+            if section.model != version or section.hash in stored:
+                db.session.delete(section)
+            else:
+                stored[section.hash] = section
+        total = None
+        weight = 0
+        counts = Counter()
+        seen = set()
+        embedded = 0
+        parts = sections(data)
+        for text in parts:
+            key = kwcache.text_key(text)
+            section = stored.get(key)
+            if section is None:
+                section_sum, section_weight, section_counts = pipeline.embed_sum(embedder, pipeline.chunk_text([text]), analyzer)
+                if section_sum is None:
+                    continue
+                section = models.NoteSection(resource=resource_id, hash=key, model=version,
+                    embedding=section_sum.astype(np.float32).tobytes(), weight=section_weight,
+                    candidates=json.dumps(section_counts))
+                db.session.add(section)
+                stored[key] = section
+                embedded += 1
+            seen.add(key)
+            section_sum = np.frombuffer(section.embedding, dtype=np.float32)
+            total = section_sum if total is None else total + section_sum
+            weight += section.weight
+            counts.update(json.loads(section.candidates))
+        for key, section in stored.items():
+            if key not in seen:
+                db.session.delete(section)
+        db.session.commit()
+        logger.info("Note %s: embedded %d of %d sections, reused the rest", resource_id, embedded, len(parts))
+        if total is None:
+            return None
+        return pipeline.select_keywords(embedder, pipeline._normalize(total / weight), counts, top_n, diversity)
+    except Exception:
+        db.session.rollback()
+        logger.exception("Keyword extraction failed")
+        return []
@@ -0,0 +1,270 @@
+from app import app, fetch
+from contextlib import asynccontextmanager
+from html.parser import HTMLParser
+from urllib.parse import urlparse, urljoin
+import ipaddress
+import codecs
+import fcntl
+import asyncio
+import logging
+import socket
+import ssl
+import html
+
+logger = logging.getLogger(__name__)
+
+"""
+Concurrent fetching of generic (non Wikipedia) url resources
+Pages are fetched with asyncio streams, no thread per request:
+    - at most URL_CONCURRENCY requests in flight, URL_PER_HOST per host
+    - connect and read timeouts from URL_FETCH_TIMEOUT
+    - the body is parsed to text while it streams in, reading stops after
+      URL_MAX_BYTES of html or URL_MAX_TEXT_KB of text
+    - hosts resolving to private, loopback or link local addresses are
+      refused unless URL_ALLOW_PRIVATE is set
+Results go to the url disk cache (see fetch.py) under 'page:<url>' with
+their ETag/Last-Modified, so stale pages are revalidated with a 304
+Failures are cached as well (failed is set) for URL_FAILURE_TTL, keeping the
+last good text if there was one
+Each url is locked on its own while it is fetched, a worker wanting a page
+another worker is fetching waits for that page only, then reads the cache
+"""
+SKIP_TAGS = {"script", "style", "noscript", "template", "svg"}
+BLOCK_TAGS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "section", "article", "title"}
+
+class FetchError(Exception):
+    pass
+
+"""
+Incremental html to text, fed with decoded chunks as they arrive
+"""
+class TextParser(HTMLParser):
+    def __init__(self, limit):
+        super().__init__(convert_charrefs=True)
+        self.limit = limit
+        self.parts = []
+        self.size = 0
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self.skipping += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS and self.skipping:
+            self.skipping -= 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self.skipping or not data.strip():
+            return
+        self.parts.append(data)
+        self.size += len(data)
+
+    @property
+    def full(self):
+        return self.size >= self.limit
+
+    def text(self):
+        lines = (" ".join(line.split()) for line in "".join(self.parts).split("\n"))
+        return "\n".join(line for line in lines if line)
+
+async def _resolve(host, port):
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    if not infos:
+        raise FetchError("Could not resolve " + host)
+    address = infos[0][4][0]
+    ip = ipaddress.ip_address(address)
+    if not app.config.get("URL_ALLOW_PRIVATE", False) and (ip.is_private or ip.is_loopback or ip.is_link_local or ip.is_reserved):
+        raise FetchError("Refusing to fetch " + host + " (" + address + ")")
+    return address
+
+async def _read(reader, size, read_timeout):
+    data = await asyncio.wait_for(reader.read(size), read_timeout)
+    return data
+
+"""
+Stream the body of a response
+Handles Content-Length, chunked and connection close framing
+"""
+async def _body(reader, headers, read_timeout):
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            line = await asyncio.wait_for(reader.readline(), read_timeout)
+            size = int(line.split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                return
+            remaining = size
+            while remaining:
+                data = await _read(reader, min(remaining, 65536), read_timeout)
+                if not data:
+                    return
+                remaining -= len(data)
+                yield data
+            await asyncio.wait_for(reader.readline(), read_timeout)
+    else:
+        remaining = int(headers["content-length"]) if "content-length" in headers else None
+        while remaining is None or remaining > 0:
+            data = await _read(reader, 65536 if remaining is None else min(remaining, 65536), read_timeout)
+            if not data:
+                return
+            if remaining is not None:
+                remaining -= len(data)
+            yield data
+
+"""
+Fetch one page
+1. Resolve and check the host, connect with the connect timeout
+2. Send a GET with the cached validators, follow up to 5 redirects
+3. Parse the body to text as it streams, stop at the size limits
+Returns the cache entry for the page
+"""
+async def fetch_page(url, cached=None, redirects=5):
+    connect_timeout, read_timeout = app.config.get("URL_FETCH_TIMEOUT", (5, 20))
+    max_bytes = app.config.get("URL_MAX_BYTES", 2 * 1024 * 1024)
+    max_text = app.config.get("URL_MAX_TEXT_KB", 256) * 1024
+    for _ in range(redirects + 1):
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise FetchError("Unsupported url " + url)
+        secure = parsed.scheme == "https"
+        port = parsed.port or (443 if secure else 80)
+        address = await _resolve(parsed.hostname, port)
+        context = ssl.create_default_context() if secure else None
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(address, port, ssl=context, server_hostname=parsed.hostname if secure else None),
+            connect_timeout)
+        try:
+            path = (parsed.path or "/") + ("?" + parsed.query if parsed.query else "")
+            request = ["GET " + path + " HTTP/1.1", "Host: " + parsed.netloc, "Accept: text/html,text/plain",
+                "Accept-Encoding: identity", "Connection: close", "User-Agent: " + app.config.get("URL_USER_AGENT", "SmartNotes/1.0")]
+            if cached and cached.get("etag"):
+                request.append("If-None-Match: " + cached["etag"])
+            if cached and cached.get("last_modified"):
+                request.append("If-Modified-Since: " + cached["last_modified"])
+            writer.write(("\r\n".join(request) + "\r\n\r\n").encode("latin-1"))
+            await writer.drain()
+            status_line = await asyncio.wait_for(reader.readline(), read_timeout)
+            parts = status_line.decode("latin-1").split()
+            if len(parts) < 2 or not parts[1].isdigit():
+                raise FetchError("Bad response from " + url)
+            status = int(parts[1])
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), read_timeout)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if status in (301, 302, 303, 307, 308) and "location" in headers:
+                url = urljoin(url, headers["location"])
+                continue
+            if status == 304 and cached:
+                return cached
+            if status != 200:
+                raise FetchError(url + " returned " + str(status))
+            content_type = headers.get("content-type", "text/html")
+            if not content_type.startswith(("text/html", "text/plain", "application/xhtml")):
+                raise FetchError(url + " is not a page (" + content_type + ")")
+            charset = "utf-8"
+            if "charset=" in content_type:
+                charset = content_type.split("charset=")[-1].split(";")[0].strip() or charset
+            parser = TextParser(max_text)
+            decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+            received = 0
+            async for data in _body(reader, headers, read_timeout):
+                received += len(data)
+                text = decoder.decode(data)
+                if content_type.startswith("text/plain"):
+                    text = html.escape(text)
+                parser.feed(text)
+                if parser.full or received >= max_bytes:
+                    logger.info("Stopped reading %s after %d bytes", url, received)
+                    break
+            parser.close()
+            return {
+                "url": url,
+                "status": status,
+                "content": parser.text(),
+                "etag": headers.get("etag"),
+                "last_modified": headers.get("last-modified"),
+            }
+        finally:
+            writer.close()
+    raise FetchError("Too many redirects for " + url)
+
+"""
+Hold the cache lock of one key without blocking the event loop
+"""
+@asynccontextmanager
+async def locked(key):
+    if not app.config.get("URL_CACHE_DIR"):
+        yield
+        return
+    with open(fetch._path(key) + ".lock", "a+") as f:
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                await asyncio.sleep(0.05)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+"""
+Fetch a list of pages concurrently with the global and per host limits
+Returns {url: text}, "" for pages that failed
+"""
+async def fetch_all(urls):
+    total = asyncio.Semaphore(app.config.get("URL_CONCURRENCY", 16))
+    hosts = {}
+    results = {}
+
+    async def one(url):
+        host = urlparse(url).hostname or ""
+        limit = hosts.setdefault(host, asyncio.Semaphore(app.config.get("URL_PER_HOST", 2)))
+        key = "page:" + url
+        cached = fetch.cache_get(key)
+        if fetch.fresh(cached):
+            results[url] = cached["content"]
+            return
+        async with locked(key):
+            # Another worker may have fetched it while we waited
+            cached = fetch.cache_get(key)
+            if fetch.fresh(cached):
+                results[url] = cached["content"]
+                return
+            async with total, limit:
+                try:
+                    entry = await fetch_page(url, cached)
+                except (OSError, asyncio.TimeoutError, FetchError, ValueError, LookupError) as e:
+                    logger.info("Could not fetch %s: %s", url, e)
+                    entry = dict(cached or {"url": url, "content": ""}, failed=True, error=str(e) or type(e).__name__)
+                else:
+                    entry.pop("failed", None)
+                fetch.cache_put(key, entry)
+                results[url] = entry["content"]
+
+    await asyncio.gather(*(one(url) for url in dict.fromkeys(urls)))
+    return results
+
+"""
+Fetch pages from synchronous code (the generator pipeline)
+Pages are locked one by one, workers only wait for the pages they share
+"""
+def fetch_pages(urls):
+    return asyncio.run(fetch_all(urls))
+
+"""
+Get the text of a page, from the cache or fetched on its own
+"""
+def page(url):
+    cached = fetch.cache_get("page:" + url)
+    if fetch.fresh(cached):
+        return cached["content"]
+    return fetch_pages([url])[url]
@@ -0,0 +1,199 @@
+from app import app
+from contextlib import contextmanager
+import numpy as np
+import hashlib
+import logging
+import fcntl
+import os
+
+logger = logging.getLogger(__name__)
+
+"""
+Persistent phrase embedding cache
+Candidate phrases repeat across a group's documents, so their embeddings
+are kept on disk and the model only runs on phrases it hasn't seen
+
+Files, one set per model, in PHRASE_CACHE_DIR:
+    - <model>.f16   memory mapped float16 matrix, one row per slot
+    - <model>.keys  memory mapped uint64 phrase hash per slot (0 is empty)
+    - <model>.ticks memory mapped int64 last use per slot, for LRU eviction
+    - <model>.meta  memory mapped int64 [dim, clock, hits, misses]
+    - <model>.lock  flock held while a process reads or changes the slots
+All worker processes share the files, each keeps its own hash to slot dict
+and rebuilds it when another process has changed the keys
+"""
+DIM, CLOCK, HITS, MISSES = range(4)
+
+def phrase_hash(phrase):
+    # 0 marks an empty slot, so keep the top bit set
+    return int.from_bytes(hashlib.blake2b(phrase.encode(), digest_size=8).digest(), "little") | (1 << 63)
+
+class PhraseCache:
+    def __init__(self, directory, model, capacity):
+        os.makedirs(directory, exist_ok=True)
+        self.base = os.path.join(directory, model.replace("/", "_"))
+        self.capacity = capacity
+        self.lock = open(self.base + ".lock", "a+")
+        self.matrix = None
+        self.slots = {}
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        with self.locked():
+            self.meta = self._map(".meta", np.int64, (4,))
+            self.keys = self._map(".keys", np.uint64, (capacity,))
+            self.ticks = self._map(".ticks", np.int64, (capacity,))
+            if self.meta[DIM]:
+                self._open_matrix(int(self.meta[DIM]))
+
+    def _map(self, suffix, dtype, shape):
+        path = self.base + suffix
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            with open(path, "wb") as f:
+                f.truncate(size)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    def _open_matrix(self, dim):
+        self.matrix = self._map(".f16", np.float16, (self.capacity, dim))
+
+    @contextmanager
+    def locked(self):
+        fcntl.flock(self.lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.lock, fcntl.LOCK_UN)
+
+    def _sync(self):
+        # Another process may have created or resized the matrix
+        dim = int(self.meta[DIM])
+        if dim and (self.matrix is None or self.matrix.shape[1] != dim):
+            self._open_matrix(dim)
+        # The sum of the keys changes whenever a slot is filled or evicted
+        generation = int(self.keys.sum(dtype=np.uint64))
+        if generation != self.generation:
+            filled = np.flatnonzero(self.keys)
+            self.slots = dict(zip(self.keys[filled].tolist(), filled.tolist()))
+            self.generation = generation
+
+    """
+    Look up phrases
+    Returns a float32 matrix with the cached rows filled in and the
+    positions of the phrases that still have to be embedded
+    """
+    def get(self, phrases):
+        hashes = [phrase_hash(phrase) for phrase in phrases]
+        with self.locked():
+            self._sync()
+            found = [(i, self.slots[h]) for i, h in enumerate(hashes) if h in self.slots]
+            missing = [i for i, h in enumerate(hashes) if h not in self.slots]
+            rows = None
+            if self.matrix is not None:
+                rows = np.zeros((len(phrases), self.matrix.shape[1]), dtype=np.float32)
+                if found:
+                    positions, slots = zip(*found)
+                    rows[list(positions)] = self.matrix[list(slots)]
+                    self.meta[CLOCK] += 1
+                    self.ticks[list(slots)] = self.meta[CLOCK]
+            self.meta[HITS] += len(found)
+            self.meta[MISSES] += len(missing)
+        self.hits += len(found)
+        self.misses += len(missing)
+        return rows, missing
+
+    """
+    Store embeddings for phrases
+    1. Skip phrases another process stored in the meantime
+    2. Fill empty slots first, then evict the least recently used ones
+    """
+    def put(self, phrases, embeddings):
+        if not phrases:
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        with self.locked():
+            if self.matrix is None or self.matrix.shape[1] != embeddings.shape[1]:
+                # First write, or the model changed its output size
+                self.keys[:] = 0
+                self.ticks[:] = 0
+                self.meta[DIM] = embeddings.shape[1]
+                self._open_matrix(embeddings.shape[1])
+            self._sync()
+            new = {}
+            for phrase, embedding in zip(phrases, embeddings):
+                h = phrase_hash(phrase)
+                if h not in self.slots:
+                    new[h] = embedding
+            new = list(new.items())[:self.capacity]
+            if not new:
+                return
+            free = np.flatnonzero(self.keys == 0)[:len(new)]
+            if len(free) < len(new):
+                used = np.flatnonzero(self.keys)
+                oldest = used[np.argpartition(self.ticks[used], len(new) - len(free) - 1)[:len(new) - len(free)]]
+                free = np.concatenate([free, oldest])
+            hashes, rows = zip(*new)
+            self.meta[CLOCK] += 1
+            self.matrix[free] = np.stack(rows).astype(np.float16)
+            self.keys[free] = np.array(hashes, dtype=np.uint64)
+            self.ticks[free] = self.meta[CLOCK]
+            self.matrix.flush()
+            self._sync()
+
+    def stats(self):
+        entries = int(np.count_nonzero(self.keys))
+        looked_up = int(self.meta[HITS] + self.meta[MISSES])
+        files = [self.base + suffix for suffix in (".f16", ".keys", ".ticks", ".meta")]
+        return {
+            "entries": entries,
+            "capacity": self.capacity,
+            "hits": int(self.meta[HITS]),
+            "misses": int(self.meta[MISSES]),
+            "hit_rate": round(int(self.meta[HITS]) / looked_up, 3) if looked_up else None,
+            "bytes_used": entries * int(self.meta[DIM]) * 2,
+            "bytes_on_disk": sum(os.path.getsize(path) for path in files if os.path.exists(path)),
+        }
+
+"""
+Embedder that serves candidate phrases from the cache
+Only phrases that miss are sent to the wrapped embedder
+"""
+class CachedEmbedder:
+    def __init__(self, embedder, cache):
+        self.embedder = embedder
+        self.cache = cache
+
+    def embed(self, documents, verbose=False):
+        rows, missing = self.cache.get(documents)
+        if missing:
+            texts = [documents[i] for i in missing]
+            embeddings = np.asarray(self.embedder.embed(texts), dtype=np.float32)
+            self.cache.put(texts, embeddings)
+            if rows is None:
+                rows = np.zeros((len(documents), embeddings.shape[1]), dtype=np.float32)
+            rows[missing] = embeddings
+        return rows
+
+_caches = {}
+
+"""
+Get the phrase cache for the configured model
+Returns None if PHRASE_CACHE_DIR is not set
+"""
+def get_cache():
+    directory = app.config.get("PHRASE_CACHE_DIR")
+    if not directory:
+        return None
+    model = app.config.get("KEYBERT_MODEL", "all-mpnet-base-v2")
+    key = (directory, model, os.getpid())
+    if key not in _caches:
+        _caches[key] = PhraseCache(directory, model, app.config.get("PHRASE_CACHE_CAPACITY", 200000))
+    return _caches[key]
+
+def wrap(embedder):
+    cache = get_cache()
+    return CachedEmbedder(embedder, cache) if cache is not None else embedder
+
+def stats():
+    cache = get_cache()
+    return cache.stats() if cache is not None else None
@@ -0,0 +1,417 @@
+from app import app, registry, phrasecache, fetch, pagefetch, timings
+from PyPDF2 import PdfReader
+from collections import Counter, deque
+from billiard import Pool, Process, Pipe
+from billiard.pool import TimeoutError as PoolTimeout
+from nltk.stem import PorterStemmer
+import numpy as np
+import webvtt
+import logging
+import html
+import os
+import signal
+import time
+from resource import setrlimit, RLIMIT_AS
+
+logger = logging.getLogger(__name__)
+ps = PorterStemmer()
+
+"""
+Keyword pipeline stages
+Extraction: resources are read as a stream of text pieces (pages, captions, lines)
+Chunking: pieces are packed into chunks of at most KEYWORD_CHUNK_CHARS characters
+Embedding: chunks are embedded in batches and averaged (weighted by length)
+into one document embedding, so nothing is lost to the model's token limit
+Selection: candidate phrases are counted per chunk, embedded in batches and
+only the KEYWORD_CANDIDATE_POOL most similar are kept for MMR
+Memory is bounded by the batch and pool sizes, not the document size
+"""
+
+"""
+Get the content from url
+1. If the url is a wikipedia page, get the article from the url cache
+   or in a batch with the other queued url resources
+2. Else if URL_FETCH_PAGES is set, get the page text, fetched concurrently
+   with the other queued url resources
+3. Else do nothing
+"""
+def prepare_url(resource):
+    content = ""
+    url = html.unescape(resource.data.strip())
+    title = fetch.wikipedia_title(url)
+    try:
+        if title:
+            fetch.prefetch_queued()
+            content = fetch.wikipedia([title])[title]
+        elif app.config.get("URL_FETCH_PAGES", False):
+            fetch.prefetch_queued()
+            content = pagefetch.page(url)
+    except:
+        logger.info("Could not get content from url %s", url)
+    return content
+
+"""
+Extract the text of pages [start, stop) of a pdf
+Runs in a pdf pool process, each process opens the file itself
+"""
+def extract_pages(path, start, stop):
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() for i in range(start, stop)]
+
+_pdf_pool = None
+
+"""
+Get the shared pdf extraction pool, created on first use
+Uses billiard (celery's fork of multiprocessing) as the stdlib pools can't
+start children from a daemonic prefork worker process
+Returns None if the pool is disabled or can't be started
+"""
+def pdf_pool():
+    global _pdf_pool
+    size = app.config.get("PDF_POOL_SIZE") or os.cpu_count() or 1
+    if _pdf_pool is None and size > 1:
+        try:
+            _pdf_pool = Pool(processes=size)
+        except (OSError, AssertionError, ValueError):
+            logger.warning("Could not start pdf extraction pool, extracting serially")
+            return None
+    return _pdf_pool
+
+"""
+Kill the pdf pool, used when a page range times out
+The stuck process can't be cancelled so the whole pool is replaced
+"""
+def reset_pdf_pool():
+    global _pdf_pool
+    pool = _pdf_pool
+    _pdf_pool = None
+    if pool is not None:
+        pool.terminate()
+
+"""
+Stream the text of a pdf, one page at a time
+1. Small pdfs (less than PDF_PARALLEL_MIN_PAGES pages) are read serially
+2. Larger pdfs are split into ranges of PDF_PAGES_PER_TASK pages
+3. Ranges are extracted in the pdf pool, at most two per pool process in flight
+4. Results are yielded in page order
+5. A range that takes longer than PDF_PAGE_TIMEOUT seconds per page is skipped
+"""
+def iter_material(resource):
+    reader = PdfReader(resource.data)
+    count = len(reader.pages)
+    pool = pdf_pool() if count >= app.config.get("PDF_PARALLEL_MIN_PAGES", 16) else None
+    if pool is None:
+        for page in reader.pages:
+            yield page.extract_text()
+        return
+    del reader
+    step = app.config.get("PDF_PAGES_PER_TASK", 8)
+    timeout = app.config.get("PDF_PAGE_TIMEOUT", 10)
+    window = pool._processes * 2
+    ranges = deque((start, min(start + step, count)) for start in range(0, count, step))
+    pending = deque()
+    while ranges or pending:
+        while ranges and len(pending) < window:
+            start, stop = ranges.popleft()
+            pending.append((start, stop, pool.apply_async(extract_pages, (resource.data, start, stop))))
+        start, stop, result = pending.popleft()
+        try:
+            pages = result.get(timeout=timeout * (stop - start))
+        except PoolTimeout:
+            logger.warning("Pages %d-%d of %s timed out, skipping", start, stop - 1, resource.data)
+            # Everything still pending was in the killed pool, run it again
+            ranges.extendleft(reversed([(s, e) for s, e, _ in pending]))
+            pending.clear()
+            reset_pdf_pool()
+            pool = pdf_pool()
+            if pool is None:
+                return
+            continue
+        for text in pages:
+            yield text
+
+class ExtractionFailed(Exception):
+    pass
+
+"""
+Virtual memory size of the current process in bytes
+"""
+def vm_bytes():
+    with open("/proc/self/statm", "r") as f:
+        return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+
+"""
+Body of the sandbox process
+1. Start a new process group so a timeout kills any pdf pool processes too
+2. Cap the address space at its current size plus EXTRACT_MEMORY_LIMIT
+   (the worker already maps the model, so an absolute cap would fail at once)
+3. Stream each piece of text back to the parent, then a done marker
+"""
+def _sandbox_main(conn, fn, resource, memory_limit):
+    global _pdf_pool
+    _pdf_pool = None
+    os.setpgrp()
+    try:
+        if memory_limit:
+            limit = vm_bytes() + memory_limit
+            setrlimit(RLIMIT_AS, (limit, limit))
+        for piece in fn(resource):
+            conn.send(("piece", piece))
+        conn.send(("done", None))
+    except BaseException as e:
+        try:
+            conn.send(("error", repr(e)))
+        except Exception:
+            pass
+    finally:
+        conn.close()
+
+"""
+Run an extraction generator in a child process with time and memory limits
+Pieces are streamed back as they are extracted
+Only the time spent waiting for the child counts against EXTRACT_TIMEOUT, the
+time the caller spends on each piece (embedding it) doesn't, as the child is
+then at most blocked on a full pipe
+Raises ExtractionFailed if the child times out, runs out of memory, crashes or raises
+"""
+def sandboxed(fn, resource):
+    if not app.config.get("EXTRACT_SANDBOX", True):
+        yield from fn(resource)
+        return
+    timeout = app.config.get("EXTRACT_TIMEOUT", 120)
+    memory_limit = app.config.get("EXTRACT_MEMORY_LIMIT", 1024 * 1024 * 1024)
+    parent, child = Pipe(duplex=False)
+    process = Process(target=_sandbox_main, args=(child, fn, resource, memory_limit), daemon=True)
+    process.start()
+    child.close()
+    waited = 0.0
+    try:
+        while True:
+            remaining = timeout - waited
+            start = time.monotonic()
+            ready = remaining > 0 and parent.poll(remaining)
+            waited += time.monotonic() - start
+            if not ready:
+                raise ExtractionFailed("Extraction of " + str(resource.data) + " timed out after " + str(timeout) + "s")
+            try:
+                kind, value = parent.recv()
+            except EOFError:
+                process.join(1)
+                raise ExtractionFailed("Extraction of " + str(resource.data) + " crashed (exit code " + str(process.exitcode) + ")")
+            if kind == "piece":
+                yield value
+            elif kind == "done":
+                return
+            else:
+                raise ExtractionFailed("Extraction of " + str(resource.data) + " failed: " + value)
+    finally:
+        parent.close()
+        if process.is_alive():
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                process.kill()
+        process.join(1)
+
+"""
+Stream the text of a transcript
+1. If the transcript is a txt file, yield it line by line
+2. Else if the transcript is a vtt file, yield each caption
+"""
+def iter_transcript(resource):
+    ext = resource.data.split(".")[-1]
+    if ext == "txt":
+        with open(resource.data, "r") as f:
+            for line in f:
+                yield line
+    elif ext == "vtt":
+        for caption in webvtt.read(resource.data):
+            yield caption.text
+
+"""
+Get the content from a transcript as one string
+"""
+def prepare_transcript(resource):
+    return " ".join(iter_transcript(resource))
+
+"""
+Pack a stream of text pieces into chunks of at most size characters
+Chunks break on whitespace, a single word longer than size is its own chunk
+"""
+def chunk_text(pieces, size=None):
+    size = size or app.config.get("KEYWORD_CHUNK_CHARS", 1500)
+    buf = []
+    length = 0
+    for piece in pieces:
+        for word in piece.split():
+            if buf and length + len(word) + 1 > size:
+                yield " ".join(buf)
+                buf = []
+                length = 0
+            buf.append(word)
+            length += len(word) + 1
+    if buf:
+        yield " ".join(buf)
+
+def _batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+"""
+Embed a stream of chunks
+1. Count candidate 1-2 gram phrases in each chunk
+2. Embed chunks in batches and keep a length weighted running sum
+3. Return the sum, the total weight and the candidate counts
+Returns (None, 0, counts) if there were no chunks
+"""
+def embed_sum(embedder, chunks, analyzer):
+    batch_size = app.config.get("KEYWORD_EMBED_BATCH", 16)
+    counts = Counter()
+    total = None
+    weight = 0
+    for batch in _batched(chunks, batch_size):
+        with timings.span("candidates"):
+            for chunk in batch:
+                counts.update(analyzer(chunk))
+        with timings.span("embed"):
+            embeddings = np.asarray(embedder.embed(batch), dtype=np.float32)
+        lengths = np.array([len(chunk) for chunk in batch], dtype=np.float32)
+        batch_sum = (embeddings * lengths[:, None]).sum(axis=0)
+        total = batch_sum if total is None else total + batch_sum
+        weight += float(lengths.sum())
+    return total, weight, counts
+
+"""
+Embed a stream of chunks into one normalized document embedding
+Returns (None, counts) if there were no chunks
+"""
+def embed_chunks(embedder, chunks, analyzer):
+    total, weight, counts = embed_sum(embedder, chunks, analyzer)
+    if total is None:
+        return None, counts
+    return _normalize(total / weight), counts
+
+"""
+Prefilter the candidate vocabulary before it is embedded
+1. Drop candidates made only of stopwords, digits or single characters
+2. On documents with more than max_candidates candidates, drop the ones
+   seen fewer than min_count times
+3. Collapse stem equivalent candidates, keeping the most frequent form
+4. Keep the max_candidates most frequent, earlier candidates win ties
+Returns the kept candidates, most frequent first
+"""
+def prefilter(counts, max_candidates=None, min_count=None):
+    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+    max_candidates = max_candidates or app.config.get("KEYWORD_MAX_CANDIDATES", 2000)
+    min_count = min_count or app.config.get("KEYWORD_MIN_COUNT", 2)
+    kept = Counter()
+    for term, count in counts.items():
+        words = term.split()
+        if all(word in ENGLISH_STOP_WORDS or word.isdigit() or len(word) < 2 for word in words):
+            continue
+        kept[term] = count
+    if len(kept) > max_candidates:
+        frequent = Counter({term: count for term, count in kept.items() if count >= min_count})
+        if frequent:
+            kept = frequent
+    forms = {}
+    totals = Counter()
+    for term, count in kept.items():
+        key = " ".join(ps.stem(word) for word in term.split())
+        if key not in forms or count > kept[forms[key]]:
+            forms[key] = term
+        totals[key] += count
+    # Counter keeps first seen order, sorted() is stable so position breaks ties
+    ranked = sorted(totals, key=lambda key: -totals[key])[:max_candidates]
+    candidates = [forms[key] for key in ranked]
+    logger.info("Keyword candidates prefiltered from %d to %d", len(counts), len(candidates))
+    return candidates
+
+"""
+Score candidates against the document in batches
+Only the pool_size most similar candidates (and their embeddings) are kept
+"""
+def candidate_pool(embedder, doc_embedding, candidates, pool_size):
+    words = []
+    embeddings = None
+    scores = np.zeros(0, dtype=np.float32)
+    for batch in _batched(candidates, 256):
+        with timings.span("embed_candidates"):
+            batch_embeddings = _normalize(np.asarray(embedder.embed(batch), dtype=np.float32))
+        batch_scores = batch_embeddings @ doc_embedding
+        words = words + batch
+        embeddings = batch_embeddings if embeddings is None else np.vstack([embeddings, batch_embeddings])
+        scores = np.concatenate([scores, batch_scores])
+        if len(words) > pool_size:
+            keep = np.argsort(-scores)[:pool_size]
+            words = [words[i] for i in keep]
+            embeddings = embeddings[keep]
+            scores = scores[keep]
+    return words, embeddings
+
+"""
+Select keywords for a document embedding and its candidate counts
+1. Prefilter the candidates to a bounded vocabulary
+2. Keep the candidates closest to the document, embedding only
+   phrases missing from the phrase cache
+3. Select a diverse set of keywords (see diversity.py)
+Returns a list of keywords, [] if no candidate survived the prefilter
+"""
+def select_keywords(embedder, doc_embedding, counts, top_n=10, diversity=0.5):
+    from app.diversity import select
+    with timings.span("candidates"):
+        candidates = prefilter(counts)
+    if not candidates:
+        return []
+    # Candidate phrases go through the persistent phrase cache when it is enabled
+    cached = phrasecache.wrap(embedder)
+    hits = cached.cache.hits if cached is not embedder else 0
+    words, embeddings = candidate_pool(cached, doc_embedding, candidates, app.config.get("KEYWORD_CANDIDATE_POOL", 100))
+    if cached is not embedder:
+        stats = cached.cache.stats()
+        logger.info("Phrase cache: %d of %d candidates cached, overall hit rate %s, %d bytes used",
+            cached.cache.hits - hits, len(candidates), stats["hit_rate"], stats["bytes_used"])
+    with timings.span("select"):
+        return list(dict(select(doc_embedding, embeddings, words, top_n, diversity)).keys())
+
+"""
+Analyzer that splits text into stopword filtered 1-2 gram candidates
+"""
+def candidate_analyzer():
+    from sklearn.feature_extraction.text import CountVectorizer
+    return CountVectorizer(ngram_range=(1, 2), stop_words='english').build_analyzer()
+
+"""
+Use keyBERT to extract keywords from a stream of text pieces
+The model is shared through the registry, so it is only loaded once per worker
+1. Chunk the pieces and embed them into one document embedding
+2. Select keywords from the candidates
+Returns None if there is no text and [] if extraction fails
+"""
+def keybert_exec(pieces, top_n=10, diversity=0.5):
+    if isinstance(pieces, str):
+        pieces = [pieces]
+    try:
+        with timings.span("model_load"):
+            embedder = registry.get_model().model
+        doc_embedding, counts = embed_chunks(embedder, chunk_text(pieces), candidate_analyzer())
+        if doc_embedding is None:
+            return None
+        return select_keywords(embedder, doc_embedding, counts, top_n, diversity)
+    except ExtractionFailed as e:
+        logger.warning("Extraction failed: %s", e)
+        return []
+    except Exception:
+        logger.exception("Keyword extraction failed")
+        return []
@@ -0,0 +1,207 @@
+from app import db, models, indexcache, ranking
+from collections import Counter
+from nltk.stem import PorterStemmer
+from sqlalchemy import insert, update, select, func
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+ps = PorterStemmer()
+
+"""
+Inverted index of the resources in each folder
+One posting per (term, folder, resource, field) with the term's count, so
+    - indexing a resource field touches only that field's rows
+    - a lookup reads the (folder, term) index for the query terms only
+Terms are lowercased Porter stems, the same for indexing and queries
+Postings also carry the folder's group, a group search reads the (group, term)
+index once instead of every folder's postings
+Every write bumps the version of the folders it touched and of their groups,
+searches answer from the per process index cache while the version holds (see
+indexcache.py)
+Callers commit, like the other writes in the views
+Searches are ranked with BM25 (see ranking.py)
+"""
+FIELDS = ("title", "heading", "keyword")
+
+def stems(text):
+    return [ps.stem(word) for word in text.lower().split()]
+
+def bump(folder_ids):
+    if folder_ids:
+        folder_ids = list(folder_ids)
+        db.session.execute(update(models.SearchTree)
+            .where(models.SearchTree.folder.in_(folder_ids))
+            .values(version=func.coalesce(models.SearchTree.version, 0) + 1)
+            .execution_options(synchronize_session=False))
+        db.session.execute(update(models.Group)
+            .where(models.Group.id.in_(select(models.Folder.group).where(models.Folder.id.in_(folder_ids))))
+            .values(index_version=func.coalesce(models.Group.index_version, 0) + 1)
+            .execution_options(synchronize_session=False))
+
+"""
+Replace the postings of one field of a resource
+texts is a list of strings (a title, headings or keywords)
+"""
+def set_field(folder_id, resource_id, field, texts):
+    remove(resource_id, [field])
+    bump([folder_id])
+    group_id = db.session.query(models.Folder.group).filter(models.Folder.id == folder_id).scalar()
+    counts = Counter()
+    for text in texts:
+        counts.update(stems(text))
+    length = sum(counts.values())
+    if counts:
+        db.session.execute(insert(models.Posting), [
+            {"term": term, "folder": folder_id, "group": group_id, "resource": resource_id, "field": field, "tf": tf, "length": length}
+            for term, tf in counts.items()
+        ])
+    return len(counts)
+
+"""
+Remove the postings of a resource, of the given fields or all of them
+"""
+def remove(resource_id, fields=None):
+    query = models.Posting.query.filter(models.Posting.resource == resource_id)
+    if fields:
+        query = query.filter(models.Posting.field.in_(fields))
+    bump([row[0] for row in query.with_entities(models.Posting.folder).distinct().all()])
+    query.delete(synchronize_session=False)
+
+def remove_folder(folder_id):
+    bump([folder_id])
+    models.Posting.query.filter(models.Posting.folder == folder_id).delete(synchronize_session=False)
+
+"""
+Postings of a scope (a folder, some folders or a group) for ranking
+terms maps a term to an int32 array of (resource, field, tf, length) rows,
+with field as its position in FIELDS
+df is the number of resources each term is in, bounds the largest tf and
+shortest field length of each term per field, docs the number of resources
+in the scope, field_docs and field_length the number of resources having
+each field and the total of their lengths
+A cached index holds every term of the scope, a partial one only the query's
+terms but still the statistics of the whole scope
+"""
+class Index:
+    def __init__(self, rows, docs=None, field_docs=None, field_length=None):
+        grouped = {}
+        lengths = {}
+        for term, resource, field, tf, length in rows:
+            if field not in FIELDS:
+                continue
+            code = FIELDS.index(field)
+            grouped.setdefault(term, []).append((resource, code, tf, length or 0))
+            lengths[(resource, code)] = length or 0
+        self.terms = {term: np.array(postings, dtype=np.int32) for term, postings in grouped.items()}
+        self.df = {term: len(np.unique(postings[:, 0])) for term, postings in self.terms.items()}
+        self.bounds = {term: _bounds(postings) for term, postings in self.terms.items()}
+        if docs is None:
+            docs = len({resource for resource, _ in lengths})
+            field_docs = np.zeros(len(FIELDS))
+            field_length = np.zeros(len(FIELDS))
+            for (_, code), length in lengths.items():
+                field_docs[code] += 1
+                field_length[code] += length
+        self.docs = docs
+        self.field_docs = field_docs
+        self.field_length = field_length
+
+    @property
+    def nbytes(self):
+        return sum(indexcache.TERM_BYTES * 2 + len(term) + postings.nbytes + self.bounds[term].nbytes
+            for term, postings in self.terms.items())
+
+"""
+Largest tf and shortest field length of a term's postings in each field,
+what ranking.top() bounds the term's score with
+"""
+def _bounds(postings):
+    max_tf = np.zeros(len(FIELDS))
+    min_length = np.full(len(FIELDS), np.inf)
+    np.maximum.at(max_tf, postings[:, 1], postings[:, 2])
+    np.minimum.at(min_length, postings[:, 1], postings[:, 3])
+    return np.vstack([max_tf, min_length])
+
+def _postings():
+    return db.session.query(models.Posting.term, models.Posting.resource, models.Posting.field,
+        models.Posting.tf, models.Posting.length)
+
+"""
+Statistics of the postings matching condition, for a partial index
+"""
+def _stats(condition):
+    fields = db.session.query(models.Posting.resource, models.Posting.field, models.Posting.length) \
+        .filter(condition).distinct().subquery()
+    field_docs = np.zeros(len(FIELDS))
+    field_length = np.zeros(len(FIELDS))
+    for field, count, total in db.session.query(fields.c.field, func.count(), func.sum(fields.c.length)).group_by(fields.c.field):
+        if field in FIELDS:
+            field_docs[FIELDS.index(field)] = count
+            field_length[FIELDS.index(field)] = total or 0
+    docs = db.session.query(func.count(func.distinct(models.Posting.resource))).filter(condition).scalar()
+    return docs, field_docs, field_length
+
+def _partial(condition, terms):
+    return Index(_postings().filter(condition, models.Posting.term.in_(terms)).all(), *_stats(condition))
+
+"""
+Load every posting of a folder, or of a group, into an Index
+"""
+def load(folder_id):
+    return Index(_postings().filter(models.Posting.folder == folder_id).order_by(models.Posting.id).all())
+
+def load_group(group_id):
+    return Index(_postings().filter(models.Posting.group == group_id).order_by(models.Posting.id).all())
+
+"""
+Get the indexes to search folders with
+1. Read the index version of each folder
+2. Take folders with a version from the index cache, loading them on a miss
+3. Read the query terms of folders without one (no SearchTree row) into a
+   partial index
+"""
+def indexes(folder_ids, terms):
+    if not folder_ids or not terms:
+        return []
+    terms = list(set(terms))
+    versions = dict(db.session.query(models.SearchTree.folder, models.SearchTree.version)
+        .filter(models.SearchTree.folder.in_(list(folder_ids))).all())
+    cache = indexcache.get_cache()
+    found = []
+    uncached = []
+    for folder_id in folder_ids:
+        if folder_id not in versions or not cache.budget:
+            uncached.append(folder_id)
+            continue
+        found.append(cache.get(("folder", folder_id), versions[folder_id] or 0, lambda: load(folder_id)))
+    if uncached:
+        found.append(_partial(models.Posting.folder.in_(uncached), terms))
+    return found
+
+"""
+Get the index to search a group with, the same way as indexes() with the
+group's version and the group's postings
+"""
+def group_indexes(group_id, terms):
+    if group_id is None or not terms:
+        return []
+    terms = list(set(terms))
+    version = db.session.query(models.Group.index_version).filter(models.Group.id == group_id).scalar()
+    cache = indexcache.get_cache()
+    if not cache.budget:
+        return [_partial(models.Posting.group == group_id, terms)]
+    return [cache.get(("group", group_id), version or 0, lambda: load_group(group_id))]
+
+"""
+Get one page of the ranking of folders, or of a group, for a query
+Returns (list of (resource id, score) from offset to offset + k, whether
+there are more results), see ranking.top()
+"""
+def top(folder_ids, query, k, offset=0):
+    words = stems(query)
+    return ranking.top(indexes(folder_ids, words), words, FIELDS, k, offset)
+
+def top_group(group_id, query, k, offset=0):
+    words = stems(query)
+    return ranking.top(group_indexes(group_id, words), words, FIELDS, k, offset)
@@ -0,0 +1,152 @@
+from app import app
+from collections import Counter
+import numpy as np
+import heapq
+import logging
+
+logger = logging.getLogger(__name__)
+
+"""
+Okapi BM25 ranking of search results over the posting fields (BM25F)
+For a query term t and resource d
+    tf(t, d) = sum over fields f of weight(f) * tf(t, d, f) / (1 - b + b * length(d, f) / avglength(f))
+    score(t, d) = idf(t) * tf(t, d) * (k1 + 1) / (k1 + tf(t, d))
+    idf(t) = log(1 + (docs - df(t) + 0.5) / (df(t) + 0.5))
+and a resource's score is the sum over the query terms (repeated words count
+again), so a title match weighs more than a keyword and long fields less
+Field weights come from SEARCH_FIELD_WEIGHTS, k1 and b from SEARCH_BM25_K1 and
+SEARCH_BM25_B. Document frequencies and lengths come with the indexes (see
+postings.Index), each query term is scored with numpy over all its postings
+Search pages use top(), which only scores the postings of resources that can
+still reach the page (MaxScore) and keeps only the best offset + k results
+"""
+
+"""
+Weight of each field, in the order of postings.FIELDS
+"""
+def weights(fields):
+    configured = app.config.get("SEARCH_FIELD_WEIGHTS", {})
+    return np.array([float(configured.get(field, 0)) for field in fields])
+
+"""
+Scope statistics of a search over some indexes and the ranking settings
+"""
+class Scope:
+    def __init__(self, indexes, fields):
+        self.indexes = indexes
+        self.k1 = app.config.get("SEARCH_BM25_K1", 1.2)
+        self.b = app.config.get("SEARCH_BM25_B", 0.75)
+        self.weights = weights(fields)
+        self.docs = sum(index.docs for index in indexes)
+        field_docs = sum(index.field_docs for index in indexes)
+        field_length = sum(index.field_length for index in indexes)
+        self.avglength = np.maximum(field_length / np.maximum(field_docs, 1), 1)
+
+    def postings(self, term):
+        postings = [index.terms[term] for index in self.indexes if term in index.terms]
+        return np.concatenate(postings) if postings else None
+
+    def idf(self, term):
+        df = sum(index.df.get(term, 0) for index in self.indexes)
+        return np.log(1 + (self.docs - df + 0.5) / (df + 0.5))
+
+    def saturate(self, tf):
+        return tf * (self.k1 + 1) / (self.k1 + tf)
+
+    """
+    Highest score a resource can get from a term, from the term's largest tf
+    and shortest field length in each field (postings.Index.bounds), without
+    reading its postings
+    """
+    def bound(self, term, idf, count):
+        bounds = [index.bounds[term] for index in self.indexes if term in index.bounds]
+        max_tf = np.max([bound[0] for bound in bounds], axis=0)
+        min_length = np.min([bound[1] for bound in bounds], axis=0)
+        present = max_tf > 0
+        norm = 1 - self.b + self.b * min_length[present] / self.avglength[present]
+        tf = float(np.sum(self.weights[present] * max_tf[present] / norm))
+        return float(count * idf * self.saturate(tf))
+
+"""
+Score postings of a term, weight and normalize them per field and sum them
+per resource, then saturate and scale by the term's idf
+Returns (resource ids, scores) of the resources with a score
+"""
+def score_postings(scope, postings, idf, count):
+    codes = postings[:, 1]
+    norm = 1 - scope.b + scope.b * postings[:, 3] / scope.avglength[codes]
+    weighted = scope.weights[codes] * postings[:, 2] / norm
+    resources, inverse = np.unique(postings[:, 0], return_inverse=True)
+    tf = np.bincount(inverse, weights=weighted)
+    keep = tf > 0
+    return resources[keep], count * idf * scope.saturate(tf[keep])
+
+def _add(resources, scores, more_resources, more_scores):
+    resources, inverse = np.unique(np.concatenate([resources, more_resources]), return_inverse=True)
+    return resources, np.bincount(inverse, weights=np.concatenate([scores, more_scores]))
+
+"""
+Score the resources of some indexes for query terms
+Returns (resource ids, scores) arrays, unsorted
+"""
+def score(indexes, terms, fields):
+    scope = Scope(indexes, fields)
+    resources, scores = np.array([], dtype=np.int32), np.array([])
+    for term, count in Counter(terms).items():
+        postings = scope.postings(term)
+        if postings is not None:
+            resources, scores = _add(resources, scores, *score_postings(scope, postings, scope.idf(term), count))
+    return resources, scores
+
+"""
+Rank the resources of some indexes for query terms, fields names the posting
+field codes (postings.FIELDS)
+Returns a list of (resource id, score), best first, ties by resource id
+"""
+def rank(indexes, terms, fields):
+    resources, scores = score(indexes, terms, fields)
+    order = np.lexsort((resources, -scores))
+    return [(int(resources[i]), round(float(scores[i]), 4)) for i in order]
+
+"""
+Get one page of the ranking, results offset to offset + k (MaxScore)
+Terms are taken from the highest bound down (Scope.bound, computed without
+reading postings), keeping the running score of each candidate
+need = offset + k + 1 results are wanted (one more tells if there is a next
+page), the need-th best running score is a floor for the final need-th score
+as scores only grow, so
+    - once the bounds of the terms left add up to less than the floor, a
+      resource without a score yet can't get in, the terms left are scored
+      only on the postings of the current candidates
+    - a candidate below the floor even with every bound left is dropped,
+      one at or above it never is (ties are broken by resource id later)
+remaining is kept at 0 or more, subtracting the bounds leaves float error
+The winners are picked with a heap of need entries
+Returns (list of (resource id, score), whether there are more results)
+"""
+def top(indexes, terms, fields, k, offset=0):
+    need = offset + k + 1
+    scope = Scope(indexes, fields)
+    queued = []
+    for term, count in Counter(terms).items():
+        postings = scope.postings(term)
+        if postings is not None:
+            idf = scope.idf(term)
+            queued.append((scope.bound(term, idf, count), postings, idf, count))
+    queued.sort(key=lambda term: -term[0])
+    remaining = sum(bound for bound, _, _, _ in queued)
+    resources, scores = np.array([], dtype=np.int32), np.array([])
+    floor = 0.0
+    for bound, postings, idf, count in queued:
+        if len(resources) >= need and remaining < floor:
+            postings = postings[np.isin(postings[:, 0], resources)]
+        if len(postings):
+            resources, scores = _add(resources, scores, *score_postings(scope, postings, idf, count))
+        remaining = max(remaining - bound, 0.0)
+        if len(resources) >= need:
+            floor = np.partition(scores, -need)[-need]
+            alive = (scores >= floor) | (scores + remaining >= floor)
+            resources, scores = resources[alive], scores[alive]
+    winners = heapq.nlargest(need, zip(scores.tolist(), (-resources).tolist()))
+    page = [(-resource, round(score, 4)) for score, resource in winners[offset:offset + k]]
+    return page, len(winners) > offset + k
@@ -0,0 +1,152 @@
+from app import app, celery
+from celery.signals import worker_init, worker_process_init
+from celery.worker.control import inspect_command
+import logging
+import threading
+import resource
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+"""
+Process wide keyword model registry
+The KeyBERT model is loaded once per process and kept warm
+Celery workers load it in the parent process before the pool forks
+so the children share the weights copy-on-write
+"""
+_lock = threading.Lock()
+_model = None
+_stats = {
+    "model": None,
+    "backend": None,
+    "warm": False,
+    "load_seconds": None,
+    "loaded_at": None,
+    "pid": None,
+}
+
+"""
+Get resident memory of the current process in bytes
+Reads /proc when available, falls back to peak rss from getrusage
+"""
+def rss_bytes():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+"""
+Load the local KeyBERT model if it is not already loaded
+1. If already warm, return the cached model
+2. Else construct the model and record the load time
+3. Return the model
+"""
+def load_local_model():
+    global _model
+    if _model is not None:
+        return _model
+    with _lock:
+        if _model is None:
+            from keybert import KeyBERT
+            name = app.config.get("KEYBERT_MODEL", "all-mpnet-base-v2")
+            start = time.perf_counter()
+            _model = KeyBERT(model=name)
+            _stats["model"] = name
+            _stats["backend"] = "local"
+            _stats["warm"] = True
+            _stats["load_seconds"] = round(time.perf_counter() - start, 3)
+            _stats["loaded_at"] = time.time()
+            _stats["pid"] = os.getpid()
+            logger.info("Keyword model %s loaded in %ss (pid %s, rss %s bytes)", name, _stats["load_seconds"], os.getpid(), rss_bytes())
+    return _model
+
+"""
+Load the keyword model used by the pipeline
+If an inference server is configured, KeyBERT is backed by the server
+and no weights are loaded in this process
+"""
+def load_model():
+    global _model
+    address = app.config.get("INFERENCE_ADDRESS")
+    if not address:
+        return load_local_model()
+    if _model is not None:
+        return _model
+    with _lock:
+        if _model is None:
+            from keybert import KeyBERT
+            from app.inference import RemoteEmbedder
+            _model = KeyBERT(model=RemoteEmbedder(address))
+            _stats["model"] = app.config.get("KEYBERT_MODEL", "all-mpnet-base-v2")
+            _stats["backend"] = "remote " + address
+            _stats["warm"] = True
+            _stats["load_seconds"] = 0.0
+            _stats["loaded_at"] = time.time()
+            _stats["pid"] = os.getpid()
+            logger.info("Keyword model served by inference server at %s", address)
+    return _model
+
+"""
+Get the keyword model, loading it on first use (cold start)
+"""
+def get_model():
+    if _model is None:
+        logger.warning("Keyword model requested while cold, loading in pid %s", os.getpid())
+    return load_model()
+
+"""
+Get the registry stats for this process
+Includes load time, resident memory and whether the model is warm
+"""
+def model_stats():
+    stats = dict(_stats)
+    stats["warm"] = _model is not None
+    stats["pid"] = os.getpid()
+    stats["rss_bytes"] = rss_bytes()
+    return stats
+
+"""
+Reply to the model_stats remote control command with a worker's registry stats
+Answered by the worker's parent process, which holds the preloaded model
+"""
+@inspect_command(name="model_stats")
+def inspect_model_stats(state, **kwargs):
+    return model_stats()
+
+"""
+Ask the celery workers for their registry stats
+Returns {worker name: stats} of the workers replying within timeout
+"""
+def worker_model_stats(timeout=1.0):
+    replies = celery.control.broadcast("model_stats", reply=True, timeout=timeout)
+    return {name: stats for reply in replies or [] for name, stats in reply.items()}
+
+"""
+Does a worker consume the queue of the extract stage, the only one using the model
+Workers started without -Q consume every queue
+"""
+def runs_extract(worker):
+    from app import jobs
+    queues = worker.app.amqp.queues if worker is not None else None
+    if queues is None or queues.consume_from is queues:
+        return True
+    return jobs.pool("extract") in queues.consume_from
+
+# Load before the prefork pool is created so the children inherit the model
+# io workers (fetch and persist) never embed, they skip it
+@worker_init.connect
+def preload_model(sender=None, **kwargs):
+    from app import extractors
+    if not runs_extract(sender):
+        logger.info("Worker doesn't run the extract stage, not preloading the keyword model")
+        return
+    if app.config.get("KEYBERT_PRELOAD", True) and not app.config.get("INFERENCE_ADDRESS") and extractors.uses_model():
+        load_model()
+
+@worker_process_init.connect
+def report_child_model(**kwargs):
+    stats = model_stats()
+    logger.info("Worker child %s started, keyword model warm: %s, rss %s bytes", stats["pid"], stats["warm"], stats["rss_bytes"])
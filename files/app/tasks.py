@@ -0,0 +1,145 @@
+from app import app, db, celery
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import threading
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+"""
+Task backends for the keyword pipeline
+TASK_BACKEND picks where stage tasks run:
+    - 'celery' (always the broker, workers run with -Q io / -Q cpu)
+    - 'local' (pools in this process)
+    - 'auto' (celery while the broker answers, else local)
+In auto the broker is checked at most every TASK_BROKER_CHECK_SECONDS with a
+TASK_BROKER_TIMEOUT connect timeout, a failed publish marks it down too, so
+/generate never waits on broker retries
+
+Local pools follow Flask-Executor's settings: the cpu pool uses EXECUTOR_TYPE
+('thread' or 'process') and EXECUTOR_MAX_WORKERS, the io pool IO_EXECUTOR_TYPE
+and IO_EXECUTOR_MAX_WORKERS. Flask-Executor itself isn't used as its submit
+needs a request context, and stages hand jobs on from worker threads
+Local tasks run the same task body as the celery worker would, jobs are still
+claimed from the queue table so a restart loses nothing
+"""
+_pools = {}
+_pools_pid = None
+_pending = set()
+_lock = threading.Lock()
+_broker = {"up": None, "checked": 0.0}
+
+"""
+Check the broker with one short connection attempt
+"""
+def broker_available():
+    now = time.monotonic()
+    if _broker["up"] is not None and now - _broker["checked"] < app.config.get("TASK_BROKER_CHECK_SECONDS", 30):
+        return _broker["up"]
+    celery.conf.broker_connection_timeout = app.config.get("TASK_BROKER_TIMEOUT", 1)
+    try:
+        with celery.connection_for_write() as connection:
+            connection.ensure_connection(max_retries=0)
+        up = True
+    except Exception as e:
+        logger.warning("Task broker unreachable, running tasks locally: %s", e)
+        up = False
+    _broker.update(up=up, checked=now)
+    return up
+
+def broker_down():
+    _broker.update(up=False, checked=time.monotonic())
+
+"""
+Backend tasks are sent to right now, 'celery' or 'local'
+"""
+def backend():
+    setting = app.config.get("TASK_BACKEND", "auto")
+    if setting in ("celery", "local"):
+        return setting
+    return "celery" if broker_available() else "local"
+
+def _process_init():
+    # Connections inherited from the parent can't be shared with it
+    db.engine.dispose(close=False)
+
+def executor(name):
+    global _pools_pid
+    with _lock:
+        if _pools_pid != os.getpid():
+            _pools.clear()
+            _pending.clear()
+            _pools_pid = os.getpid()
+        if name not in _pools:
+            prefix = "IO_" if name == "io" else ""
+            kind = app.config.get(prefix + "EXECUTOR_TYPE", "thread")
+            workers = app.config.get(prefix + "EXECUTOR_MAX_WORKERS")
+            workers = int(workers) if workers is not None else None
+            if kind == "thread":
+                _pools[name] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tasks-" + name)
+            elif kind == "process":
+                _pools[name] = ProcessPoolExecutor(max_workers=workers, initializer=_process_init)
+            else:
+                raise ValueError(str(kind) + " is not a valid executor type.")
+        return _pools[name]
+
+def _run(name, args):
+    with app.app_context():
+        return celery.tasks[name](*args)
+
+def _done(future):
+    with _lock:
+        _pending.discard(future)
+    error = future.exception()
+    if error is not None and app.config.get("EXECUTOR_PROPAGATE_EXCEPTIONS", False):
+        logger.error("Local task failed", exc_info=error)
+
+def _submit_local(task, pool_name, args):
+    future = executor(pool_name).submit(_run, task.name, args)
+    with _lock:
+        _pending.add(future)
+    future.add_done_callback(_done)
+    return future
+
+"""
+Run a celery task on the current backend
+1. With celery, publish it without publish retries (the broker was just checked)
+2. If the publish fails, mark the broker down and run it locally
+3. Locally, run it on the named pool, after countdown seconds if given
+Returns the backend used
+"""
+def submit(task, *args, pool="cpu", countdown=None):
+    if backend() == "celery":
+        try:
+            task.apply_async(args, countdown=countdown, retry=False)
+            return "celery"
+        except Exception as e:
+            logger.warning("Could not publish %s, running it locally: %s", task.name, e)
+            broker_down()
+    if countdown:
+        timer = threading.Timer(countdown, _submit_local, (task, pool, args))
+        timer.daemon = True
+        timer.start()
+    else:
+        _submit_local(task, pool, args)
+    return "local"
+
+"""
+Wait until no local task is running or queued, including tasks they submit
+Returns False if timeout seconds passed first
+"""
+def join(timeout=None):
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        with _lock:
+            pending = list(_pending)
+        if not pending:
+            return True
+        for future in pending:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                future.result(remaining)
+            except Exception:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
@@ -0,0 +1,155 @@
+from app import app, db, models
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import numpy as np
+import threading
+import logging
+import json
+import time
+
+logger = logging.getLogger(__name__)
+
+"""
+Per job timing spans for the keyword pipeline
+A stage runs a job inside recording(), the pipeline marks its steps with
+span(name) or timed(name, pieces) and the times are added up by name
+Outside a recording both do nothing but run the code, so extraction called
+from elsewhere (tests, benchmarks) isn't affected
+
+When the stage finishes the spans are logged as one json line and saved to
+the job_span table, summary() aggregates them for the admin pipeline page
+Spans of a failed attempt are dropped, the retry records its own
+"""
+_local = threading.local()
+
+class Recorder:
+    def __init__(self):
+        self.spans = {}
+
+    def add(self, name, seconds, chars=None):
+        total = self.spans.setdefault(name, [0.0, None])
+        total[0] += seconds
+        if chars is not None:
+            total[1] = (total[1] or 0) + chars
+
+class Span:
+    def __init__(self):
+        self.chars = None
+
+def current():
+    return getattr(_local, "recorder", None)
+
+@contextmanager
+def recording():
+    previous = current()
+    recorder = Recorder()
+    _local.recorder = recorder
+    try:
+        yield recorder
+    finally:
+        _local.recorder = previous
+
+"""
+Time the body of the with block under name
+Set .chars on the yielded span to record the amount of text handled
+"""
+@contextmanager
+def span(name):
+    recorder = current()
+    handle = Span()
+    start = time.perf_counter()
+    try:
+        yield handle
+    finally:
+        if recorder is not None:
+            recorder.add(name, time.perf_counter() - start, handle.chars)
+
+"""
+Time producing a stream of text pieces, counting their characters
+Only the time spent inside the stream is counted, not the consumer's
+"""
+def timed(name, pieces):
+    recorder = current()
+    if recorder is None:
+        yield from pieces
+        return
+    pieces = iter(pieces)
+    seconds = 0.0
+    chars = 0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                piece = next(pieces)
+            except StopIteration:
+                seconds += time.perf_counter() - start
+                break
+            seconds += time.perf_counter() - start
+            chars += len(piece)
+            yield piece
+    finally:
+        recorder.add(name, seconds, chars)
+
+"""
+Save the spans of a finished stage
+1. Log them as one json line
+2. Add a row per span, plus the queue wait and the stage total
+3. Drop rows older than TIMING_RETENTION_HOURS
+"""
+def save(job_id, resource_id, stage, recorder, wait, total):
+    spans = dict(recorder.spans)
+    spans["wait"] = [wait, None]
+    spans["total"] = [total, None]
+    logger.info("Job %s %s stage spans %s", job_id, stage, json.dumps({
+        "job": job_id, "resource": resource_id, "stage": stage,
+        "spans": {name: round(seconds, 4) for name, (seconds, _) in spans.items()},
+    }))
+    now = datetime.now()
+    for name, (seconds, chars) in spans.items():
+        db.session.add(models.JobSpan(job=job_id, resource=resource_id, stage=stage, name=name,
+            seconds=seconds, chars=chars, finished=now))
+    cutoff = now - timedelta(hours=app.config.get("TIMING_RETENTION_HOURS", 168))
+    models.JobSpan.query.filter(models.JobSpan.finished < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+
+"""
+Aggregate the spans of the last window_minutes
+1. p50, p95 and mean seconds of every stage and span name
+2. Documents per minute, from jobs finishing the persist stage
+3. Characters per second, prepared text over time in the extract stage
+"""
+def summary(window_minutes=None):
+    window_minutes = window_minutes or app.config.get("TIMING_WINDOW_MINUTES", 60)
+    since = datetime.now() - timedelta(minutes=window_minutes)
+    rows = db.session.query(models.JobSpan.stage, models.JobSpan.name, models.JobSpan.seconds, models.JobSpan.chars) \
+        .filter(models.JobSpan.finished >= since).all()
+    grouped = {}
+    chars = 0
+    documents = 0
+    extract_seconds = 0.0
+    for stage, name, seconds, count in rows:
+        grouped.setdefault((stage, name), []).append(seconds)
+        if stage == "extract" and name.startswith("prepare_") and count:
+            chars += count
+        if name == "total" and stage == "extract":
+            extract_seconds += seconds
+        if name == "total" and stage == "persist":
+            documents += 1
+    spans = []
+    for (stage, name), values in sorted(grouped.items()):
+        values = np.array(values)
+        spans.append({
+            "stage": stage,
+            "name": name,
+            "count": len(values),
+            "p50": round(float(np.percentile(values, 50)), 4),
+            "p95": round(float(np.percentile(values, 95)), 4),
+            "mean": round(float(values.mean()), 4),
+        })
+    return {
+        "window_minutes": window_minutes,
+        "documents": documents,
+        "docs_per_minute": round(documents / window_minutes, 3),
+        "chars_per_second": round(chars / extract_seconds, 1) if extract_seconds else None,
+        "spans": spans,
+    }
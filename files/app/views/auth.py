@@ -1,5 +1,5 @@
 from datetime import datetime, timedelta
-from app import app, db, models, admin, mail
+from app import app, db, models, admin, mail, postings
 from flask_admin.contrib.sqla import ModelView
 from flask import render_template, request, flash, redirect, url_for, Markup
 from flask_login import current_user, login_user, logout_user, login_required
@@ -33,6 +33,8 @@ admin.add_view(CustomModelView(models.Keywords, db.session))
 admin.add_view(CustomModelView(models.Queue, db.session))
 admin.add_view(CustomModelView(models.Report, db.session, ))
 admin.add_view(CustomModelView(models.SearchTree, db.session))
+admin.add_view(CustomModelView(models.Posting, db.session))
+admin.add_view(CustomModelView(models.KeywordCache, db.session))
 
 # Decorator to check if user is logged in
 def logged_out_only(func):
@@ -139,10 +141,12 @@ def deleteAccount():
                 tree = models.SearchTree.query.filter_by(folder=folder.id).first()
                 if tree:
                     db.session.delete(tree)
+                postings.remove_folder(folder.id)
                 resources = models.Resource.query.filter_by(folder=folder.id).all()
                 for resource in resources:
                     models.Review.query.filter_by(resource=resource.id).delete()
                     models.Keywords.query.filter_by(resource=resource.id).delete()
+                    models.NoteSection.query.filter_by(resource=resource.id).delete()
                     if resource.type == "material" or resource.type == "transcript":
                         os.remove(resource.data)
                     db.session.delete(resource)
@@ -155,6 +159,8 @@ def deleteAccount():
         resources = models.Resource.query.filter_by(creator=current_user.id).all()
         for resource in resources:
             models.Keywords.query.filter_by(resource=resource.id).delete()
+            models.NoteSection.query.filter_by(resource=resource.id).delete()
+            postings.remove(resource.id)
             if resource.type == "material" or resource.type == "transcript":
                 os.remove(resource.data)
             db.session.delete(resource)
@@ -1,4 +1,4 @@
-from app import app, db, models
+from app import app, db, models, postings
 from flask import render_template, request, flash, redirect, url_for, send_file
 from flask_login import current_user, login_required
 from ..forms import *
@@ -11,41 +11,17 @@ from werkzeug.utils import secure_filename
 import os
 import math
 from ..scripts import *
-from nltk.stem import PorterStemmer
 
 logger = logging.getLogger(__name__)
-ps = PorterStemmer()
 
 """
-Adds resource title+id to the tree for a given folder
-Gets the tree from the database
-Splits the title into individual words
-Stems each word
-For each stem, if the stem is not in the tree, add it with the resource id
-If the stem is in the tree, add the resource id to the list of resources
-Updates the tree in the database
+Adds resource title+id to the search index for a given folder
+Replaces the title postings of the resource (see postings.py)
+Only the title's terms are written, the rest of the folder isn't read
 """
 def add_res_title_tree(title, folder_id, resource_id):
-    with app.app_context():
-        SearchTreeDB = models.SearchTree.query.filter_by(folder=folder_id).first()
-    tree = {}
-    if SearchTreeDB.json != "":
-        json.loads(SearchTreeDB.json)
-    stems = []
-    words = title.split(" ")
-    for w in words:
-        stems.append(ps.stem(w.lower()))
-    for stem in stems:
-        if stem not in tree:
-            tree[stem] =  [resource_id]
-        else:
-            resources = tree[stem]
-            if resource_id not in resources:
-                tree[stem].append(resource_id)
-    SearchTreeDB.json = json.dumps(tree)
-    with app.app_context():
-        db.session.add(SearchTreeDB)
-        db.session.commit()
+    postings.set_field(folder_id, resource_id, "title", [title])
+    db.session.commit()
 
 """
 Home Page
@@ -688,9 +664,9 @@ def edit_notes():
         Keywords = models.Keywords.query.filter_by(resource=id).all()
         for keyword in Keywords:
             db.session.delete(keyword)
-        queue = models.Queue.query.filter_by(resource=id).first()
-        if queue:
-            db.session.delete(queue)
+        models.Queue.query.filter_by(resource=id).delete()
+        # The old headings and keywords are gone until keywords are generated again
+        postings.remove(id, ["heading", "keyword"])
         db.session.commit()
         add_res_title_tree(title=title, resource_id=resource.id, folder_id=resource.folder)
         flash("Notes edited", "success")
@@ -896,9 +872,9 @@ def report_resource():
             keywords = models.Keywords.query.filter_by(resource=form.resource_id.data).first()
             if keywords:
                 db.session.delete(keywords)
-            queued = models.Queue.query.filter_by(resource=form.resource_id.data).first()
-            if queued:
-                db.session.delete(queued)
+            models.NoteSection.query.filter_by(resource=form.resource_id.data).delete()
+            postings.remove(form.resource_id.data)
+            models.Queue.query.filter_by(resource=form.resource_id.data).delete()
             reviews = models.Review.query.filter_by(resource=form.resource_id.data).all()
             for review in reviews:
                 db.session.delete(review)
@@ -1003,6 +979,8 @@ def delete_resource():
         keywords = models.Keywords.query.filter_by(resource=form.resource_id.data).first()
         if keywords:
             db.session.delete(keywords)
+        models.NoteSection.query.filter_by(resource=form.resource_id.data).delete()
+        postings.remove(form.resource_id.data)
         if resource.type == "material" or resource.type == "transcript":
             os.remove(resource.data)
         db.session.delete(resource)
@@ -1056,6 +1034,7 @@ def delete_folder():
         tree = models.SearchTree.query.filter_by(folder=folder.id).first()
         if tree:
             db.session.delete(tree)
+        postings.remove_folder(folder.id)
         resources = models.Resource.query.filter_by(folder=form.folder_id.data).all()
         for resource in resources:
             reviews = models.Review.query.filter_by(resource=resource.id).all()
@@ -1063,6 +1042,7 @@ def delete_folder():
                 db.session.delete(review)
             keywords = models.Keywords.query.filter_by(resource=resource.id).first()
             db.session.delete(keywords)
+            models.NoteSection.query.filter_by(resource=resource.id).delete()
             if resource.type == "material" or resource.type == "transcript":
                 os.remove(resource.data)
             db.session.delete(resource)
@@ -1119,6 +1099,7 @@ def delete_group():
             tree = models.SearchTree.query.filter_by(folder=folder.id).first()
             if tree:
                 db.session.delete(tree)
+            postings.remove_folder(folder.id)
             resources = models.Resource.query.filter_by(folder=folder.id).all()
             for resource in resources:
                 reviews = models.Review.query.filter_by(resource=resource.id).all()
@@ -1127,6 +1108,7 @@ def delete_group():
                 keywords = models.Keywords.query.filter_by(resource=resource.id).first()
                 if keywords:
                     db.session.delete(keywords)
+                models.NoteSection.query.filter_by(resource=resource.id).delete()
                 if resource.type == "material" or resource.type == "transcript":
                     os.remove(resource.data)
                 db.session.delete(resource)
@@ -1185,6 +1167,8 @@ def leave_group():
                         db.session.delete(review)
                     keywords = models.Keywords.query.filter_by(resource=resource.id).first()
                     db.session.delete(keywords)
+                    models.NoteSection.query.filter_by(resource=resource.id).delete()
+                    postings.remove(resource.id)
                     if resource.type == "material" or resource.type == "transcript":
                         os.remove(resource.data)
                     db.session.delete(resource)
@@ -1,23 +1,16 @@
-from app import app, db, models, celery
+from app import app, db, models, celery, admin, jobs, tasks, postings, indexcache, kwcache, pipeline, extractors, normalize, notes, timings, registry
 from flask import render_template, request, flash, redirect, url_for
 from flask_login import current_user, login_required
 from ..forms import *
+from .auth import CustomModelView
+from flask_admin.actions import action
+from flask_admin import BaseView, expose
 import logging
-import html
-import time
 import json
-import requests
-from bs4 import BeautifulSoup
-from markdown import markdown
-from keybert import KeyBERT
-from PyPDF2 import PdfReader
-import webvtt
-from nltk.stem import PorterStemmer
-import string
-import html2text
+import time
+from celery.signals import worker_ready
 
 logger = logging.getLogger(__name__)
-ps = PorterStemmer()
 
 """
 Generate Keywords Route
@@ -39,7 +32,7 @@ If form validates
         - Flash & log error, redirect to resource
     - If resource already queued for keyword generation
         - Flash & log error, redirect to resource
-    - Create queue entry and add to thread pool 
+    - Create queued job at its first stage and start a task to claim it
     - Flash success, redirect to resource
 If form does not validate
     - Flash & log error, redirect to resource
@@ -74,17 +67,14 @@ def generate():
             flash("Keywords already generated!", "danger")
             logger.warning("User %s tried to generate keywords for a resource that already has keywords!", current_user.email)
             return redirect(url_for("resource", id=id))
-        queued = models.Queue.query.filter_by(resource=id).first()
+        queued = jobs.active(id)
         if queued:
             flash("Resource already queued for keyword generation!", "danger")
             logger.warning("User %s tried to generate keywords for a resource that already has keywords queued!", current_user.email)
             return redirect(url_for("resource", id=id))
-        entry = models.Queue(resource=id)
-        db.session.add(entry)
-        db.session.commit()
-        wholeQueue = models.Queue.query.all()
-        if len(wholeQueue) == 1:
-            generator_pipeline.delay()
+        stage = jobs.first_stage(resource.type)
+        jobs.enqueue(id, stage)
+        dispatch(stage)
         flash("Resource queued for keyword generation!", "success")
         logger.info("User %s queued resource %s for keyword generation!", current_user.email, id)
         return redirect(url_for("resource", id=id))
@@ -93,12 +83,123 @@ def generate():
         logger.warning("User %s submitted an invalid form!", current_user.email)
         return redirect(url_for("index"))
 
+"""
+Admin view of dead lettered keyword jobs
+Lists jobs in the 'dead' state with their last error
+Requeue gives the selected jobs fresh attempts at the stage they died in and starts tasks for them
+Purge deletes the selected jobs
+"""
+class DeadJobView(CustomModelView):
+    can_create = False
+    can_edit = False
+    column_list = ("id", "resource", "attempts", "enqueued", "finished", "last_error")
+    column_default_sort = ("finished", True)
+
+    def get_query(self):
+        return super().get_query().filter(models.Queue.state == "dead")
+
+    def get_count_query(self):
+        return super().get_count_query().filter(models.Queue.state == "dead")
+
+    @action("requeue", "Requeue", "Requeue the selected jobs?")
+    def action_requeue(self, ids):
+        count = jobs.requeue([int(id) for id in ids])
+        resume()
+        flash(str(count) + " job(s) requeued", "success")
+        logger.info("Admin requeued %s dead keyword job(s)", count)
+
+    @action("purge", "Purge", "Delete the selected jobs?")
+    def action_purge(self, ids):
+        count = jobs.purge([int(id) for id in ids])
+        flash(str(count) + " job(s) purged", "success")
+        logger.info("Admin purged %s dead keyword job(s)", count)
+
+admin.add_view(DeadJobView(models.Queue, db.session, name="Dead Jobs", endpoint="deadjobs"))
+
+"""
+Admin view of the keyword pipeline
+Shows the queued and running jobs of every stage with its pool and limit,
+and the span timings and throughput of the last TIMING_WINDOW_MINUTES
+(or ?minutes=N), and the keyword model of this process (the one running local
+tasks) and of the celery workers while tasks go to celery
+/admin/pipeline/depths, /admin/pipeline/timings and /admin/pipeline/model
+return the same as json
+"""
+class PipelineView(BaseView):
+    @expose("/")
+    def index(self):
+        return self.render("admin/pipeline.html", depths=jobs.depths(), timings=timings.summary(request.args.get("minutes", type=int)),
+            model=self.model())
+
+    @expose("/depths")
+    def depths(self):
+        return jobs.depths()
+
+    @expose("/timings")
+    def timing_summary(self):
+        return timings.summary(request.args.get("minutes", type=int))
+
+    @expose("/model")
+    def model(self):
+        workers = {}
+        if tasks.backend() == "celery":
+            workers = registry.worker_model_stats(app.config.get("TASK_BROKER_TIMEOUT", 1))
+        return {"local": registry.model_stats(), "workers": workers}
+
+admin.add_view(PipelineView(name="Pipeline", endpoint="pipeline"))
+
+"""
+Admin view of the search index cache of the process serving the request
+Shows cached folders, estimated size against the budget and the hit rate
+/admin/searchindex/stats returns the same as json
+"""
+class SearchIndexView(BaseView):
+    @expose("/")
+    def index(self):
+        return self.render("admin/search_index.html", stats=indexcache.stats())
+
+    @expose("/stats")
+    def stats(self):
+        return indexcache.stats()
+
+admin.add_view(SearchIndexView(name="Search Index", endpoint="searchindex"))
+
+"""
+Load the resources of one page of search results, in rank order
+One query each for the resources, their average ratings and their keywords
+Returns (resources, {id: rating}, {id: keywords})
+"""
+def hydrate(resource_ids):
+    found = {resource.id: resource for resource in models.Resource.query.filter(models.Resource.id.in_(resource_ids)).all()}
+    resources = [found[id] for id in resource_ids if id in found]
+    dictratings = {id: "NA" for id in found}
+    for id, total, count in db.session.query(models.Review.resource, db.func.sum(models.Review.rating), db.func.count(models.Review.id)) \
+            .filter(models.Review.resource.in_(list(found))).group_by(models.Review.resource).all():
+        dictratings[int(id)] = str(total / count) + "/5"
+    dictkeywords = {id: [] for id in found}
+    seen = set()
+    for keywords in models.Keywords.query.filter(models.Keywords.resource.in_(list(found))).order_by(models.Keywords.id).all():
+        if keywords.resource not in seen:
+            seen.add(keywords.resource)
+            dictkeywords[int(keywords.resource)] = json.loads(keywords.json)
+    return resources, dictratings, dictkeywords
+
+"""
+Offset of the page before (step -1) or after (step 1) the page at offset
+Returns None if there is no such page
+"""
+def page_offset(offset, step):
+    size = app.config.get("SEARCH_RESULTS_PER_PAGE", 20)
+    if step < 0 and offset <= 0:
+        return None
+    return max(offset + step * size, 0)
+
 """
 FOR AJAX USE ONLY
 Folder Search Route
 GET Request Only
 Requires login
-Takes folder id and query as parameters
+Takes folder id, query and optionally offset (of the page) as parameters
 If folder does not exist
     - return message to user
     - log error
@@ -113,11 +214,12 @@ If query is not empty
         - return message to user
         - log error
     - If search tree exists
-        - Get results using stemmed words
+        - Get one page of results using stemmed words from the folder's postings, ranked with BM25
         - If results is empty
             - return message to user
         - If results is not empty
-            - return results as rendered page
+            - Load only the page's resources, ratings and keywords
+            - return results as rendered page with links to the other pages
 """
 @app.route("/folder/search", methods=["GET"])
 @login_required
@@ -146,63 +248,25 @@ def folder_search():
         logger.warning("User %s tried to search a folder that does not have a search tree!", current_user.email)
         logger.error("Folder %s does not have a search tree!", folder_id)
         return "No resources found", 200
-    tree = json.loads(SearchTreeDB.json)
-    resources = []
-    words = query.split(" ")
-    for word in words:
-        stem = ps.stem(word)
-        if stem in tree: # If the word is in the tree
-            resources = resources + tree[stem]
-    # Count duplicates in resources and put into a dictionary resource:count
-    resource_count = {}
-    for resource in resources:
-        if resource in resource_count:
-            resource_count[resource] += 1
-        else:
-            resource_count[resource] = 1
-    # Sort the dictionary by count, this will put most relevant resources at the start
-    sorted_resource_count = sorted(resource_count.items(), key=lambda x: x[1], reverse=True)
-    if len(sorted_resource_count) == 0:
+    # One page of resources ranked by BM25 over their title, heading and keyword postings, most relevant first
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    ranked, more = postings.top([folder_id], query, app.config.get("SEARCH_RESULTS_PER_PAGE", 20), offset)
+    if len(ranked) == 0:
         logger.info("User %s searched a folder with a query that returned no results!", current_user.email)
         return "No resources found", 200
-    # Convert to a list of resources
-    sorted_resources = []
-    for resource in sorted_resource_count:
-        sorted_resources.append(resource[0])
-    resources = models.Resource.query.filter(models.Resource.id.in_(sorted_resources)).all()
+    resources, dictratings, dictkeywords = hydrate([r[0] for r in ranked])
     if not resources:
-        logger.info('User ' + current_user.email + ' tried to search for resources but none were found')
-        return 'No resources found', 200
-    dictratings = {}
-    dictkeywords = {}
-    count = 0
-    resources = []
-    for r in sorted_resource_count:
-        resource = models.Resource.query.filter_by(id=r[0]).first()
-        if resource:
-            resources.append(resource)
-            count += 1
-            ratings = models.Review.query.filter_by(resource=resource.id).all()
-            if ratings:
-                dictratings[int(resource.id)] = str(sum(rating.rating for rating in ratings) / len(ratings)) + "/5"
-            else:
-                dictratings[int(resource.id)] = "NA"
-            keywords = models.Keywords.query.filter_by(resource=resource.id).first()
-            if keywords:
-                dictkeywords[int(resource.id)] = json.loads(keywords.json)
-            else:
-                dictkeywords[int(resource.id)] = []
-    if count == 0:
-        logger.info("User %s searched a group with a query that returned no results!", current_user.email)
+        logger.info("User %s searched a folder with a query that returned no results!", current_user.email)
         return "No resources found", 200
-    return render_template('resources.html', resources=resources, ratings=dictratings, keywords=dictkeywords)
+    return render_template('resources.html', resources=resources, ratings=dictratings, keywords=dictkeywords,
+        previous_offset=page_offset(offset, -1), next_offset=page_offset(offset, 1) if more else None)
 
 """
 FOR AJAX USE ONLY
 Group Search Route
 GET Request Only
 Requires login
-Takes group id and query as parameters
+Takes group id, query and optionally offset (of the page) as parameters
 If group does not exist
     - return message to user
     - log error
@@ -212,20 +276,12 @@ If user is not a member of the group
 If query is empty
     - return message to user
 If query is not empty
-    - For Each Folder
-        - Get search tree
-        - If search tree does not exist
-            - log error
-        - If search tree exists
-            - Get results using stemmed words
-            - If results is empty
-                - continue
-            - If results is not empty
-                - Add results to list of results
+    - Get one page of results using stemmed words from the group's postings, ranked with BM25
     - If list of results is empty
         - return message to user
     - If list of results is not empty
-        - return results as rendered page
+        - Load only the page's resources, ratings and keywords
+        - return results as rendered page with links to the other pages
 """
 @app.route("/group/search", methods=["GET"])
 @login_required
@@ -245,274 +301,220 @@ def group_search():
     if not query:
         logger.info("User %s searched a group with an empty query!", current_user.email)
         return "No resources found", 200
-    folders = models.Folder.query.filter_by(group=group_id).all()
-    if not folders:
-        logger.info("User %s searched a group with a query that returned no results!", current_user.email)
-        return "No resources found", 200
-    resources = []
-    words = query.split(" ")
-    for folder in folders:
-        SearchTreeDB = models.SearchTree.query.filter_by(folder=folder.id).first()
-        if not SearchTreeDB:
-            logger.warning("User %s tried to search a group that does not have a search tree!", current_user.email)
-            logger.error("Folder %s does not have a search tree!", folder.id)
-            continue
-        tree = json.loads(SearchTreeDB.json)
-        for word in words:
-            stem = ps.stem(word)
-            if stem in tree: # If the word is in the tree
-                resources = resources + tree[stem]
-    resource_count = {}
-    for resource in resources:
-        if resource in resource_count:
-            resource_count[resource] += 1
-        else:
-            resource_count[resource] = 1
-    sorted_resource_count = sorted(resource_count.items(), key=lambda x: x[1], reverse=True)
-    if len(sorted_resource_count) == 0:
+    # One lookup over the group's postings, however many folders it has, for one page of results
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    ranked, more = postings.top_group(group_id, query, app.config.get("SEARCH_RESULTS_PER_PAGE", 20), offset)
+    if len(ranked) == 0:
         logger.info("User %s searched a group with a query that returned no results!", current_user.email)
         return "No resources found", 200
-    dictratings = {}
-    dictkeywords = {}
-    count = 0
-    resources = []
-    for r in sorted_resource_count:
-        resource = models.Resource.query.filter_by(id=r[0]).first()
-        if resource:
-            resources.append(resource)
-            count += 1
-            ratings = models.Review.query.filter_by(resource=resource.id).all()
-            if ratings:
-                dictratings[int(resource.id)] = str(sum(rating.rating for rating in ratings) / len(ratings)) + "/5"
-            else:
-                dictratings[int(resource.id)] = "NA"
-            keywords = models.Keywords.query.filter_by(resource=resource.id).first()
-            if keywords:
-                dictkeywords[int(resource.id)] = json.loads(keywords.json)
-            else:
-                dictkeywords[int(resource.id)] = []
-    if count == 0:
+    resources, dictratings, dictkeywords = hydrate([r[0] for r in ranked])
+    if not resources:
         logger.info("User %s searched a group with a query that returned no results!", current_user.email)
         return "No resources found", 200
     logger.info('User ' + current_user.email + ' found resources for query: ' + query)
-    return render_template('resources.html', resources=resources, ratings=dictratings, keywords=dictkeywords)
+    return render_template('resources.html', resources=resources, ratings=dictratings, keywords=dictkeywords,
+        previous_offset=page_offset(offset, -1), next_offset=page_offset(offset, 1) if more else None)
 
-@celery.task
-def generator_pipeline():
+"""
+Fetch stage (io pool)
+1. Get the job's resource, a job for a deleted resource is finished
+2. Download the url content, Wikipedia articles in batches (see fetch.py)
+3. Pass the content to the extract stage in the job payload
+Returns the next stage
+"""
+def fetch_job(job):
+    resource = models.Resource.query.filter_by(id=job.resource).first()
+    if not resource:
+        logger.warning("Resource %s does not exist!", job.resource)
+        jobs.complete(job)
+        db.session.commit()
+        return None
+    with timings.span("prepare_url") as span:
+        content = pipeline.prepare_url(resource)
+        span.chars = len(content)
+    jobs.advance(job, "extract", json.dumps({"content": content}))
+    db.session.commit()
+    return "extract"
 
-    # Use keyBERT to extract keywords from text
-    def keybert_exec(text):
-        try:
-            kw_model = KeyBERT(model='all-mpnet-base-v2')
-            keywords = kw_model.extract_keywords(
-                text, 
-                keyphrase_ngram_range=(1, 2), 
-                stop_words='english', 
-                highlight=False,
-                use_maxsum=True,
-                use_mmr=True,
-                diversity=0.5,
-                top_n=10
-            )
-        except:
-            keywords=[]
-        return list(dict(keywords).keys())
-
-    # Get the number of hashes in a markdown heading
-    def num_hashes(line):
-        count = 0
-        for letter in line:
-            if letter != "#":
-                return 0
-            else:
-                count += 1
-        return count
-
-    """
-    Get the headings from a markdown file
-    1. Split the file into lines
-    2. For each line, split it into words
-    3. Get the number of hashes in the first word
-    4. Remove the hashes from the first word
-    5. Remove the carriage return from the last word
-    6. Join the words back together
-    7. If the number of hashes is greater than 0 and not already in the dictionary, add it
-    8. Sort the dictionary such that headers with less hashes come first (less hashes = higher level)
-    9. Return the sorted dictionary
-    """
-    def markdown_headings(resource):
-        data = resource.data.split("\n")
-        headers = {}
-        headers_sorted = []
-        for line in data:
-            line = line.lstrip()
-            words = line.split(" ")
-            hashes = num_hashes(words[0])
-            words[-1] = words[-1].replace("\r", "")
-            words.pop(0)
-            header = " ".join(words)
-            if hashes >= 1:
-                if header in headers:
-                    headers[header] = min(headers[header], hashes)
-                else:
-                    headers[header] = hashes
-        temp = sorted(headers)
-        for heading in temp:
-            headers_sorted.append(heading)
-        return headers_sorted
-
-    """
-    Get the notes as plaintext
-    1. Convert to html (need to be done for Markdown)
-    2. Convert to text from html
-    """
-    def prepare_notes(resource):
-        ht = markdown(html.unescape(resource.data))
-        text = ''.join(BeautifulSoup(ht, features="html.parser").findAll(text=True))
-        return text
-
-    """
-    Get the content from url
-    1. If the url is a wikipedia page, get the content from the page
-    2. Else do nothing as webscraping is not allowed
-    """
-    def prepare_url(resource):
-        content = ""
-        if "wikipedia.org" in resource.data:
-            title = resource.data.split("/")[-1]
-            try:
-                url = "https://en.wikipedia.org/w/api.php?format=json&action=query&prop=extracts&titles="+title+"&redirects=true"
-                response = requests.get(url).json()
-                if "-1" not in response["query"]["pages"]:
-                    h = html2text.HTML2Text()
-                    h.ignore_links = True
-                    h.ignore_images = True
-                    content = h.handle(list(response["query"]["pages"].values())[0]["extract"])
-            except:
-                logger.info("Could not get content from wikipedia page!!!!!!!! %s", title)
-        return content
-
-    """
-    Get the content from a pdf
-    1. Read the pdf
-    2. For each page, extract the text
-    3. Merge each page and return
-    """
-    def prepare_material(resource):
-        content = ""
-        reader = PdfReader(resource.data)
-        for page in reader.pages:
-            content += page.extract_text()
-        return content
-
-    """
-    Get the content from a transcript
-    1. If the transcript is a txt file, read the file
-    2. Else if the transcript is a vtt file, read the file as captions and merge
-    3. Return the content
-    """
-    def prepare_transcript(resource):
-        content = ""
-        ext = resource.data.split(".")[-1]
-        if ext == "txt":
-            with open(resource.data, "r") as f:
-                content = f.read()
-        elif ext == "vtt":
-            for caption in webvtt.read(resource.data):
-                content += caption.text + " "
-        return content
-
-    """
-    1. Get resource and validate exists and queued
-    2. Get content
-    3. Generate keywords
-    4. Save keywords
-    5. Remove from queue
-    6. Log
-    """
-    def main(id):
-        ps = PorterStemmer()
-        id = int(id)
-        with app.app_context():
-            queued = models.Queue.query.filter_by(resource=id).first()
-        if not queued:
-            logger.warning("Resource %s is not queued for keyword generation!", id)
-            return
-        with app.app_context():
-            resource = models.Resource.query.filter_by(id=id).first()
-        if not resource:
-            logger.warning("Resource %s does not exist!", id)
-            with app.app_context():
-                db.session.delete(queued)
-                db.session.commit()
-            return
-
-        extra_keywords = []
-        content = ""
-        if resource.type == "material":
-            content = prepare_material(resource)
-        elif resource.type == "transcript":
-            content = prepare_transcript(resource)
-        elif resource.type == "notes":
-            extra_keywords = markdown_headings(resource)
-            content = prepare_notes(resource)
-        elif resource.type == "url":
-            content = prepare_url(resource)
+"""
+Extract stage (cpu pool)
+1. Get the job's resource and validate it exists
+2. Get content key, raw bytes for files and text for notes and urls (fetched by the fetch stage)
+3. Get keywords from the cache, or extract content and generate them once
+4. Pass the keywords to the persist stage in the job payload
+Returns the next stage
+"""
+def extract_job(job):
+    id = int(job.resource)
+    resource = models.Resource.query.filter_by(id=id).first()
+    if not resource:
+        logger.warning("Resource %s does not exist!", id)
+        jobs.complete(job)
+        db.session.commit()
+        return None
+
+    # Files are keyed by their bytes so a cache hit skips extraction too
+    # Uploaded files are parsed in a sandbox process with time and memory limits
+    extra_keywords = []
+    content = ""
+    # Files are parsed lazily, prepare_* spans time the stream as extraction reads it
+    if resource.type == "material":
+        key = kwcache.file_key(resource.data)
+        load = lambda: timings.timed("prepare_material", pipeline.sandboxed(pipeline.iter_material, resource))
+    elif resource.type == "transcript":
+        key = kwcache.file_key(resource.data)
+        load = lambda: timings.timed("prepare_transcript", pipeline.sandboxed(pipeline.iter_transcript, resource))
+    elif resource.type == "notes":
+        with timings.span("prepare_notes") as span:
+            extra_keywords, content = notes.parse(resource.data)
+            span.chars = len(content)
+        key = kwcache.text_key(content)
+        load = lambda: [content]
+    elif resource.type == "url":
+        # Jobs queued before the fetch stage existed have no payload
+        with timings.span("prepare_url") as span:
+            payload = json.loads(job.payload) if job.payload else {}
+            content = payload["content"] if "content" in payload else pipeline.prepare_url(resource)
+            span.chars = len(content)
+        key = kwcache.text_key(content)
+        load = lambda: [content]
+    else:
+        logger.warning("Resource %d has an invalid type!", id)
+        # Retrying can't help, dead letter it so the job isn't claimed again
+        jobs.dead_letter(job, "Invalid resource type: " + str(resource.type))
+        db.session.commit()
+        return None
+
+    # Content is normalized and streamed through the extractor configured for the resource type
+    # None when there is no text, [] when extraction failed
+    extractor = extractors.name_for(resource.type)
+    def extract():
+        if resource.type == "notes" and extractor == "keybert":
+            # Only the sections changed since the last generation are embedded again
+            keywords = notes.keybert_sections(id, resource.data)
         else:
-            logger.warning("Resource %d has an invalid type!", id)
-            return
+            keywords = extractors.EXTRACTORS[extractor](normalize.normalize(load(), resource.type), extra_keywords)
+        if keywords == []:
+            logger.warning("Could not extract keywords for resource %d", id)
+        return keywords
+
+    found = kwcache.single_flight(key, extract, kwcache.model_version(extractor))
+    jobs.advance(job, "persist", json.dumps({"extra_keywords": extra_keywords, "found": found}))
+    db.session.commit()
+    return "persist"
 
-        if content == "":
-            keywords = ["Extraction unavailable for this resource."]
+"""
+Persist stage (io pool)
+1. Get the job's resource and the keywords from the payload
+2. Index the headings and keywords in the folder's postings
+3. Save keywords
+4. Mark job as done
+5. Log
+"""
+def persist_job(job):
+    id = int(job.resource)
+    resource = models.Resource.query.filter_by(id=id).first()
+    if not resource:
+        logger.warning("Resource %s does not exist!", id)
+        jobs.complete(job)
+        db.session.commit()
+        return None
+    payload = json.loads(job.payload)
+    found = payload["found"]
+    if found is None:
+        keywords = ["Extraction unavailable for this resource."]
+    else:
+        keywords = payload["extra_keywords"] + found
+        if len(keywords) != 0:
+            # Headings (notes) and keywords are indexed as separate fields of the folder's index
+            with timings.span("index"):
+                postings.set_field(resource.folder, id, "heading", payload["extra_keywords"])
+                postings.set_field(resource.folder, id, "keyword", found)
         else:
+            keywords = ["Extraction failed for this resource."]
+
+    with timings.span("db_write"):
+        for previous in models.Keywords.query.filter_by(resource=id).all():
+            db.session.delete(previous)
+        db.session.add(models.Keywords(resource=id, json=json.dumps(keywords)))
+        jobs.complete(job)
+        job.payload = None
+        db.session.commit()
+    logger.info("Resource %s keywords generated!", id)
+    return None
+
+STAGE_JOBS = {"fetch": fetch_job, "extract": extract_job, "persist": persist_job}
+
+"""
+Claim jobs of a stage until none are left, other workers claim in parallel
+Each job's stage is timed (see timings.py) and its spans saved when it finishes
+A job that finishes its stage gets a task for the next stage
+A failing job is retried with backoff and never stops the drain
+"""
+def drain(stage):
+    worker = jobs.worker_id()
+    with app.app_context():
+        while (job := jobs.claim(worker, stage=stage)) is not None:
+            job_id = job.id
+            resource_id = job.resource
+            with timings.recording() as recorder:
+                start = time.perf_counter()
+                try:
+                    wait = jobs.waited(job)
+                    with jobs.Lease(job_id, worker):
+                        following = STAGE_JOBS[stage](job)
+                except Exception as e:
+                    logger.exception("Keyword %s stage failed for job %s", stage, job_id)
+                    db.session.rollback()
+                    delay = jobs.fail(job_id, repr(e))
+                    if delay is not None:
+                        dispatch(stage, countdown=delay)
+                    continue
+                total = time.perf_counter() - start
             try:
-                keywords = extra_keywords + keybert_exec(content)
-            except:
-                keywords = extra_keywords
-                logger.warning("Could not extract keywords for resource %d", id)
-            if len(keywords) != 0:        
-                tree = {}
-                with app.app_context():
-                    SearchTreeDB = models.SearchTree.query.filter_by(folder=resource.folder).first()
-                if SearchTreeDB.json != "":
-                    tree = json.loads(SearchTreeDB.json)
-                stems = []
-                for keyword in keywords:
-                    words = keyword.split(" ")
-                    for w in words:
-                        stems.append(ps.stem(w.lower()))
-                for stem in stems:
-                    if stem not in tree:
-                        tree[stem] = [resource.id]
-                    else:
-                        resources = tree[stem]
-                        if resource.id not in resources:
-                            tree[stem].append(resource.id)
-                SearchTreeDB.json = json.dumps(tree)
-                with app.app_context():
-                    db.session.add(SearchTreeDB)
-                    db.session.commit()
-            else:
-                keywords = ["Extraction failed for this resource."]
-
-        with app.app_context():
-            dbEntryKeywords = models.Keywords(resource=id, json=json.dumps(keywords))
-            prevKeywords = models.Keywords.query.filter_by(resource=id).all()
-            for keywords in prevKeywords:
-                db.session.delete(keywords)
-            db.session.add(dbEntryKeywords)
-            db.session.delete(queued)
-            db.session.commit()
-        logger.info("Resource %s keywords generated!", id)
-        del content
-        del keywords
-        del extra_keywords
-        del resource
-        del dbEntryKeywords
-        del queued
-        del id
-        return
+                timings.save(job_id, resource_id, stage, recorder, wait, total)
+            except Exception:
+                logger.exception("Could not save spans for job %s", job_id)
+                db.session.rollback()
+            if following:
+                dispatch(following)
+
+@celery.task
+def fetch_stage():
+    drain("fetch")
+
+# Kept under its old name, the extract stage is the one already running jobs queued before the split
+@celery.task
+def generator_pipeline():
+    drain("extract")
+
+@celery.task
+def persist_stage():
+    drain("persist")
+
+STAGE_TASKS = {"fetch": fetch_stage, "extract": generator_pipeline, "persist": persist_stage}
+
+# Stage tasks go to the queue of their pool, run workers with -Q io and -Q cpu
+celery.conf.task_routes = {task.name: {"queue": jobs.pool(stage)} for stage, task in STAGE_TASKS.items()}
+
+"""
+Start a task for a stage, every queued job gets one
+Tasks claim distinct jobs so N workers drain a stage in parallel
+Runs on celery, or the local pool of the stage when the broker is down (see tasks.py)
+"""
+def dispatch(stage, countdown=None):
+    tasks.submit(STAGE_TASKS[stage], pool=jobs.pool(stage), countdown=countdown)
+
+"""
+Start a task for every claimable job of every stage
+"""
+def resume():
+    for stage in jobs.STAGES:
+        for _ in range(jobs.claimable_count(stage)):
+            dispatch(stage)
 
+# Pick up jobs left behind by a worker that died, once their lease expires
+@worker_ready.connect
+def resume_pipeline(**kwargs):
     with app.app_context():
-        while (item := models.Queue.query.first()) is not None:
-            main(item.resource)
\ No newline at end of file
+        resume()
@@ -0,0 +1,77 @@
+from app import app
+from app import diversity
+from keybert._mmr import mmr as keybert_mmr
+from keybert._maxsum import max_sum_distance as keybert_maxsum
+import numpy as np
+import argparse
+import time
+
+"""
+Benchmark diversity selection against keybert's implementations
+Candidates are synthetic clustered embeddings (topics plus noise), normalized
+like the candidate pool in keybert_exec
+Reports the median latency of each method and the keyword overlap
+(Jaccard) of the new selectors with keybert's on the same input
+
+python bench_diversity.py --candidates 100 --top-n 10 --dim 768
+"""
+
+def make_candidates(n, dim, topics, rng):
+    centers = rng.normal(size=(topics, dim))
+    embeddings = centers[rng.integers(0, topics, n)] + 0.8 * rng.normal(size=(n, dim))
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    doc = embeddings.mean(axis=0)
+    doc /= np.linalg.norm(doc)
+    return doc.astype(np.float32), embeddings.astype(np.float32)
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return result, np.median(times) * 1000
+
+def overlap(a, b):
+    a, b = set(word for word, _ in a), set(word for word, _ in b)
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--candidates", type=int, default=100)
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--topics", type=int, default=8)
+    parser.add_argument("--maxsum-candidates", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--documents", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    rows = {}
+    for _ in range(args.documents):
+        doc, embeddings = make_candidates(args.candidates, args.dim, args.topics, rng)
+        words = ["phrase" + str(i) for i in range(args.candidates)]
+        with app.app_context():
+            runs = {
+                "keybert mmr (current)": lambda: keybert_mmr(doc.reshape(1, -1), embeddings, words, args.top_n, 0.5),
+                "keybert maxsum": lambda: keybert_maxsum(doc.reshape(1, -1), embeddings, words, args.top_n, args.maxsum_candidates),
+                "greedy mmr": lambda: diversity.mmr(doc, embeddings, words, args.top_n, 0.5),
+                "capped maxsum": lambda: diversity.max_sum(doc, embeddings, words, args.top_n, args.maxsum_candidates),
+            }
+            results = {}
+            for name, fn in runs.items():
+                results[name], ms = timed(fn, args.repeat)
+                rows.setdefault(name, {"ms": [], "overlap": []})["ms"].append(ms)
+            rows["greedy mmr"]["overlap"].append(overlap(results["greedy mmr"], results["keybert mmr (current)"]))
+            rows["capped maxsum"]["overlap"].append(overlap(results["capped maxsum"], results["keybert maxsum"]))
+
+    pool = diversity.maxsum_pool(args.top_n, args.maxsum_candidates, app.config.get("KEYWORD_MAXSUM_COMBINATIONS", 20000))
+    print("%d candidates, top_n %d, dim %d, capped maxsum pool %d" % (args.candidates, args.top_n, args.dim, pool))
+    print("%-24s %12s %10s" % ("method", "median ms", "overlap"))
+    for name, row in rows.items():
+        jaccard = "%.2f" % np.mean(row["overlap"]) if row["overlap"] else "-"
+        print("%-24s %12.2f %10s" % (name, np.median(row["ms"]), jaccard))
+
+if __name__=="__main__":
+    main()
@@ -22,6 +22,120 @@ SECRET_KEY = 'b4StrEde2N*WJx'
 MAX_CONTENT_LENGTH = 16 * 1000 * 1000
 UPLOAD_FOLDER = 'app/static/uploads'
 
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
+CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://redis:6379/0")
+
+# Where pipeline tasks run: 'celery', 'local' (pools in the web process) or
+# 'auto' (celery, local while the broker is unreachable)
+TASK_BACKEND = os.getenv("TASK_BACKEND", "auto")
+TASK_BROKER_TIMEOUT = 1
+TASK_BROKER_CHECK_SECONDS = 30
+
+# Local cpu pool (extract stage)
 EXECUTOR_MAX_WORKERS = 1
 EXECUTOR_TYPE = 'thread'
-EXECUTOR_PROPAGATE_EXCEPTIONS = True
\ No newline at end of file
+EXECUTOR_PROPAGATE_EXCEPTIONS = True
+# Local io pool (fetch and persist stages)
+IO_EXECUTOR_MAX_WORKERS = 8
+IO_EXECUTOR_TYPE = 'thread'
+
+# Keyword model, loaded once per worker process before the pool forks
+KEYBERT_MODEL = 'all-mpnet-base-v2'
+KEYBERT_PRELOAD = True
+
+# Local inference server, e.g. 'unix:///tmp/smartnotes-inference.sock' or '127.0.0.1:5001'
+# When set, pipeline workers send embedding requests to it instead of loading the model
+INFERENCE_ADDRESS = os.getenv("INFERENCE_ADDRESS")
+INFERENCE_MAX_BATCH = 64
+INFERENCE_MAX_WAIT_MS = 10
+
+# Keyword job queue, a claimed job is reclaimed if its lease isn't renewed in time
+JOB_LEASE_SECONDS = 300
+# Failed jobs are retried with exponential backoff, then dead lettered
+JOB_MAX_ATTEMPTS = 3
+JOB_BACKOFF_SECONDS = 30
+JOB_BACKOFF_MAX_SECONDS = 3600
+# Finished jobs are deleted after this many hours, dead ones are kept
+JOB_DONE_RETENTION_HOURS = 24
+# Pipeline stages and the celery queue (worker pool) each one runs on
+# fetch and persist wait on the network and the database, extract on the cpu
+PIPELINE_POOLS = {'fetch': 'io', 'extract': 'cpu', 'persist': 'io'}
+# Opt-in global throttle, most jobs of a stage running at once across all workers
+# e.g. {'fetch': 16} to be gentle on remote sites. Unset stages have no limit,
+# each worker's own concurrency is its --concurrency
+PIPELINE_STAGE_LIMITS = {}
+# Stage timing spans, aggregated over the last TIMING_WINDOW_MINUTES on the
+# admin pipeline page and kept for TIMING_RETENTION_HOURS
+TIMING_WINDOW_MINUTES = 60
+TIMING_RETENTION_HOURS = 168
+
+# Folder and group indexes cached by each web process for search, evicted least recently
+# used past this estimated size, 0 to always read the postings table
+INDEX_CACHE_BYTES = 64 * 1024 * 1024
+
+# Search ranking, Okapi BM25 with a weight per posting field (see ranking.py)
+# A field missing here or weighted 0 doesn't count towards the score
+SEARCH_FIELD_WEIGHTS = {'title': 3.0, 'heading': 2.0, 'keyword': 1.0}
+SEARCH_BM25_K1 = 1.2
+SEARCH_BM25_B = 0.75
+# Search results are shown a page at a time, only a page's resources are loaded
+SEARCH_RESULTS_PER_PAGE = 20
+
+# Content addressed keyword cache, bump the version when extraction settings change
+KEYWORD_CACHE_VERSION = 2
+KEYWORD_CACHE_WAIT_SECONDS = 600
+
+# Chunked keyword extraction, long documents are embedded in chunks and averaged
+KEYWORD_CHUNK_CHARS = 1500
+KEYWORD_EMBED_BATCH = 16
+KEYWORD_CANDIDATE_POOL = 100
+# At most KEYWORD_MAX_CANDIDATES candidates are embedded per document, on long
+# documents candidates seen fewer than KEYWORD_MIN_COUNT times are dropped first
+KEYWORD_MAX_CANDIDATES = 2000
+KEYWORD_MIN_COUNT = 2
+
+# Diversity selection, 'mmr' (greedy, O(n*d*k)) or 'maxsum' (capped combinations)
+KEYWORD_DIVERSITY = 'mmr'
+KEYWORD_MAXSUM_CANDIDATES = 20
+KEYWORD_MAXSUM_COMBINATIONS = 20000
+
+# Persistent phrase embedding cache shared by the workers, None to disable
+# Each slot takes 2 bytes per embedding dimension (1.5 KB for all-mpnet-base-v2)
+PHRASE_CACHE_DIR = os.path.join(basedir, 'phrase_cache')
+PHRASE_CACHE_CAPACITY = 200000
+
+# Parallel pdf text extraction, PDF_POOL_SIZE of None uses every core
+PDF_POOL_SIZE = None
+PDF_PAGES_PER_TASK = 8
+PDF_PAGE_TIMEOUT = 10
+PDF_PARALLEL_MIN_PAGES = 16
+
+# Uploaded files are parsed in a child process, a timeout or running out of
+# memory gives "Extraction failed" instead of taking the worker down
+EXTRACT_SANDBOX = True
+EXTRACT_TIMEOUT = 120
+EXTRACT_MEMORY_LIMIT = 1024 * 1024 * 1024
+
+# Keyword extractor, 'keybert' or 'statistical' (no model needed)
+# KEYWORD_EXTRACTOR_BY_TYPE overrides it per resource type, e.g. {'transcript': 'statistical'}
+KEYWORD_EXTRACTOR = 'keybert'
+KEYWORD_EXTRACTOR_BY_TYPE = {}
+
+# Url resources, fetched through one pooled session with (connect, read) timeouts
+# and cached on disk, stale entries are revalidated after URL_CACHE_TTL seconds
+WIKIPEDIA_API_URL = 'https://en.wikipedia.org/w/api.php'
+URL_FETCH_TIMEOUT = (5, 20)
+URL_POOL_SIZE = 8
+URL_CACHE_DIR = os.path.join(basedir, 'url_cache')
+URL_CACHE_TTL = 24 * 60 * 60
+# Failed fetches are cached too, and retried after URL_FAILURE_TTL seconds
+URL_FAILURE_TTL = 5 * 60
+
+# Generic (non Wikipedia) url pages, fetched concurrently with asyncio
+# Off by default, pages are only read up to URL_MAX_BYTES of html or URL_MAX_TEXT_KB of text
+URL_FETCH_PAGES = False
+URL_CONCURRENCY = 16
+URL_PER_HOST = 2
+URL_MAX_BYTES = 2 * 1024 * 1024
+URL_MAX_TEXT_KB = 256
+URL_ALLOW_PRIVATE = False
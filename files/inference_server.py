@@ -0,0 +1,4 @@
+from app import app
+from app.inference import serve
+if __name__=="__main__":
+    serve(app.config.get("INFERENCE_ADDRESS") or "0.0.0.0:5001")
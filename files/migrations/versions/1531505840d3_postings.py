@@ -0,0 +1,110 @@
+"""postings
+
+Revision ID: 1531505840d3
+Revises: 34a7b5f0737a
+Create Date: 2026-10-18 08:12:00.696295
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from collections import Counter
+from nltk.stem import PorterStemmer
+import json
+
+
+# revision identifiers, used by Alembic.
+revision = '1531505840d3'
+down_revision = '34a7b5f0737a'
+branch_labels = None
+depends_on = None
+
+BATCH = 100
+INSERT_BATCH = 5000
+
+search_tree = sa.table('search_tree', sa.column('id', sa.Integer), sa.column('folder', sa.Integer), sa.column('json', sa.Text))
+resource = sa.table('resource', sa.column('id', sa.Integer), sa.column('folder', sa.Integer), sa.column('title', sa.String))
+posting = sa.table('posting', sa.column('term', sa.String), sa.column('folder', sa.Integer), sa.column('resource', sa.Integer),
+    sa.column('field', sa.String), sa.column('tf', sa.Integer))
+
+"""
+Move the SearchTree json of every folder into postings, BATCH folders at a time
+1. Titles are indexed again from the resources (the tree lost all but the
+   latest title of a folder), as 'title' postings with their counts
+2. Stems of the tree that aren't in the resource's title become 'keyword'
+   postings, ids of deleted resources are dropped
+3. The json is emptied once the folder is migrated
+"""
+def migrate_trees(connection):
+    ps = PorterStemmer()
+    last = 0
+    while True:
+        trees = connection.execute(sa.select(search_tree.c.id, search_tree.c.folder, search_tree.c.json)
+            .where(search_tree.c.id > last).order_by(search_tree.c.id).limit(BATCH)).all()
+        if not trees:
+            return
+        last = trees[-1].id
+        folders = [tree.folder for tree in trees]
+        titles = {}
+        for row in connection.execute(sa.select(resource.c.id, resource.c.folder, resource.c.title).where(resource.c.folder.in_(folders))):
+            titles[(row.folder, row.id)] = Counter(ps.stem(word) for word in (row.title or "").lower().split())
+        rows = []
+        for (folder, resource_id), counts in titles.items():
+            rows += [{"term": term, "folder": folder, "resource": resource_id, "field": "title", "tf": tf} for term, tf in counts.items()]
+        for tree in trees:
+            try:
+                stems = json.loads(tree.json) if tree.json else {}
+            except ValueError:
+                stems = {}
+            for term, resource_ids in stems.items():
+                for resource_id in set(resource_ids):
+                    title = titles.get((tree.folder, resource_id))
+                    if title is None or term in title:
+                        continue
+                    rows.append({"term": term, "folder": tree.folder, "resource": resource_id, "field": "keyword", "tf": 1})
+        for start in range(0, len(rows), INSERT_BATCH):
+            op.bulk_insert(posting, rows[start:start + INSERT_BATCH])
+        connection.execute(search_tree.update().where(search_tree.c.id.in_([tree.id for tree in trees])).values(json=""))
+
+"""
+Rebuild the SearchTree json of every folder from its postings
+"""
+def restore_trees(connection):
+    trees = {}
+    for row in connection.execute(sa.select(posting.c.folder, posting.c.term, posting.c.resource).order_by(posting.c.resource)):
+        resources = trees.setdefault(row.folder, {}).setdefault(row.term, [])
+        if row.resource not in resources:
+            resources.append(row.resource)
+    for folder, tree in trees.items():
+        connection.execute(search_tree.update().where(search_tree.c.folder == folder).values(json=json.dumps(tree)))
+
+
+def upgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table('posting',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('term', sa.String(length=128), nullable=True),
+    sa.Column('folder', sa.Integer(), nullable=True),
+    sa.Column('resource', sa.Integer(), nullable=True),
+    sa.Column('field', sa.String(length=16), nullable=True),
+    sa.Column('tf', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['folder'], ['folder.id'], ),
+    sa.ForeignKeyConstraint(['resource'], ['resource.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('posting', schema=None) as batch_op:
+        batch_op.create_index('ix_posting_folder_term', ['folder', 'term'], unique=False)
+        batch_op.create_index('ix_posting_resource_field', ['resource', 'field'], unique=False)
+
+    # ### end Alembic commands ###
+    migrate_trees(op.get_bind())
+
+
+def downgrade():
+    restore_trees(op.get_bind())
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('posting', schema=None) as batch_op:
+        batch_op.drop_index('ix_posting_resource_field')
+        batch_op.drop_index('ix_posting_folder_term')
+
+    op.drop_table('posting')
+    # ### end Alembic commands ###
@@ -1,13 +1,14 @@
 import pytest
 import os
 os.environ["TESTING"] = "1"
-from app import app as flask_app, db, models, mail
+from app import app as flask_app, db, models, mail, tasks
 del os.environ["TESTING"]
 from flask_mail import Mail
 import logging
 from test_sprint1 import verify, signup, login
 from test_sprint2 import create_group, join_group, delete_group, leave_group, create_folder, delete_folder, delete_resource
 import time
+import json
 
 @pytest.fixture
 def app():
@@ -203,16 +204,23 @@ def test_extractor_interface(app, client):
     res2 = extract(client, 9999)
     assert b"Resource not found!" in res2.data
 
+    # There is no broker in the testing environment, keywords are generated
+    # by the local task pools (the statistical extractor needs no model)
+    app.config["KEYWORD_EXTRACTOR_BY_TYPE"] = {"notes": "statistical"}
     res3 = extract(client, resource.id)
     assert b"Resource queued for keyword generation!" in res3.data
     with app.app_context():
         q = models.Queue.query.filter_by(resource=resource.id).first()
         assert q is not None
-    # Cannot run celery task in testing environment
-    # So we will manually add the keywords to the database
-    keywords = models.Keywords(resource=resource.id, json='["Test Notes", "Subtitle"]')
+    assert tasks.join(60)
+    app.config["KEYWORD_EXTRACTOR_BY_TYPE"] = {}
     with app.app_context():
-        db.session.add(keywords)
+        keywords = models.Keywords.query.filter_by(resource=resource.id).first()
+        assert keywords is not None
+        assert "Subtitle" in json.loads(keywords.json)
+        q = models.Queue.query.filter_by(resource=resource.id).first()
+        assert q.state == "done"
+        models.JobSpan.query.filter_by(resource=resource.id).delete()
         db.session.delete(q)
         db.session.commit()
 
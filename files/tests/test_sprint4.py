@@ -0,0 +1,1741 @@
+import pytest
+import os
+os.environ["TESTING"] = "1"
+from app import app as flask_app, db, models, mail
+del os.environ["TESTING"]
+from flask_mail import Mail
+import logging
+import threading
+import numpy as np
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+@pytest.fixture
+def app():
+    flask_app.config['TESTING'] = True
+    flask_app.config['WTF_CSRF_ENABLED'] = False
+    flask_app.config['PHRASE_CACHE_DIR'] = None
+    flask_app.logger.disabled = True
+    log = logging.getLogger(__name__)
+    log.disabled = True
+    mail = Mail(flask_app)
+    yield flask_app
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+# Write a minimal pdf with one line of text per page
+def make_pdf(path, pages):
+    kids = " ".join(str(4 + 2 * i) + " 0 R" for i in range(len(pages)))
+    objs = {
+        1: "<< /Type /Catalog /Pages 2 0 R >>",
+        2: "<< /Type /Pages /Kids [" + kids + "] /Count " + str(len(pages)) + " >>",
+        3: "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    for i, text in enumerate(pages):
+        stream = "BT /F1 12 Tf 72 712 Td (" + text + ") Tj ET"
+        objs[4 + 2 * i] = "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents " + str(5 + 2 * i) + " 0 R >>"
+        objs[5 + 2 * i] = "<< /Length " + str(len(stream)) + " >>\nstream\n" + stream + "\nendstream"
+    out = "%PDF-1.4\n"
+    offsets = {}
+    for num in sorted(objs):
+        offsets[num] = len(out)
+        out += str(num) + " 0 obj\n" + objs[num] + "\nendobj\n"
+    xref = len(out)
+    out += "xref\n0 " + str(len(objs) + 1) + "\n0000000000 65535 f \n"
+    for num in sorted(objs):
+        out += "%010d 00000 n \n" % offsets[num]
+    out += "trailer\n<< /Size " + str(len(objs) + 1) + " /Root 1 0 R >>\nstartxref\n" + str(xref) + "\n%%EOF\n"
+    with open(path, "w") as f:
+        f.write(out)
+
+"""
+Test Inference Server Micro-Batching:
+1. Concurrent requests from several clients are answered with the right rows
+2. Requests are merged into fewer forward passes than requests
+3. Batch size and queue wait histograms are reported
+"""
+def test_inference_batching(app):
+    from app.inference import create_server, RemoteEmbedder
+
+    calls = []
+    def fake_embed(texts):
+        calls.append(len(texts))
+        return np.array([[len(t), i] for i, t in enumerate(texts)], dtype=np.float32)
+
+    server = create_server("127.0.0.1:0", embed_fn=fake_embed, max_batch=64, max_wait_ms=200)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    address = "127.0.0.1:" + str(server.server_address[1])
+
+    results = {}
+    def worker(n):
+        embedder = RemoteEmbedder(address)
+        results[n] = embedder.embed(["x" * n, "y" * (n + 1)])
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(1, 9)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # 1. Each client gets back its own rows
+    for n in range(1, 9):
+        assert results[n].shape == (2, 2)
+        assert list(results[n][:, 0]) == [n, n + 1]
+
+    # 2. Fewer forward passes than requests
+    assert sum(calls) == 16
+    assert len(calls) < 8
+
+    # 3. Histograms
+    stats = RemoteEmbedder(address).stats()
+    assert stats["batch_size"]["count"] == len(calls)
+    assert stats["queue_wait_ms"]["count"] == 8
+
+    server.shutdown()
+    server.batcher.stop()
+    server.server_close()
+
+"""
+Test Leased Job Queue:
+1. Concurrent workers claim distinct jobs
+2. Nothing left to claim once every job is running
+3. Only the lease holder can heartbeat
+4. An expired lease is reclaimed by another worker
+5. Completed jobs are no longer active
+6. A failed heartbeat doesn't stop the lease's heartbeats
+"""
+def test_job_claims(app, monkeypatch):
+    from app import jobs
+    from datetime import datetime, timedelta
+    from sqlalchemy.exc import OperationalError
+
+    with app.app_context():
+        ids = [jobs.enqueue(900000 + n).id for n in range(8)]
+
+    # 1. Concurrent claims
+    claimed = []
+    lock = threading.Lock()
+    def worker(name):
+        with app.app_context():
+            while (job := jobs.claim(name)) is not None:
+                with lock:
+                    claimed.append((job.id, name))
+    threads = [threading.Thread(target=worker, args=("worker" + str(n),)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    claimed_ids = [id for id, _ in claimed]
+    assert len(claimed_ids) == len(set(claimed_ids))
+    assert set(ids) <= set(claimed_ids)
+
+    # 2. Nothing left
+    with app.app_context():
+        assert jobs.claim("late worker") is None
+        assert jobs.active(900000).state == "running"
+
+    # 3. Heartbeat
+    first, owner = [c for c in claimed if c[0] == ids[0]][0]
+    with app.app_context():
+        assert jobs.heartbeat(first, owner)
+        assert not jobs.heartbeat(first, "someone else")
+
+    # 4. Expired lease
+    with app.app_context():
+        job = db.session.get(models.Queue, first)
+        job.lease_expires = datetime.now() - timedelta(seconds=1)
+        db.session.commit()
+        job = jobs.claim("rescuer")
+        assert job.id == first
+        assert job.attempts == 2
+        assert job.worker == "rescuer"
+
+    # 5. Complete
+    with app.app_context():
+        job = db.session.get(models.Queue, first)
+        jobs.complete(job)
+        db.session.commit()
+        assert job.state == "done"
+        assert job.finished is not None
+        assert jobs.active(job.resource) is None
+
+    # 6. Failed heartbeat
+    beats = []
+    def flaky(job_id, worker):
+        beats.append(job_id)
+        if len(beats) == 1:
+            raise OperationalError("UPDATE queue", {}, Exception("database is locked"))
+        return True
+    monkeypatch.setitem(app.config, "JOB_LEASE_SECONDS", 3)
+    monkeypatch.setattr(jobs, "heartbeat", flaky)
+    with jobs.Lease(ids[1], "worker0") as lease:
+        time.sleep(2.5)
+        assert lease.thread.is_alive()
+    assert beats == [ids[1], ids[1]]
+
+    # Tear Down
+    with app.app_context():
+        models.Queue.query.filter(models.Queue.id.in_(ids)).delete()
+        db.session.commit()
+
+"""
+Test Dead Letter Handling:
+1. A failed job backs off and can't be claimed until it is available
+2. A job is dead lettered once it has used every attempt
+3. Dead jobs are listed in the admin panel
+4. Requeue gives a dead job fresh attempts
+5. Purge deletes dead jobs
+"""
+def test_job_dead_letter(app, client):
+    from app import jobs
+    from datetime import datetime, timedelta
+
+    with app.app_context():
+        id = jobs.enqueue(910000).id
+        models.Queue.query.filter(models.Queue.id != id, models.Queue.state.in_(jobs.ACTIVE_STATES)).update({"state": "done"})
+        db.session.commit()
+
+    # 1. Backoff
+    with app.app_context():
+        assert jobs.claim("worker").id == id
+        delay = jobs.fail(id, "Broken PDF")
+        assert delay == app.config["JOB_BACKOFF_SECONDS"]
+        assert jobs.claim("worker") is None
+        job = db.session.get(models.Queue, id)
+        assert job.state == "queued"
+        assert job.last_error == "Broken PDF"
+
+    # 2. Dead letter after max attempts
+    with app.app_context():
+        for attempt in range(2, app.config["JOB_MAX_ATTEMPTS"] + 1):
+            models.Queue.query.filter_by(id=id).update({"available_at": datetime.now() - timedelta(seconds=1)})
+            db.session.commit()
+            assert jobs.claim("worker").attempts == attempt
+            jobs.fail(id, "Broken PDF")
+        job = db.session.get(models.Queue, id)
+        assert job.state == "dead"
+        assert jobs.claim("worker") is None
+        assert jobs.active(910000) is None
+
+    # 3. Admin panel
+    res = client.get("/admin/deadjobs/")
+    assert res.status_code == 200
+    assert b"Broken PDF" in res.data
+
+    # 4. Requeue
+    with app.app_context():
+        assert jobs.requeue([id]) == 1
+        job = jobs.claim("worker")
+        assert job.id == id
+        assert job.attempts == 1
+        jobs.dead_letter(job, "Still broken")
+        db.session.commit()
+
+    # 5. Purge
+    with app.app_context():
+        assert jobs.purge([id]) == 1
+        assert db.session.get(models.Queue, id) is None
+
+"""
+Test Keyword Cache Single Flight:
+1. Concurrent jobs for the same content compute it once
+2. Later jobs are served from the cache
+3. Failed extractions are not cached
+"""
+def test_keyword_cache(app):
+    from app import kwcache
+    import time
+
+    key = kwcache.text_key("Gaussian   elimination\nnotes")
+    assert key == kwcache.text_key("Gaussian elimination notes")
+
+    # 1. Single flight
+    calls = []
+    results = []
+    def compute():
+        calls.append(1)
+        time.sleep(0.5)
+        return ["gaussian elimination"]
+    def worker():
+        with app.app_context():
+            results.append(kwcache.single_flight(key, compute))
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert results == [["gaussian elimination"]] * 4
+
+    # 2. Cache hit
+    with app.app_context():
+        assert kwcache.single_flight(key, lambda: 1 / 0) == ["gaussian elimination"]
+        assert kwcache.lookup(key).state == "ready"
+
+    # 3. Failures not cached
+    failed = kwcache.text_key("unreadable")
+    with app.app_context():
+        assert kwcache.single_flight(failed, lambda: []) == []
+        assert kwcache.lookup(failed) is None
+
+    # Tear Down
+    with app.app_context():
+        models.KeywordCache.query.filter_by(hash=key).delete()
+        db.session.commit()
+
+# Deterministic stand-in for the sentence-transformer, one dimension per hashed word
+class FakeEmbedder:
+    def __init__(self):
+        self.batches = []
+
+    def embed(self, documents, verbose=False):
+        self.batches.append(len(documents))
+        out = np.zeros((len(documents), 32), dtype=np.float32)
+        for i, doc in enumerate(documents):
+            for word in doc.lower().split():
+                out[i, sum(map(ord, word)) % 32] += 1
+        return out
+
+class FakeKeyBERT:
+    def __init__(self):
+        self.model = FakeEmbedder()
+
+"""
+Test Chunked Keyword Extraction:
+1. Chunks never exceed the configured size
+2. Long documents are embedded in bounded batches
+3. Keywords are returned for long documents
+4. No text gives None
+"""
+def test_chunked_extraction(app, monkeypatch):
+    from app import pipeline, registry
+
+    fake = FakeKeyBERT()
+    monkeypatch.setattr(registry, "_model", fake)
+    pages = ["Gaussian elimination solves linear systems of equations. " * 40 for _ in range(30)]
+
+    # 1. Chunk sizes
+    with app.app_context():
+        chunks = list(pipeline.chunk_text(pages, 500))
+    assert len(chunks) > 30
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    assert " ".join(chunks).split() == " ".join(pages).split()
+
+    # 2 & 3. Long document
+    with app.app_context():
+        keywords = pipeline.keybert_exec(iter(pages))
+    assert 0 < len(keywords) <= 10
+    assert max(fake.model.batches) <= max(app.config["KEYWORD_EMBED_BATCH"], 256)
+
+    # 4. No text
+    with app.app_context():
+        assert pipeline.keybert_exec(iter(["", "   "])) is None
+
+"""
+Test Parallel PDF Extraction:
+1. Small pdfs are read serially
+2. Large pdfs are read in the pool and pages come back in order
+"""
+def test_parallel_pdf(app, monkeypatch, tmp_path):
+    from app import pipeline
+    path = str(tmp_path / "slides.pdf")
+    make_pdf(path, ["Slide " + str(i) + " covers topic " + str(i * 7) for i in range(40)])
+    resource = models.Resource(data=path, type="material")
+    monkeypatch.setitem(app.config, "PDF_POOL_SIZE", 2)
+    monkeypatch.setitem(app.config, "PDF_PAGES_PER_TASK", 4)
+
+    # 1. Serial
+    monkeypatch.setitem(app.config, "PDF_PARALLEL_MIN_PAGES", 100)
+    serial = list(pipeline.iter_material(resource))
+    assert pipeline._pdf_pool is None
+    assert serial[3] == "Slide 3 covers topic 21"
+
+    # 2. Parallel
+    monkeypatch.setitem(app.config, "PDF_PARALLEL_MIN_PAGES", 16)
+    parallel = list(pipeline.iter_material(resource))
+    assert pipeline._pdf_pool is not None
+    assert parallel == serial
+    pipeline.reset_pdf_pool()
+
+def slow_extract(resource):
+    yield "first page"
+    import time
+    time.sleep(5)
+    yield "never sent"
+
+def quick_extract(resource):
+    for n in range(3):
+        yield "page " + str(n)
+
+def greedy_extract(resource):
+    data = bytearray(512 * 1024 * 1024)
+    yield str(len(data))
+
+"""
+Test Sandboxed Extraction:
+1. Pieces stream back from the sandbox
+2. A hanging extraction is killed after the timeout
+3. An extraction over the memory limit fails cleanly
+4. Failures give an empty keyword list ("Extraction failed")
+5. Time spent by the consumer doesn't count against the timeout
+"""
+def test_sandboxed_extraction(app, monkeypatch, tmp_path):
+    from app import pipeline, registry
+    import time
+    path = tmp_path / "lecture.txt"
+    path.write_text("line one\nline two\n")
+    resource = models.Resource(data=str(path), type="transcript")
+
+    # 1. Streaming
+    assert list(pipeline.sandboxed(pipeline.iter_transcript, resource)) == ["line one\n", "line two\n"]
+
+    # 2. Timeout
+    monkeypatch.setitem(app.config, "EXTRACT_TIMEOUT", 1)
+    start = time.monotonic()
+    pieces = []
+    with pytest.raises(pipeline.ExtractionFailed):
+        for piece in pipeline.sandboxed(slow_extract, resource):
+            pieces.append(piece)
+    assert pieces == ["first page"]
+    assert time.monotonic() - start < 4
+
+    # 3. Memory limit
+    monkeypatch.setitem(app.config, "EXTRACT_TIMEOUT", 30)
+    monkeypatch.setitem(app.config, "EXTRACT_MEMORY_LIMIT", 64 * 1024 * 1024)
+    with pytest.raises(pipeline.ExtractionFailed):
+        list(pipeline.sandboxed(greedy_extract, resource))
+
+    # 4. Extraction failed path
+    monkeypatch.setattr(registry, "_model", FakeKeyBERT())
+    assert pipeline.keybert_exec(pipeline.sandboxed(greedy_extract, resource)) == []
+
+    # 5. Slow consumer
+    monkeypatch.setitem(app.config, "EXTRACT_TIMEOUT", 1)
+    pieces = []
+    for piece in pipeline.sandboxed(quick_extract, resource):
+        time.sleep(0.6)
+        pieces.append(piece)
+    assert pieces == ["page 0", "page 1", "page 2"]
+
+"""
+Test Statistical Extractor:
+1. Keywords come from term statistics without loading the model
+2. Words from the markdown headings are boosted
+3. No text gives None, like the keybert extractor
+4. The extractor is picked per resource type and versions the cache key
+"""
+def test_statistical_extractor(app, monkeypatch):
+    from app import extractors, registry, kwcache
+    monkeypatch.setattr(registry, "_model", None)
+    text = ("Photosynthesis converts light energy into chemical energy. "
+            "Chlorophyll absorbs light in the chloroplast. "
+            "The light reactions and the Calvin cycle make up photosynthesis. "
+            "Mitochondria are mentioned once. ") * 5
+
+    # 1. Statistics only
+    keywords = extractors.statistical_extractor([text])
+    assert registry._model is None
+    assert 0 < len(keywords) <= 10
+    assert "light" in keywords
+    assert any("photosynthesi" in keyword for keyword in keywords)
+    assert "the" not in keywords
+
+    # 2. Heading boost
+    plain = extractors.statistical_extractor([text], top_n=3)
+    boosted = extractors.statistical_extractor([text], ["Mitochondria"], top_n=3)
+    assert not any("mitochondria" in keyword for keyword in plain)
+    assert any("mitochondria" in keyword for keyword in boosted)
+
+    # 3. No text
+    assert extractors.statistical_extractor([]) is None
+
+    # 4. Per type configuration
+    monkeypatch.setitem(app.config, "KEYWORD_EXTRACTOR", "keybert")
+    monkeypatch.setitem(app.config, "KEYWORD_EXTRACTOR_BY_TYPE", {"transcript": "statistical"})
+    assert extractors.name_for("transcript") == "statistical"
+    assert extractors.name_for("material") == "keybert"
+    assert extractors.uses_model()
+    monkeypatch.setitem(app.config, "KEYWORD_EXTRACTOR", "statistical")
+    monkeypatch.setitem(app.config, "KEYWORD_EXTRACTOR_BY_TYPE", {})
+    assert not extractors.uses_model()
+    assert kwcache.model_version("statistical") != kwcache.model_version("keybert")
+
+"""
+Test Phrase Embedding Cache:
+1. Only unseen phrases are sent to the model
+2. Cached rows match what the model returned (float16 precision)
+3. The cache persists across processes (a new instance sees old entries)
+4. The least recently used phrases are evicted when full
+5. Hit rate and bytes used are reported
+"""
+def test_phrase_cache(app, monkeypatch, tmp_path):
+    from app import phrasecache, pipeline, registry
+    monkeypatch.setitem(app.config, "PHRASE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setitem(app.config, "PHRASE_CACHE_CAPACITY", 4)
+    model = FakeEmbedder()
+    cache = phrasecache.PhraseCache(str(tmp_path), "fake", 4)
+    embedder = phrasecache.CachedEmbedder(model, cache)
+
+    # 1. Misses only
+    first = embedder.embed(["neural network", "time complexity"])
+    second = embedder.embed(["neural network", "time complexity", "big o"])
+    assert model.batches == [2, 1]
+
+    # 2. Same rows
+    assert np.allclose(first, second[:2], atol=1e-3)
+    assert np.allclose(second[2], model.embed(["big o"])[0], atol=1e-3)
+
+    # 3. Persistent
+    model.batches = []
+    reopened = phrasecache.CachedEmbedder(model, phrasecache.PhraseCache(str(tmp_path), "fake", 4))
+    reopened.embed(["neural network", "big o"])
+    assert model.batches == []
+
+    # 4. LRU eviction, time complexity is the least recently used
+    reopened.embed(["graph", "tree"])
+    assert model.batches == [2]
+    reopened.embed(["neural network", "big o", "graph", "tree"])
+    assert model.batches == [2]
+    reopened.embed(["time complexity"])
+    assert model.batches == [2, 1]
+
+    # 5. Stats
+    stats = reopened.cache.stats()
+    assert stats["entries"] == 4
+    assert stats["bytes_used"] == 4 * 32 * 2
+    assert stats["hits"] == 8 and stats["misses"] == 6
+    assert stats["hit_rate"] == round(8 / 14, 3)
+
+    # Used by keyword extraction when enabled
+    monkeypatch.setitem(app.config, "PHRASE_CACHE_CAPACITY", 1000)
+    monkeypatch.setattr(registry, "_model", FakeKeyBERT())
+    text = "Neural networks learn weights. Time complexity of training neural networks. " * 3
+    assert pipeline.keybert_exec([text])
+    batches = len(registry._model.model.batches)
+    assert pipeline.keybert_exec([text])
+    # Only the document chunk is embedded the second time
+    assert len(registry._model.model.batches) == batches + 1
+    assert phrasecache.stats()["hits"] > 0
+
+"""
+Test Diversity Selection:
+1. Greedy MMR picks the same keywords as keybert's MMR
+2. Uncapped max sum picks the same keywords as keybert's max sum
+3. The max sum pool is capped to the combination budget
+4. Fewer candidates than keywords returns every candidate
+"""
+def test_diversity_selection(app):
+    from app import diversity
+    from keybert._mmr import mmr as keybert_mmr
+    from keybert._maxsum import max_sum_distance
+    rng = np.random.default_rng(1)
+    embeddings = rng.normal(size=(60, 16)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    doc = embeddings[:10].mean(axis=0)
+    doc /= np.linalg.norm(doc)
+    words = ["w" + str(i) for i in range(60)]
+
+    # 1. MMR
+    for diversity_value in (0.2, 0.5, 0.8):
+        expected = keybert_mmr(doc.reshape(1, -1), embeddings, words, 8, diversity_value)
+        assert [w for w, _ in diversity.mmr(doc, embeddings, words, 8, diversity_value)] == [w for w, _ in expected]
+
+    # 2. Max sum
+    with app.app_context():
+        expected = max_sum_distance(doc.reshape(1, -1), embeddings, words, 4, 10)
+        found = diversity.max_sum(doc, embeddings, words, 4, 10, max_combinations=1000)
+    assert set(w for w, _ in found) == set(w for w, _ in expected)
+
+    # 3. Capped
+    assert diversity.maxsum_pool(10, 20, 20000) == 17
+    assert diversity.maxsum_pool(4, 10, 210) == 10
+    with app.app_context():
+        assert len(diversity.max_sum(doc, embeddings, words, 10, 20, max_combinations=100)) == 10
+
+    # 4. Small pools
+    assert len(diversity.mmr(doc, embeddings[:3], words[:3], 10)) == 3
+    assert diversity.mmr(doc, embeddings[:0], [], 10) == []
+
+"""
+Test Candidate Prefilter:
+1. Stopword, digit and single character candidates are dropped
+2. Stem equivalent candidates collapse to the most frequent form
+3. Rare candidates are dropped only on long documents
+4. The number of embedded candidates is bounded
+"""
+def test_candidate_prefilter(app, monkeypatch):
+    from app import pipeline, registry
+    from collections import Counter
+
+    # 1. Junk
+    assert pipeline.prefilter(Counter({"2019": 3, "x": 2, "network": 1})) == ["network"]
+
+    # 2. Stems
+    counts = Counter({"network": 2, "networks": 5, "neural network": 3, "neural networks": 1})
+    assert pipeline.prefilter(counts) == ["networks", "neural network"]
+
+    # 3. Rare candidates
+    counts = Counter({"graph": 1, "tree": 1, "heap": 4})
+    assert pipeline.prefilter(counts, max_candidates=10) == ["heap", "graph", "tree"]
+    assert pipeline.prefilter(counts, max_candidates=2) == ["heap"]
+
+    # 4. Bounded embedding work
+    monkeypatch.setitem(app.config, "KEYWORD_MAX_CANDIDATES", 50)
+    monkeypatch.setattr(registry, "_model", FakeKeyBERT())
+    text = " ".join("topic" + chr(97 + i % 26) + chr(97 + i // 26 % 26) for i in range(3000))
+    assert pipeline.keybert_exec([text])
+    chunks = len(list(pipeline.chunk_text([text])))
+    assert sum(registry._model.model.batches) == chunks + 50
+
+"""
+Test Text Normalization:
+1. Rolling vtt captions are only kept once
+2. Repeated page headers, footers and page numbers are stripped
+3. Hyphenated line breaks are joined and whitespace collapsed
+4. The size reduction is reported
+"""
+def test_normalization(app, tmp_path):
+    from app import normalize, pipeline
+
+    # 1. Captions
+    path = tmp_path / "lecture.vtt"
+    path.write_text("WEBVTT\n\n"
+        "00:00:00.000 --> 00:00:02.000\nwelcome to the lecture\n\n"
+        "00:00:02.000 --> 00:00:04.000\nwelcome to the lecture\ntoday we cover graphs\n\n"
+        "00:00:04.000 --> 00:00:06.000\ntoday we cover graphs\nand shortest paths\n\n")
+    resource = models.Resource(data=str(path), type="transcript")
+    assert list(normalize.normalize(pipeline.iter_transcript(resource), "transcript")) == [
+        "welcome to the lecture", "today we cover graphs", "and shortest paths"]
+
+    # 2. Boilerplate
+    pages = ["COMP2001 Algorithms\nGraphs part " + str(i) + "\nBody text " + str(i) + "\nPage " + str(i) + " of 5" for i in range(1, 6)]
+    stripped = list(normalize.strip_boilerplate(pages))
+    assert stripped[0] == "Graphs part 1\nBody text 1"
+    assert all("COMP2001" not in page and "Page" not in page for page in stripped)
+    assert list(normalize.strip_boilerplate(pages[:2])) == pages[:2]
+
+    # 3. Hyphens and whitespace
+    assert list(normalize.normalize(["a dyn-\n  amic   pro-\ngram\n\n"], "material")) == ["a dynamic program"]
+
+    # 4. Report
+    report = normalize.SizeReport("material")
+    out = list(normalize.normalize(pages, "material", report))
+    assert report.before == sum(len(page) for page in pages)
+    assert report.after == sum(len(page) for page in out)
+    assert report.after < report.before / 2
+
+"""
+Test Single Pass Notes Reader:
+1. Plaintext has the same words as the markdown/BeautifulSoup round trip
+2. Headings match the previous heading scan
+3. Large notes prepare in a fraction of the time
+"""
+def test_notes_reader(app):
+    from app import notes
+    from markdown import markdown
+    from bs4 import BeautifulSoup
+    import html
+    import glob
+    import time
+
+    def reference(data):
+        ht = markdown(html.unescape(data))
+        return ''.join(BeautifulSoup(ht, features="html.parser").findAll(text=True))
+
+    # 1. Text
+    corpus = {}
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(__file__), "notes", "*.md"))):
+        with open(path) as f:
+            corpus[os.path.basename(path)] = f.read()
+    assert len(corpus) == 2
+    for name, data in corpus.items():
+        assert notes.parse(data)[1].split() == reference(data).split(), name
+
+    # 2. Headings
+    assert notes.parse(corpus["algorithms.md"])[0] == ["Algorithms", "Dynamic Programming", "Sorting ##", "Trees"]
+    assert notes.parse(corpus["lecture.md"])[0] == ["Deadlock & Starvation", "Memory", "Processes", "Scheduling"]
+
+    # 3. Speed
+    data = "\n".join(corpus.values()) * 100
+    start = time.perf_counter()
+    reference(data)
+    before = time.perf_counter() - start
+    start = time.perf_counter()
+    notes.parse(data)
+    assert time.perf_counter() - start < before / 2
+
+"""
+Test Incremental Note Regeneration:
+1. Notes are split into heading delimited sections
+2. The first generation embeds every section
+3. After an edit only the changed section is embedded
+4. Removed sections are dropped and keywords still come from the whole note
+"""
+def test_incremental_notes(app, monkeypatch, tmp_path):
+    from app import notes, registry
+    monkeypatch.setitem(app.config, "PHRASE_CACHE_DIR", str(tmp_path))
+    model = FakeKeyBERT()
+    monkeypatch.setattr(registry, "_model", model)
+    texts = []
+    embed = model.model.embed
+    def recording_embed(documents, verbose=False):
+        texts.extend(documents)
+        return embed(documents)
+    monkeypatch.setattr(model.model, "embed", recording_embed)
+    resource_id = 999999
+    note = ("Intro to the course\n\n# Sorting\nMerge sort and quick sort algorithms\n\n"
+            "# Graphs\nBreadth first search and depth first search\n\n# Hashing\nOpen addressing and chaining\n")
+
+    # 1. Sections
+    assert notes.sections(note) == ["Intro to the course", "Sorting\nMerge sort and quick sort algorithms",
+        "Graphs\nBreadth first search and depth first search", "Hashing\nOpen addressing and chaining"]
+
+    with app.app_context():
+        try:
+            # 2. First generation
+            assert notes.keybert_sections(resource_id, note)
+            assert models.NoteSection.query.filter_by(resource=resource_id).count() == 4
+            assert sum("Merge sort" in text for text in texts) == 1
+
+            # 3. Edit one section
+            texts.clear()
+            edited = note.replace("Open addressing and chaining", "Open addressing, chaining and cuckoo hashing")
+            keywords = notes.keybert_sections(resource_id, edited)
+            # Candidates are 1-2 grams, longer texts are section chunks
+            chunks = [text for text in texts if len(text.split()) > 2]
+            assert chunks == ["Hashing Open addressing, chaining and cuckoo hashing"]
+            assert "cuckoo" in " ".join(texts)
+            assert models.NoteSection.query.filter_by(resource=resource_id).count() == 4
+
+            # 4. Remove a section
+            texts.clear()
+            shorter = edited.replace("# Graphs\nBreadth first search and depth first search\n\n", "")
+            keywords = notes.keybert_sections(resource_id, shorter)
+            assert models.NoteSection.query.filter_by(resource=resource_id).count() == 3
+            assert keywords and not any("search" in keyword for keyword in keywords)
+            assert notes.keybert_sections(resource_id, "") is None
+        finally:
+            models.NoteSection.query.filter_by(resource=resource_id).delete()
+            db.session.commit()
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    pages = {}
+    calls = []
+    etag = '"v1"'
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+    aborted = False
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, status, body, headers={}):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        from urllib.parse import urlparse, parse_qs
+        url = urlparse(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        StubHandler.calls.append((url.path, params, dict(self.headers)))
+        if url.path == "/w/api.php":
+            titles = params["titles"].split("|")
+            redirects = [{"from": "ML", "to": "Machine learning"}] if "ML" in titles else []
+            pages = {}
+            for i, title in enumerate(titles):
+                target = "Machine learning" if title == "ML" else title
+                if target not in StubHandler.pages:
+                    pages[str(-1 - i)] = {"title": target, "missing": ""}
+                    continue
+                revid, extract = StubHandler.pages[target]
+                page = {"pageid": abs(hash(target)), "title": target, "lastrevid": revid}
+                if "extracts" in params["prop"]:
+                    page["extract"] = extract
+                pages[str(page["pageid"])] = page
+            body = json.dumps({"query": {"redirects": redirects, "pages": pages}}).encode()
+            self.send_body(200, body, {"Content-Type": "application/json"})
+        elif url.path == "/article":
+            with StubHandler.lock:
+                StubHandler.active += 1
+                StubHandler.peak = max(StubHandler.peak, StubHandler.active)
+            time.sleep(0.3)
+            with StubHandler.lock:
+                StubHandler.active -= 1
+            body = ("<html><head><title>Article " + params.get("n", "") + "</title><style>p {}</style></head>"
+                "<body><script>var x = 1;</script><p>Dijkstra finds shortest paths &amp; trees</p></body></html>").encode()
+            self.send_body(200, body, {"Content-Type": "text/html; charset=utf-8"})
+        elif url.path == "/moved":
+            self.send_body(302, b"", {"Location": "/article?n=moved"})
+        elif url.path == "/slow":
+            time.sleep(3)
+            self.send_body(200, b"<p>too late</p>", {"Content-Type": "text/html"})
+        elif url.path == "/big":
+            self.close_connection = True
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for i in range(2000):
+                    chunk = ("<p>paragraph " + str(i) + " " + "word " * 100 + "</p>").encode()
+                    self.wfile.write(hex(len(chunk))[2:].encode() + b"\r\n" + chunk + b"\r\n")
+                self.wfile.write(b"0\r\n\r\n")
+            except OSError:
+                StubHandler.aborted = True
+        elif url.path == "/page":
+            if self.headers.get("If-None-Match") == StubHandler.etag:
+                self.send_body(304, b"")
+            else:
+                self.send_body(200, b"<p>plain page</p>", {"ETag": StubHandler.etag})
+        else:
+            self.send_body(404, b"")
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    StubHandler.calls = []
+    StubHandler.pages = {
+        "Graph theory": (10, "<p>Graph theory studies <b>graphs</b>.</p>"),
+        "Machine learning": (20, "<p>Machine learning learns from data.</p>"),
+    }
+    yield "http://127.0.0.1:" + str(server.server_port)
+    server.shutdown()
+
+"""
+Test Url Fetching And Cache:
+1. Wikipedia titles are fetched in one batched query, redirects and missing pages resolved
+2. Cached articles are not fetched again, also by concurrent workers
+3. Stale articles are revalidated by revision, only changed ones are fetched again
+4. Plain urls are revalidated with their ETag
+5. prepare_url reads the article through the cache
+"""
+def test_url_fetching(app, monkeypatch, tmp_path, stub_server):
+    from app import fetch, pipeline
+    monkeypatch.setitem(app.config, "WIKIPEDIA_API_URL", stub_server + "/w/api.php")
+    monkeypatch.setitem(app.config, "URL_CACHE_DIR", str(tmp_path))
+    api_calls = lambda: [params for path, params, _ in StubHandler.calls if path == "/w/api.php"]
+
+    # 1. Batch
+    found = fetch.wikipedia(["Graph theory", "ML", "Nothing here"])
+    assert len(api_calls()) == 1
+    assert api_calls()[0]["titles"] == "Graph theory|ML|Nothing here"
+    assert "Graph theory studies **graphs**" in found["Graph theory"]
+    assert "learns from data" in found["ML"]
+    assert found["Nothing here"] == ""
+
+    # 2. Cached, concurrent requests for a new title fetch it once
+    fetch.wikipedia(["Graph theory", "ML"])
+    assert len(api_calls()) == 1
+    StubHandler.pages["Hashing"] = (30, "<p>Hash tables</p>")
+    threads = [threading.Thread(target=fetch.wikipedia, args=(["Hashing"],)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(api_calls()) == 2
+
+    # 3. Revalidation
+    monkeypatch.setitem(app.config, "URL_CACHE_TTL", 0)
+    StubHandler.pages["Machine learning"] = (21, "<p>Machine learning, revised.</p>")
+    StubHandler.calls = []
+    found = fetch.wikipedia(["Graph theory", "ML"])
+    assert [call["prop"] for call in api_calls()] == ["info", "extracts|info"]
+    assert api_calls()[1]["titles"] == "ML"
+    assert "revised" in found["ML"]
+
+    # 4. ETag
+    StubHandler.calls = []
+    assert "plain page" in fetch.get(stub_server + "/page")["content"]
+    assert "plain page" in fetch.get(stub_server + "/page")["content"]
+    assert StubHandler.calls[1][2].get("If-None-Match") == StubHandler.etag
+
+    # 5. prepare_url
+    monkeypatch.setitem(app.config, "URL_CACHE_TTL", 3600)
+    StubHandler.calls = []
+    resource = models.Resource(data="https://en.wikipedia.org/wiki/Graph_theory", type="url")
+    with app.app_context():
+        assert "Graph theory studies" in pipeline.prepare_url(resource)
+    assert pipeline.prepare_url(models.Resource(data="https://example.com/", type="url")) == ""
+
+"""
+Test Concurrent Page Fetching:
+1. Pages are fetched concurrently, at most URL_PER_HOST at a time per host
+2. Text is extracted without scripts and styles, redirects are followed
+3. Slow pages time out and give no text, and aren't fetched again until URL_FAILURE_TTL
+4. Large pages stop streaming at the text limit
+5. Private addresses are refused unless allowed
+6. A burst of queued url resources is fetched in one round
+7. Workers only wait for the pages another worker is fetching
+"""
+def test_page_fetching(app, monkeypatch, tmp_path, stub_server):
+    from app import pagefetch, pipeline
+    monkeypatch.setitem(app.config, "URL_CACHE_DIR", str(tmp_path))
+    monkeypatch.setitem(app.config, "URL_ALLOW_PRIVATE", True)
+    monkeypatch.setitem(app.config, "URL_PER_HOST", 2)
+    monkeypatch.setitem(app.config, "URL_FETCH_TIMEOUT", (1, 1))
+    monkeypatch.setitem(app.config, "URL_MAX_TEXT_KB", 16)
+    StubHandler.peak = 0
+    port = stub_server.rsplit(":", 1)[1]
+
+    # 1. Concurrency
+    urls = [stub_server + "/article?n=" + str(i) for i in range(4)] + ["http://localhost:" + port + "/article?n=" + str(i) for i in range(4)]
+    start = time.monotonic()
+    pages = pagefetch.fetch_pages(urls)
+    elapsed = time.monotonic() - start
+    assert StubHandler.peak <= 4
+    assert StubHandler.peak >= 3
+    assert elapsed < 8 * 0.3
+
+    # 2. Text
+    assert pages[urls[0]] == "Article 0\nDijkstra finds shortest paths & trees"
+    assert "shortest paths" in pagefetch.fetch_pages([stub_server + "/moved"])[stub_server + "/moved"]
+
+    # 3. Timeout, the failure is cached for URL_FAILURE_TTL
+    assert pagefetch.fetch_pages([stub_server + "/slow"])[stub_server + "/slow"] == ""
+    StubHandler.calls = []
+    start = time.monotonic()
+    assert pagefetch.page(stub_server + "/slow") == ""
+    assert StubHandler.calls == [] and time.monotonic() - start < 0.5
+    monkeypatch.setitem(app.config, "URL_FAILURE_TTL", 0)
+    assert pagefetch.fetch_pages([stub_server + "/slow"])[stub_server + "/slow"] == ""
+    assert len(StubHandler.calls) == 1
+
+    # 4. Early termination
+    text = pagefetch.fetch_pages([stub_server + "/big"])[stub_server + "/big"]
+    assert 16 * 1024 <= len(text) < 2 * 16 * 1024
+
+    # 5. Private addresses
+    monkeypatch.setitem(app.config, "URL_ALLOW_PRIVATE", False)
+    assert pagefetch.fetch_pages([stub_server + "/article?n=private"])[stub_server + "/article?n=private"] == ""
+    monkeypatch.setitem(app.config, "URL_ALLOW_PRIVATE", True)
+
+    # 6. Burst through prepare_url
+    monkeypatch.setitem(app.config, "URL_FETCH_PAGES", True)
+    from app import fetch
+    burst = [stub_server + "/article?n=burst" + str(i) for i in range(4)]
+    monkeypatch.setattr(fetch, "prefetch_queued", lambda: pagefetch.fetch_pages(burst))
+    StubHandler.calls = []
+    start = time.monotonic()
+    assert "Dijkstra" in pipeline.prepare_url(models.Resource(data=burst[0], type="url"))
+    assert len(StubHandler.calls) == 4
+    assert time.monotonic() - start < 4 * 0.3
+    assert "Dijkstra" in pipeline.prepare_url(models.Resource(data=burst[3], type="url"))
+    assert len(StubHandler.calls) == 4
+
+    # 7. Pages are locked one by one, a page being fetched elsewhere doesn't hold up others
+    busy = stub_server + "/article?n=busy"
+    with fetch.locked("page:" + busy):
+        start = time.monotonic()
+        other = stub_server + "/article?n=other"
+        assert "Dijkstra" in pagefetch.fetch_pages([other])[other]
+        assert time.monotonic() - start < 1
+
+"""
+Test Pipeline Stages:
+1. Url resources start at the fetch stage, other resources at extract
+2. Claims only take jobs of the requested stage, and stop at the stage limit
+3. Queue depths are reported per stage and pool
+4. A url job goes through fetch, extract and persist, each stage starting the next
+5. The admin pipeline page and json endpoint show the depths
+"""
+def test_pipeline_stages(app, client, monkeypatch, tmp_path, stub_server):
+    from app import jobs
+    from app.views import kyw
+    monkeypatch.setitem(app.config, "WIKIPEDIA_API_URL", stub_server + "/w/api.php")
+    monkeypatch.setitem(app.config, "URL_CACHE_DIR", str(tmp_path))
+    monkeypatch.setitem(app.config, "KEYWORD_EXTRACTOR_BY_TYPE", {"url": "statistical"})
+    monkeypatch.setitem(app.config, "PIPELINE_STAGE_LIMITS", {"extract": 1})
+    StubHandler.pages["Graph theory"] = (10, "<p>" + "Graph theory studies graphs, vertices and edges. " * 5 + "</p>")
+    dispatched = []
+    monkeypatch.setattr(kyw, "dispatch", lambda stage, countdown=None: dispatched.append(stage))
+
+    # 1. First stage
+    assert jobs.first_stage("url") == "fetch"
+    assert jobs.first_stage("notes") == "extract"
+
+    with app.app_context():
+        models.Queue.query.filter(models.Queue.state.in_(jobs.ACTIVE_STATES)).update({"state": "done"})
+        db.session.commit()
+        folder = models.Folder(title="Stages")
+        db.session.add(folder)
+        db.session.commit()
+        db.session.add(models.SearchTree(folder=folder.id, json=""))
+        resource = models.Resource(title="Graphs", folder=folder.id, type="url", data="https://en.wikipedia.org/wiki/Graph_theory")
+        db.session.add(resource)
+        db.session.commit()
+        resource_id = resource.id
+        try:
+            fetching = jobs.enqueue(resource_id, jobs.first_stage(resource.type))
+            others = [jobs.enqueue(920000 + n).id for n in range(2)]
+
+            # 2. Stage claims and limits
+            assert jobs.claim("io worker", stage="persist") is None
+            first = jobs.claim("cpu worker", stage="extract")
+            assert first.id == others[0]
+            assert jobs.claim("cpu worker", stage="extract") is None
+            assert jobs.claim("io worker", stage="fetch").id == fetching.id
+            fetching = db.session.get(models.Queue, fetching.id)
+            jobs.fail(fetching.id, "reset")
+            fetching.available_at = None
+            db.session.commit()
+
+            # 3. Depths
+            depths = jobs.depths()
+            assert depths["extract"] == {"pool": "cpu", "queued": 1, "running": 1, "limit": 1}
+            assert depths["fetch"]["pool"] == "io" and depths["fetch"]["queued"] == 1
+            models.Queue.query.filter(models.Queue.id.in_(others)).update({"state": "done"}, synchronize_session=False)
+            db.session.commit()
+
+            # 4. Stages in order
+            # Stages run in their own app context and session
+            kyw.drain("fetch")
+            db.session.expire_all()
+            assert dispatched == ["extract"]
+            job = db.session.get(models.Queue, fetching.id)
+            assert job.stage == "extract" and job.state == "queued" and job.attempts == 0
+            assert "Graph theory studies" in json.loads(job.payload)["content"]
+            kyw.drain("extract")
+            db.session.expire_all()
+            assert dispatched == ["extract", "persist"]
+            assert json.loads(db.session.get(models.Queue, fetching.id).payload)["found"]
+            kyw.drain("persist")
+            db.session.expire_all()
+            job = db.session.get(models.Queue, fetching.id)
+            assert job.state == "done" and job.payload is None
+            keywords = json.loads(models.Keywords.query.filter_by(resource=resource_id).first().json)
+            assert any("graph" in keyword for keyword in keywords)
+            assert models.Posting.query.filter_by(folder=folder.id, resource=resource_id, term="graph", field="keyword").first()
+
+            # 5. Admin page
+            assert b"Keyword Pipeline" in client.get("/admin/pipeline/").data
+            assert client.get("/admin/pipeline/depths").get_json()["persist"]["pool"] == "io"
+        finally:
+            models.Keywords.query.filter_by(resource=resource_id).delete()
+            models.Posting.query.filter_by(resource=resource_id).delete()
+            models.Queue.query.filter(models.Queue.resource.in_([resource_id, 920000, 920001])).delete(synchronize_session=False)
+            models.SearchTree.query.filter_by(folder=folder.id).delete()
+            models.Resource.query.filter_by(id=resource_id).delete()
+            models.Folder.query.filter_by(id=folder.id).delete()
+            db.session.commit()
+
+"""
+Test Pipeline Timings:
+1. Spans only record inside a recording, repeated spans add up
+2. Streams are timed without the consumer's time, their characters counted
+3. A notes job saves wait, prepare, embedding, selection, index and write spans per stage
+4. The summary has p50/p95 per span, docs/min and chars/sec
+5. The admin page and json endpoint show the summary
+6. A job from before the leased queue, without queue times, drains with no wait
+"""
+def test_pipeline_timings(app, client, monkeypatch):
+    from app import jobs, timings, registry, notes
+    from app.views import kyw
+    monkeypatch.setattr(registry, "_model", FakeKeyBERT())
+    monkeypatch.setattr(kyw, "dispatch", lambda stage, countdown=None: None)
+
+    # 1. Spans
+    with timings.span("outside"):
+        pass
+    with timings.recording() as recorder:
+        for _ in range(2):
+            with timings.span("step") as span:
+                time.sleep(0.01)
+                span.chars = 5
+    assert list(recorder.spans) == ["step"]
+    assert recorder.spans["step"][0] >= 0.02 and recorder.spans["step"][1] == 10
+
+    # 2. Streams
+    def slow_pieces():
+        for piece in ["abc", "de"]:
+            time.sleep(0.02)
+            yield piece
+    with timings.recording() as recorder:
+        for piece in timings.timed("prepare_test", slow_pieces()):
+            time.sleep(0.05)
+    seconds, chars = recorder.spans["prepare_test"]
+    assert 0.04 <= seconds < 0.09 and chars == 5
+
+    with app.app_context():
+        models.Queue.query.filter(models.Queue.state.in_(jobs.ACTIVE_STATES)).update({"state": "done"})
+        models.JobSpan.query.delete()
+        db.session.commit()
+        folder = models.Folder(title="Timings")
+        db.session.add(folder)
+        db.session.commit()
+        db.session.add(models.SearchTree(folder=folder.id, json=""))
+        note = "# Sorting\nMerge sort and quick sort split the list and merge sorted halves.\n"
+        resource = models.Resource(title="Sorting", folder=folder.id, type="notes", data=note)
+        db.session.add(resource)
+        db.session.commit()
+        resource_id = resource.id
+        try:
+            # 3. Spans of a job
+            job_id = jobs.enqueue(resource_id, jobs.first_stage("notes")).id
+            kyw.drain("extract")
+            kyw.drain("persist")
+            db.session.expire_all()
+            assert db.session.get(models.Queue, job_id).state == "done"
+            names = {(span.stage, span.name) for span in models.JobSpan.query.filter_by(job=job_id).all()}
+            for name in ["wait", "total", "prepare_notes", "model_load", "candidates", "embed", "embed_candidates", "select"]:
+                assert ("extract", name) in names
+            for name in ["wait", "total", "index", "db_write"]:
+                assert ("persist", name) in names
+            prepare = models.JobSpan.query.filter_by(job=job_id, name="prepare_notes").first()
+            assert prepare.chars == len(notes.parse(note)[1])
+
+            # 4. Summary
+            summary = timings.summary(60)
+            assert summary["documents"] == 1
+            assert summary["docs_per_minute"] == round(1 / 60, 3)
+            assert summary["chars_per_second"] > 0
+            embed = [span for span in summary["spans"] if span["stage"] == "extract" and span["name"] == "embed"][0]
+            assert embed["count"] == 1 and 0 <= embed["p50"] <= embed["p95"]
+
+            # 5. Admin page
+            page = client.get("/admin/pipeline/").data
+            assert b"docs/min" in page and b"embed_candidates" in page
+            data = client.get("/admin/pipeline/timings?minutes=5").get_json()
+            assert data["window_minutes"] == 5 and data["documents"] == 1
+
+            # 6. Legacy job
+            legacy = jobs.enqueue(resource_id, "extract")
+            legacy.enqueued = None
+            db.session.commit()
+            legacy_id = legacy.id
+            kyw.drain("extract")
+            db.session.expire_all()
+            assert db.session.get(models.Queue, legacy_id).state == "queued"
+            assert db.session.get(models.Queue, legacy_id).stage == "persist"
+            assert models.JobSpan.query.filter_by(job=legacy_id, name="wait").one().seconds == 0
+        finally:
+            models.JobSpan.query.delete()
+            models.NoteSection.query.filter_by(resource=resource_id).delete()
+            models.Posting.query.filter_by(resource=resource_id).delete()
+            models.Keywords.query.filter_by(resource=resource_id).delete()
+            models.Queue.query.filter_by(resource=resource_id).delete()
+            models.SearchTree.query.filter_by(folder=folder.id).delete()
+            models.Resource.query.filter_by(id=resource_id).delete()
+            models.Folder.query.filter_by(id=folder.id).delete()
+            db.session.commit()
+
+"""
+Test Task Backends:
+1. TASK_BACKEND forces a backend, auto checks the broker
+2. An unreachable broker is detected quickly and the result is reused
+3. Tasks run on the local pool they are sent to, join waits for tasks they submit
+4. Countdowns delay local tasks
+5. A failed publish falls back to the local pools
+"""
+def test_task_backends(app, monkeypatch):
+    from app import tasks, celery
+    monkeypatch.setitem(app.config, "CELERY_BROKER_URL", "redis://127.0.0.1:1/0")
+    monkeypatch.setattr(celery.conf, "broker_url", "redis://127.0.0.1:1/0")
+    monkeypatch.setattr(tasks, "_broker", {"up": None, "checked": 0.0})
+    ran = []
+
+    @celery.task(name="tests.record_task")
+    def record_task(value, follow=None):
+        time.sleep(0.05)
+        ran.append((value, threading.current_thread().name))
+        if follow:
+            tasks.submit(record_task, follow, pool="cpu")
+
+    # 1 & 2. Backend selection
+    monkeypatch.setitem(app.config, "TASK_BACKEND", "local")
+    assert tasks.backend() == "local"
+    monkeypatch.setitem(app.config, "TASK_BACKEND", "auto")
+    start = time.monotonic()
+    assert tasks.backend() == "local"
+    assert time.monotonic() - start < 2
+    calls = []
+    monkeypatch.setattr(celery, "connection_for_write", lambda: calls.append(1))
+    assert tasks.backend() == "local"
+    assert calls == []
+
+    # 3. Local pools
+    assert tasks.submit(record_task, "first", "second", pool="io") == "local"
+    assert tasks.join(10)
+    assert [value for value, _ in ran] == ["first", "second"]
+    assert ran[0][1].startswith("tasks-io") and ran[1][1].startswith("tasks-cpu")
+
+    # 4. Countdown
+    ran.clear()
+    start = time.monotonic()
+    tasks.submit(record_task, "later", countdown=0.3)
+    while not ran and time.monotonic() - start < 5:
+        time.sleep(0.05)
+    assert ran and time.monotonic() - start >= 0.3
+
+    # 5. Publish failure
+    ran.clear()
+    monkeypatch.setitem(app.config, "TASK_BACKEND", "celery")
+    def refuse(*args, **kwargs):
+        raise ConnectionError("broker went away")
+    monkeypatch.setattr(record_task, "apply_async", refuse)
+    assert tasks.submit(record_task, "fallback") == "local"
+    assert tasks.join(10)
+    assert [value for value, _ in ran] == ["fallback"]
+    assert tasks._broker["up"] is False
+
+"""
+Every result of a folder, or group, search, as one page of postings.top()
+"""
+def search(folder_ids, query):
+    from app import postings
+    return postings.top(folder_ids, query, 1000)[0]
+
+def search_group(group_id, query):
+    from app import postings
+    return postings.top_group(group_id, query, 1000)[0]
+
+"""
+Test Postings Index:
+1. Titles are indexed per resource, adding one keeps the others (the tree lost them)
+2. Replacing a field only rewrites that field's postings
+3. Lookups read only the query terms of the given folders
+4. Search ranks resources matching more query words first, across folders
+5. Removing a resource or a folder removes its postings
+"""
+def test_postings_index(app, client):
+    from app import postings
+    from app.views import grp
+    with app.app_context():
+        folders = [models.Folder(title="Index " + str(n)) for n in range(2)]
+        db.session.add_all(folders)
+        db.session.commit()
+        resources = [
+            models.Resource(title="Gaussian Elimination", folder=folders[0].id, type="notes", data=""),
+            models.Resource(title="Linear Systems", folder=folders[0].id, type="notes", data=""),
+            models.Resource(title="Gaussian Processes", folder=folders[1].id, type="notes", data=""),
+        ]
+        db.session.add_all(resources)
+        db.session.commit()
+        ids = [resource.id for resource in resources]
+        try:
+            # 1. Titles
+            for resource in resources:
+                grp.add_res_title_tree(resource.title, resource.folder, resource.id)
+            assert [id for id, _ in search([folders[0].id], "gaussian")] == [ids[0]]
+            assert [id for id, _ in search([folders[0].id], "systems")] == [ids[1]]
+
+            # 2. Fields
+            postings.set_field(folders[0].id, ids[1], "keyword", ["row reduction", "linear systems of equations"])
+            db.session.commit()
+            before = {(p.term, p.field): p.tf for p in models.Posting.query.filter_by(resource=ids[1]).all()}
+            assert before[("linear", "keyword")] == 1 and before[("system", "title")] == 1
+            postings.set_field(folders[0].id, ids[1], "title", ["Linear Linear Algebra"])
+            db.session.commit()
+            after = {(p.term, p.field): p.tf for p in models.Posting.query.filter_by(resource=ids[1]).all()}
+            assert after[("linear", "title")] == 2 and ("system", "title") not in after
+            assert after[("row", "keyword")] == 1 and after[("system", "keyword")] == 1
+
+            # 3. Lookups
+            terms = postings.stems("Gaussian row")
+            found = postings.indexes([folders[0].id], terms)
+            assert sorted((term, int(resource)) for index in found for term in terms if term in index.terms
+                for resource in index.terms[term][:, 0]) == [("gaussian", ids[0]), ("row", ids[1])]
+
+            # 4. Ranking
+            postings.set_field(folders[0].id, ids[0], "keyword", ["row operations"])
+            db.session.commit()
+            assert [id for id, _ in search([folders[0].id], "gaussian row")] == [ids[0], ids[1]]
+            assert [id for id, _ in search([f.id for f in folders], "gaussian")] == [ids[0], ids[2]]
+            assert search([folders[0].id], "nothing") == []
+
+            # 5. Removal
+            postings.remove(ids[0])
+            db.session.commit()
+            assert [id for id, _ in search([folders[0].id], "gaussian row")] == [ids[1]]
+            postings.remove_folder(folders[1].id)
+            db.session.commit()
+            assert models.Posting.query.filter_by(folder=folders[1].id).count() == 0
+        finally:
+            models.Posting.query.filter(models.Posting.resource.in_(ids)).delete(synchronize_session=False)
+            models.Resource.query.filter(models.Resource.id.in_(ids)).delete(synchronize_session=False)
+            models.Folder.query.filter(models.Folder.id.in_([f.id for f in folders])).delete(synchronize_session=False)
+            db.session.commit()
+
+"""
+Test Search Index Cache:
+1. Repeat searches of a folder are answered without loading its postings again
+2. Writing to a folder bumps its version, the next search loads the new postings
+3. Folders without a SearchTree row are read from the postings table
+4. Entries are evicted least recently used past the memory budget
+5. Hit rate and resident size are shown on the admin page and json endpoint
+"""
+def test_index_cache(app, client, monkeypatch):
+    from app import postings, indexcache
+    monkeypatch.setattr(indexcache, "_caches", {})
+    loads = []
+    load = postings.load
+    monkeypatch.setattr(postings, "load", lambda folder_id: loads.append(folder_id) or load(folder_id))
+    with app.app_context():
+        folders = [models.Folder(title="Cache " + str(n)) for n in range(3)]
+        db.session.add_all(folders)
+        db.session.commit()
+        folder_ids = [folder.id for folder in folders]
+        db.session.add_all([models.SearchTree(folder=id, json="") for id in folder_ids[:2]])
+        resources = [models.Resource(title="Fourier Transform " + str(n), folder=id, type="notes", data="")
+            for n, id in enumerate(folder_ids)]
+        db.session.add_all(resources)
+        db.session.commit()
+        ids = [resource.id for resource in resources]
+        try:
+            for resource in resources:
+                postings.set_field(resource.folder, resource.id, "title", [resource.title])
+            db.session.commit()
+            version = models.SearchTree.query.filter_by(folder=folder_ids[0]).first().version
+
+            # 1. Repeat searches
+            assert [id for id, _ in search([folder_ids[0]], "fourier")] == [ids[0]]
+            assert [id for id, _ in search([folder_ids[0]], "transform")] == [ids[0]]
+            assert loads == [folder_ids[0]]
+            assert indexcache.stats()["hits"] == 1 and indexcache.stats()["misses"] == 1
+
+            # 2. Version bump
+            postings.set_field(folder_ids[0], ids[0], "keyword", ["fast convolution"])
+            db.session.commit()
+            assert models.SearchTree.query.filter_by(folder=folder_ids[0]).first().version > version
+            assert [id for id, _ in search([folder_ids[0]], "convolution")] == [ids[0]]
+            assert loads == [folder_ids[0], folder_ids[0]]
+            postings.remove(ids[0])
+            db.session.commit()
+            assert search([folder_ids[0]], "convolution") == []
+
+            # 3. No SearchTree row
+            assert [id for id, _ in search([folder_ids[2]], "fourier")] == [ids[2]]
+            assert folder_ids[2] not in loads
+
+            # 4. Eviction
+            postings.set_field(folder_ids[0], ids[0], "title", [resources[0].title])
+            db.session.commit()
+            search([folder_ids[0]], "fourier")
+            size = indexcache.estimate(postings.load(folder_ids[1]))
+            monkeypatch.setitem(app.config, "INDEX_CACHE_BYTES", size + 1)
+            search(folder_ids[:2], "fourier")
+            stats = indexcache.stats()
+            assert stats["folders"] == 1 and stats["bytes"] <= size + 1 and stats["evictions"] >= 1
+
+            # 5. Admin page
+            assert b"Hit rate" in client.get("/admin/searchindex/").data
+            assert client.get("/admin/searchindex/stats").get_json()["misses"] >= 3
+        finally:
+            models.Posting.query.filter(models.Posting.resource.in_(ids)).delete(synchronize_session=False)
+            models.Resource.query.filter(models.Resource.id.in_(ids)).delete(synchronize_session=False)
+            models.SearchTree.query.filter(models.SearchTree.folder.in_(folder_ids)).delete(synchronize_session=False)
+            models.Folder.query.filter(models.Folder.id.in_(folder_ids)).delete(synchronize_session=False)
+            db.session.commit()
+
+"""
+Test Group Index:
+1. Postings carry the group of their folder
+2. A group search is one lookup of the group's postings, whatever the folder count
+3. Adding and removing resources bumps the group version and the search sees it
+4. Without the cache the group's postings are queried directly
+"""
+def test_group_index(app, monkeypatch):
+    from app import postings, indexcache
+    monkeypatch.setattr(indexcache, "_caches", {})
+    loads = []
+    load_group = postings.load_group
+    monkeypatch.setattr(postings, "load_group", lambda group_id: loads.append(group_id) or load_group(group_id))
+    with app.app_context():
+        group = models.Group(title="Index Group", code="INDEXGRP23")
+        db.session.add(group)
+        db.session.commit()
+        folders = [models.Folder(title="Index " + str(n), group=group.id) for n in range(5)]
+        db.session.add_all(folders)
+        db.session.commit()
+        folder_ids = [folder.id for folder in folders]
+        db.session.add_all([models.SearchTree(folder=id, json="") for id in folder_ids[:3]])
+        resources = [models.Resource(title="Laplace Transform " + str(n), folder=id, type="notes", data="")
+            for n, id in enumerate(folder_ids)]
+        db.session.add_all(resources)
+        db.session.commit()
+        ids = [resource.id for resource in resources]
+        try:
+            for resource in resources:
+                postings.set_field(resource.folder, resource.id, "title", [resource.title])
+            db.session.commit()
+
+            # 1. Group column
+            assert {row.group for row in models.Posting.query.filter(models.Posting.resource.in_(ids))} == {group.id}
+
+            # 2. One lookup
+            assert [resource for resource, _ in search_group(group.id, "laplace")] == ids
+            assert search_group(group.id, "laplace transform")[0][1] > search_group(group.id, "laplace")[0][1]
+            assert loads == [group.id]
+            assert indexcache.stats()["groups"] == 1
+
+            # 3. Version bump
+            version = db.session.get(models.Group, group.id).index_version
+            postings.set_field(folder_ids[4], ids[4], "keyword", ["z transform"])
+            postings.remove(ids[0])
+            db.session.commit()
+            db.session.expire_all()
+            assert db.session.get(models.Group, group.id).index_version > version
+            assert [resource for resource, _ in search_group(group.id, "laplace")] == ids[1:]
+            assert [id for id, _ in search_group(group.id, "z")] == [ids[4]]
+            assert loads == [group.id, group.id]
+            postings.remove_folder(folder_ids[1])
+            db.session.commit()
+            assert ids[1] not in [resource for resource, _ in search_group(group.id, "laplace")]
+
+            # 4. No cache
+            monkeypatch.setitem(app.config, "INDEX_CACHE_BYTES", 0)
+            assert [resource for resource, _ in search_group(group.id, "laplace")] == ids[2:]
+            assert len(loads) == 3
+        finally:
+            models.Posting.query.filter(models.Posting.resource.in_(ids)).delete(synchronize_session=False)
+            models.Resource.query.filter(models.Resource.id.in_(ids)).delete(synchronize_session=False)
+            models.SearchTree.query.filter(models.SearchTree.folder.in_(folder_ids)).delete(synchronize_session=False)
+            models.Folder.query.filter(models.Folder.id.in_(folder_ids)).delete(synchronize_session=False)
+            models.Group.query.filter_by(id=group.id).delete(synchronize_session=False)
+            db.session.commit()
+
+"""
+Test BM25 Ranking:
+1. Postings store the length of their field
+2. A title match outranks a keyword match, a short field outranks a long one
+3. Rare terms weigh more than common ones
+4. Scores follow the BM25 formula, cached or read from the postings table
+5. A field weighted 0 doesn't match
+"""
+def test_bm25_ranking(app, monkeypatch):
+    import math
+    from app import postings, indexcache
+    monkeypatch.setattr(indexcache, "_caches", {})
+    monkeypatch.setitem(app.config, "SEARCH_FIELD_WEIGHTS", {"title": 3.0, "heading": 2.0, "keyword": 1.0})
+    with app.app_context():
+        folder = models.Folder(title="Ranking")
+        db.session.add(folder)
+        db.session.commit()
+        db.session.add(models.SearchTree(folder=folder.id, json=""))
+        resources = [models.Resource(title="Ranking " + str(n), folder=folder.id, type="notes", data="") for n in range(4)]
+        db.session.add_all(resources)
+        db.session.commit()
+        ids = [resource.id for resource in resources]
+        try:
+            postings.set_field(folder.id, ids[0], "title", ["Matrix Rank"])
+            postings.set_field(folder.id, ids[1], "keyword", ["matrix", "eigenvalue"])
+            postings.set_field(folder.id, ids[2], "title", ["Matrix Calculus and Differential Forms of Tensors"])
+            postings.set_field(folder.id, ids[3], "title", ["Eigenvalue Problems"])
+            db.session.commit()
+
+            # 1. Lengths
+            assert {p.length for p in models.Posting.query.filter_by(resource=ids[2])} == {7}
+
+            # 2. Fields and lengths
+            ranked = search([folder.id], "matrix")
+            assert [id for id, _ in ranked] == [ids[0], ids[2], ids[1]]
+
+            # 3. Rare terms
+            ranked = dict(search([folder.id], "matrix rank"))
+            assert ranked[ids[0]] - ranked[ids[2]] > ranked[ids[2]] - ranked[ids[1]]
+
+            # 4. Formula, title lengths 2, 7 and 2 (avg 11/3), resource 3 matches "eigenvalue" once in its title
+            tf = 3.0 / (1 - 0.75 + 0.75 * 2 / (11 / 3))
+            keyword_tf = 1.0 / (1 - 0.75 + 0.75 * 2 / 2)
+            idf = math.log(1 + (4 - 2 + 0.5) / (2 + 0.5))
+            expected = {
+                ids[3]: round(idf * tf * 2.2 / (1.2 + tf), 4),
+                ids[1]: round(idf * keyword_tf * 2.2 / (1.2 + keyword_tf), 4),
+            }
+            assert dict(search([folder.id], "eigenvalues")) == expected
+            monkeypatch.setitem(app.config, "INDEX_CACHE_BYTES", 0)
+            assert dict(search([folder.id], "eigenvalues")) == expected
+
+            # 5. Field weights
+            monkeypatch.setitem(app.config, "SEARCH_FIELD_WEIGHTS", {"keyword": 1.0})
+            assert [id for id, _ in search([folder.id], "matrix")] == [ids[1]]
+        finally:
+            models.Posting.query.filter(models.Posting.resource.in_(ids)).delete(synchronize_session=False)
+            models.Resource.query.filter(models.Resource.id.in_(ids)).delete(synchronize_session=False)
+            models.SearchTree.query.filter_by(folder=folder.id).delete(synchronize_session=False)
+            models.Folder.query.filter_by(id=folder.id).delete(synchronize_session=False)
+            db.session.commit()
+
+"""
+Test Top K Search:
+1. Every page of top() matches the same slice of the full ranking
+2. The last page says there are no more results
+3. The search routes return one page with links to the others
+4. Only the page's resources are loaded, in a fixed number of queries
+5. The folder listing, sharing the results template, has no page links
+6. Terms that can't lift a new resource onto the page are only scored on the candidates
+7. Resources tied at the floor are kept, with ties and without
+"""
+def test_top_k_search(app, client, monkeypatch):
+    from app import postings, ranking
+    from sqlalchemy import event
+    with app.app_context():
+        user = models.User(email="topk@example.com", activated=True)
+        db.session.add(user)
+        db.session.commit()
+        group = models.Group(title="Top K", code="TOPKGROUP25", owner=user.id)
+        db.session.add(group)
+        db.session.commit()
+        folder = models.Folder(title="Top K", group=group.id)
+        db.session.add(folder)
+        db.session.commit()
+        db.session.add(models.SearchTree(folder=folder.id, json=""))
+        words = ["matrix", "vector", "tensor", "scalar", "basis"]
+        resources = [models.Resource(title=" ".join(words[:1 + n % 5]) + " " + str(n), folder=folder.id, type="notes", data="",
+            creator=user.id) for n in range(45)]
+        db.session.add_all(resources)
+        db.session.commit()
+        ids = [resource.id for resource in resources]
+        titles = [resource.title for resource in resources]
+        user_id, group_id, folder_id = user.id, group.id, folder.id
+    statements = []
+    def count(*args):
+        statements.append(args[2])
+    try:
+        with app.app_context():
+            for n, id in enumerate(ids):
+                postings.set_field(folder_id, id, "title", [titles[n]])
+                postings.set_field(folder_id, id, "keyword", words[n % 3:n % 3 + 2])
+            db.session.add(models.Review(resource=ids[44], rating=4))
+            db.session.add(models.Review(resource=ids[44], rating=5))
+            db.session.commit()
+
+            # 1. Pages
+            def rank(query):
+                words = postings.stems(query)
+                return ranking.rank(postings.indexes([folder_id], words), words, postings.FIELDS)
+            for query in ["matrix", "basis scalar", "vector tensor basis", "matrix vector vector", "nothing"]:
+                ranked = rank(query)
+                for k, offset in [(5, 0), (5, 5), (20, 20), (20, 40), (7, 43), (3, 100)]:
+                    page, more = postings.top([folder_id], query, k, offset)
+                    assert page == ranked[offset:offset + k]
+                    assert more == (len(ranked) > offset + k)
+                assert postings.top_group(group_id, query, 10)[0] == ranked[:10]
+
+            # 2. Last page
+            assert postings.top([folder_id], "matrix", 20, 40) == (rank("matrix")[40:], False)
+
+        with client.session_transaction() as session:
+            session["_user_id"] = str(user_id)
+
+        # 3. Routes
+        with app.app_context():
+            event.listen(db.engine, "before_cursor_execute", count)
+        first = client.get("/folder/search", query_string=dict(folder_id=folder_id, query="matrix"))
+        assert first.data.count(b"res-wrapper") == 20
+        assert b"handleSearch(20)" in first.data and b"Previous" not in first.data
+        last = client.get("/group/search", query_string=dict(group_id=group_id, query="matrix", offset=40))
+        assert last.data.count(b"res-wrapper") == 5
+        assert b"handleSearch(20)" in last.data and b"More results" not in last.data
+        assert b"4.5/5" in client.get("/folder/search", query_string=dict(folder_id=folder_id, query="basis 44")).data
+
+        # 4. Queries
+        statements.clear()
+        client.get("/folder/search", query_string=dict(folder_id=folder_id, query="matrix", offset=20))
+        assert sum(1 for statement in statements if "FROM resource" in statement) == 1
+        assert len(statements) < 15
+
+        # 5. Folder listing
+        listing = client.get("/resources", query_string=dict(folder=folder_id, type="Admin"))
+        assert listing.data.count(b"res-wrapper") == 45
+        assert b"handleSearch" not in listing.data and b"More results" not in listing.data and b"Previous" not in listing.data
+
+        # 6. Pruning
+        rng = np.random.default_rng(0)
+        index = postings.Index([(term, int(resource), field, int(rng.integers(1, 4)), 5)
+            for term, field, count in [("rare", "title", 50), ("common", "keyword", 1500), ("usual", "keyword", 1500)]
+            for resource in rng.choice(2000, count, replace=False)])
+        scored = []
+        score_postings = ranking.score_postings
+        monkeypatch.setattr(ranking, "score_postings", lambda scope, rows, idf, count: scored.append(len(rows)) or score_postings(scope, rows, idf, count))
+        with app.app_context():
+            ranked = ranking.rank([index], ["rare", "common", "usual"], postings.FIELDS)
+            scored.clear()
+            page, more = ranking.top([index], ["rare", "common", "usual"], postings.FIELDS, 10)
+        assert page == ranked[:10] and more
+        assert scored[0] == 50 and sum(scored) < 3050 / 2
+        monkeypatch.setattr(ranking, "score_postings", score_postings)
+
+        # 7. Ties
+        tied = postings.Index([(term, resource, "title", 1, 2) for resource in range(30) for term in ["lectur", "note"]]
+            + [("graph", resource, "keyword", 1, 1) for resource in range(10)])
+        cases = [(tied, ["graph", "lectur", "note"])]
+        for seed in range(20):
+            rng = np.random.default_rng(seed)
+            cases.append((postings.Index([(term, int(resource), str(rng.choice(postings.FIELDS)), int(rng.integers(1, 4)),
+                int(rng.integers(1, 9))) for term in "abcd" for resource in rng.choice(200, int(rng.integers(5, 120)), replace=False)]),
+                list(rng.choice(list("abcd"), int(rng.integers(1, 5))))))
+        with app.app_context():
+            for index, terms in cases:
+                ranked = ranking.rank([index], terms, postings.FIELDS)
+                for k, offset in [(5, 0), (10, 10), (20, 0), (20, 20)]:
+                    assert ranking.top([index], terms, postings.FIELDS, k, offset) == (ranked[offset:offset + k], len(ranked) > offset + k)
+            assert len(ranking.rank([tied], ["graph", "lectur", "note"], postings.FIELDS)) == 30
+    finally:
+        with app.app_context():
+            if event.contains(db.engine, "before_cursor_execute", count):
+                event.remove(db.engine, "before_cursor_execute", count)
+            models.Review.query.filter(models.Review.resource.in_(ids)).delete(synchronize_session=False)
+            models.Posting.query.filter(models.Posting.resource.in_(ids)).delete(synchronize_session=False)
+            models.Resource.query.filter(models.Resource.id.in_(ids)).delete(synchronize_session=False)
+            models.SearchTree.query.filter_by(folder=folder_id).delete(synchronize_session=False)
+            models.Folder.query.filter_by(id=folder_id).delete(synchronize_session=False)
+            models.Group.query.filter_by(id=group_id).delete(synchronize_session=False)
+            models.User.query.filter_by(id=user_id).delete(synchronize_session=False)
+            db.session.commit()
+
+"""
+Test Transcript Extraction:
+1. txt transcripts stream line by line
+2. vtt transcripts stream caption by caption, without timestamps
+3. prepare_transcript joins the stream into one string
+4. Keywords are extracted from a transcript through the sandbox
+"""
+def test_transcript_extraction(app, monkeypatch, tmp_path):
+    from app import pipeline, registry
+    txt = tmp_path / "lecture.txt"
+    txt.write_text("Eigenvalues of a matrix\nDiagonalization of symmetric matrices\n")
+    vtt = tmp_path / "lecture.vtt"
+    vtt.write_text("WEBVTT\n\n00:00:00.000 --> 00:00:02.000\nEigenvalues of a matrix\n\n"
+        "00:00:02.000 --> 00:00:04.000\nDiagonalization of symmetric matrices\n")
+    text_resource = models.Resource(data=str(txt), type="transcript")
+    caption_resource = models.Resource(data=str(vtt), type="transcript")
+
+    # 1. txt
+    assert list(pipeline.iter_transcript(text_resource)) == ["Eigenvalues of a matrix\n", "Diagonalization of symmetric matrices\n"]
+
+    # 2. vtt
+    captions = list(pipeline.iter_transcript(caption_resource))
+    assert captions == ["Eigenvalues of a matrix", "Diagonalization of symmetric matrices"]
+
+    # 3. Joined
+    assert pipeline.prepare_transcript(caption_resource) == "Eigenvalues of a matrix Diagonalization of symmetric matrices"
+
+    # 4. Keywords
+    monkeypatch.setattr(registry, "_model", FakeKeyBERT())
+    keywords = pipeline.keybert_exec(pipeline.sandboxed(pipeline.iter_transcript, text_resource))
+    assert keywords and all(isinstance(keyword, str) for keyword in keywords)
+
+"""
+Test Done Job Retention:
+1. Completing a job deletes done jobs past the retention window
+2. Recent done jobs and dead jobs are kept
+3. Claims and resource lookups use the queue indexes
+"""
+def test_done_job_retention(app, monkeypatch):
+    from app import jobs
+    from datetime import datetime, timedelta
+    monkeypatch.setitem(app.config, "JOB_DONE_RETENTION_HOURS", 24)
+    with app.app_context():
+        old, recent, dead, current = [jobs.enqueue(920000 + n) for n in range(4)]
+        ids = [old.id, recent.id, dead.id, current.id]
+        try:
+            old.state, old.finished = "done", datetime.now() - timedelta(hours=25)
+            recent.state, recent.finished = "done", datetime.now() - timedelta(hours=1)
+            dead.state, dead.finished = "dead", datetime.now() - timedelta(hours=48)
+            db.session.commit()
+
+            # 1. Old done jobs
+            jobs.complete(current)
+            db.session.commit()
+            remaining = {job.id for job in models.Queue.query.filter(models.Queue.id.in_(ids)).all()}
+            assert ids[0] not in remaining
+
+            # 2. Kept
+            assert remaining == set(ids[1:])
+
+            # 3. Indexes
+            indexes = {index.name for index in models.Queue.__table__.indexes}
+            assert {"ix_queue_resource", "ix_queue_state_stage_available", "ix_queue_state_finished"} <= indexes
+            plan = " ".join(str(row) for row in db.session.execute(db.text(
+                "EXPLAIN QUERY PLAN SELECT id FROM queue WHERE resource = 920001 AND state IN ('queued', 'running')")))
+            assert "ix_queue_resource" in plan
+        finally:
+            models.Queue.query.filter(models.Queue.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+
+"""
+Test Model Preload Per Queue:
+1. Workers consuming only the io queue don't load the model
+2. Workers consuming the cpu queue, or every queue, load it
+"""
+def test_preload_per_queue(app, monkeypatch):
+    from app import registry, extractors
+    from celery.app.amqp import Queues
+    from types import SimpleNamespace
+    loads = []
+    monkeypatch.setattr(registry, "load_model", lambda: loads.append(True))
+    monkeypatch.setattr(extractors, "uses_model", lambda: True)
+    monkeypatch.setitem(app.config, "KEYBERT_PRELOAD", True)
+    monkeypatch.setitem(app.config, "INFERENCE_ADDRESS", None)
+
+    def worker(queues):
+        declared = Queues({})
+        if queues:
+            declared.select(queues)
+        return SimpleNamespace(app=SimpleNamespace(amqp=SimpleNamespace(queues=declared)))
+
+    # 1. io only
+    registry.preload_model(sender=worker(["io"]))
+    assert loads == []
+
+    # 2. cpu, every queue
+    registry.preload_model(sender=worker(["cpu"]))
+    registry.preload_model(sender=worker(["io", "cpu"]))
+    registry.preload_model(sender=worker(None))
+    assert len(loads) == 3
+
+"""
+Test Model Stats:
+1. The admin pipeline page shows this process's model, warm or cold, load time and rss
+2. The json endpoint returns the same stats
+3. Workers answer the model_stats remote control command with theirs, shown while tasks go to celery
+"""
+def test_model_stats(app, client, monkeypatch):
+    from app import registry, tasks, celery
+    from celery.worker.control import Panel
+    monkeypatch.setattr(tasks, "backend", lambda: "local")
+    monkeypatch.setattr(registry, "_model", None)
+    monkeypatch.setitem(registry._stats, "load_seconds", None)
+
+    # 1. Admin page
+    page = client.get("/admin/pipeline/").data
+    assert b"Keyword Model" in page and b"cold" in page
+    monkeypatch.setattr(registry, "_model", FakeKeyBERT())
+    monkeypatch.setitem(registry._stats, "model", "fake-model")
+    monkeypatch.setitem(registry._stats, "backend", "local")
+    monkeypatch.setitem(registry._stats, "load_seconds", 1.25)
+    page = client.get("/admin/pipeline/").data
+    assert b"fake-model" in page and b"warm" in page and b"1.25" in page
+
+    # 2. Json
+    data = client.get("/admin/pipeline/model").get_json()
+    assert data["workers"] == {}
+    assert data["local"]["warm"] and data["local"]["load_seconds"] == 1.25
+    assert data["local"]["rss_bytes"] > 0 and data["local"]["pid"] == os.getpid()
+
+    # 3. Workers
+    assert Panel.meta["model_stats"].type == "inspect"
+    reply = Panel.data["model_stats"](None)
+    assert reply["model"] == "fake-model" and reply["warm"]
+    broadcasts = []
+    def broadcast(command, reply=False, timeout=None):
+        broadcasts.append(command)
+        return [{"cpu@worker": dict(Panel.data[command](None), pid=4242)}]
+    monkeypatch.setattr(celery.control, "broadcast", broadcast)
+    monkeypatch.setattr(tasks, "backend", lambda: "celery")
+    assert client.get("/admin/pipeline/model").get_json()["workers"]["cpu@worker"]["pid"] == 4242
+    page = client.get("/admin/pipeline/").data
+    assert b"cpu@worker" in page and b"4242" in page
+    assert broadcasts == ["model_stats", "model_stats"]